@@ -1,17 +1,11 @@
-import torch 
 import streamlit as st
-from app.services.pdf_processor import extract_text_from_pdf, process_zip_invoices
-from app.services.llm_service import InvoiceAnalyzer
-from app.services.vector_store import VectorStore
-import tempfile
-import uuid
+from app.services.pdf_processor import iter_zip_invoices
+from app.services.pipeline import stream_analysis_records, iter_sync
+from app.services import resources
 import os
 import sys
 import asyncio
 from pathlib import Path
-# Add this before initializing VectorStore in your app.py
-import shutil
-shutil.rmtree("./chroma_db", ignore_errors=True)  # Remove old database
 
 os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
 
@@ -21,10 +15,19 @@ if sys.platform == "win32":
 
 sys.path.append(str(Path(__file__).parent))
 
+@st.cache_resource(show_spinner="Loading models...")
+def load_components():
+    """Built once per process; Streamlit reruns reuse the same instances"""
+    resources.warm_up()
+    analyzer = resources.get_analyzer()
+    vector_db = resources.get_vector_store()
+    # Same pipeline as the API: uploads are checked against and recorded in the dedup index
+    pipeline = resources.get_pipeline()
+    return analyzer, vector_db, resources.get_policy_registry(), pipeline, resources.get_retriever()
+
 # Initialize components with error handling
 try:
-    analyzer = InvoiceAnalyzer()
-    vector_db = VectorStore()
+    analyzer, vector_db, policy_registry, pipeline, retriever = load_components()
 except Exception as e:
     st.error(f"Failed to initialize system: {str(e)}")
     st.stop()  # Prevent further execution
@@ -47,35 +50,35 @@ with tab1:
         else:
             with st.spinner("Processing..."):
                 try:
-                    # Process policy
-                    policy_text = extract_text_from_pdf(policy_pdf)
-                    
-                    # Process invoices
-                    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                        tmp.write(invoices_zip.getvalue())
-                        invoices = process_zip_invoices(tmp.name)
+                    # Process policy (cached by content hash across reruns)
+                    policy = policy_registry.get_or_parse(policy_pdf.getvalue())
                     
-                    # Analyze each invoice
-                    for filename, invoice_file in invoices:
-                        invoice_text = extract_text_from_pdf(invoice_file)
-                        analysis = analyzer.analyze_invoice(policy_text, invoice_text)
-                        
-                        # Store in vector DB
-                        invoice_id = f"inv-{uuid.uuid4().hex[:6]}"
-                        vector_db.store_analysis(
-                            invoice_id=invoice_id,
-                            invoice_text=invoice_text,
-                            analysis=analysis,
-                            employee_name=employee_name
-                        )
-                        
-                        # Display results
-                        st.success(f"Processed {filename}")
-                        st.json({
-                            "Status": analysis.status.value,
-                            "Amount Reimbursed": f"₹{analysis.reimbursed_amount}",
-                            "Reason": analysis.reason
-                        })
+                    # Render each invoice as soon as the pipeline finishes it
+                    records = stream_analysis_records(
+                        pipeline, policy, iter_zip_invoices(invoices_zip), employee_name
+                    )
+                    for record in iter_sync(records):
+                        if record["type"] == "summary":
+                            st.info(
+                                f"Processed {record['processed_invoices']} invoices, "
+                                f"{record['failed_invoices']} failed, "
+                                f"{record['duplicate_invoices']} duplicates skipped, "
+                                f"₹{record['total_reimbursed']} reimbursed"
+                            )
+                        elif record["status"] == "Failed":
+                            st.error(f"Failed {record['filename']}: {record['reason']}")
+                        elif record["status"] == "Duplicate":
+                            st.warning(f"Skipped {record['filename']}: {record['reason']}")
+                        else:
+                            st.success(f"Processed {record['filename']}")
+                            st.json({
+                                "Invoice ID": record["invoice_id"],
+                                "Status": record["status"],
+                                "Amount Reimbursed": f"₹{record['reimbursed_amount']}",
+                                "Reason": record["reason"]
+                            })
+                            for warning in record.get("warnings", []):
+                                st.warning(f"{record['filename']}: {warning}")
                 
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
@@ -83,8 +86,9 @@ with tab1:
 with tab2:
     st.header("Query Invoices")
     query = st.text_input("Ask about invoices")
+    k = st.slider("Results", min_value=1, max_value=resources.RETRIEVER_MAX_K, value=resources.RETRIEVER_K)
     if st.button("Search"):
-        results = vector_db.search(query)
+        results = retriever.search(query, k=k)["results"]
         for doc in results:
-            with st.expander(f"Result {doc['metadata']['invoice_id']}"):
+            with st.expander(f"Result {doc['id']}"):
                 st.write(doc['document'])
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""Maintenance commands for the persistent vector store
+
+    python -m app.cli info
+    python -m app.cli snapshot backups/analyses.jsonl.gz
+    python -m app.cli restore backups/analyses.jsonl.gz [--replace]
+    EMBEDDING_MODEL=all-mpnet-base-v2 python -m app.cli reembed
+    python -m app.cli reporting-rebuild
+
+Paths and the embedding model come from the same environment variables as
+the API (CHROMA_PATH, CHROMA_HOST, EMBEDDING_MODEL, EMBEDDING_BACKEND,
+REPORTING_DB_PATH, DEDUP_DB_PATH). ``restore`` updates the dedup index and the
+reporting mirror along with the collection. ``restore`` and ``reembed`` claim
+a local Chroma directory like the API does, so they refuse to run while it is
+being served.
+"""
+import argparse
+import json
+import time
+
+from app.services import resources
+from app.services.vector_store import VectorStore
+
+
+def open_store(verify_embedding_model: bool = True, exclusive: bool = False) -> VectorStore:
+    return VectorStore(
+        persist_path=resources.CHROMA_PATH,
+        embedding_backend=resources.EMBEDDING_BACKEND,
+        embedding_model=resources.EMBEDDING_MODEL,
+        host=resources.CHROMA_HOST,
+        port=resources.CHROMA_PORT,
+        verify_embedding_model=verify_embedding_model,
+        exclusive=exclusive
+    )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Vector store maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="show collection schema, embedding model and size")
+    snapshot = commands.add_parser("snapshot", help="export all records to a gzipped JSONL file")
+    snapshot.add_argument("path")
+    restore = commands.add_parser("restore", help="load a snapshot (re-embedding if the model differs)")
+    restore.add_argument("path")
+    restore.add_argument("--replace", action="store_true", help="drop existing records first")
+    reembed = commands.add_parser("reembed", help="re-embed every record with the configured model")
+    reembed.add_argument("--model", help="embedding model (default: EMBEDDING_MODEL)")
+    reembed.add_argument("--backend", help="embedding backend (default: EMBEDDING_BACKEND)")
+    reembed.add_argument("--batch-size", type=int, default=256)
+    commands.add_parser("reporting-rebuild", help="reload the DuckDB reporting table from the collection")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.command == "info":
+        report = open_store(verify_embedding_model=False).info()
+    elif args.command == "snapshot":
+        report = open_store(verify_embedding_model=False).snapshot(args.path)
+    elif args.command == "restore":
+        # Same wiring as the API, so the dedup index and reporting mirror follow the restore
+        store = resources.get_vector_store()
+        dedup = resources.get_dedup_index()
+        try:
+            report = {"restored": store.restore(args.path, replace=args.replace), **store.info()}
+            if dedup is not None:
+                report["dedup_entries"] = len(dedup)
+        finally:
+            resources.reset()
+    elif args.command == "reembed":
+        # Swaps the collection, so no other process may hold it open
+        store = open_store(verify_embedding_model=False, exclusive=True)
+        report = {"reembedded": store.reembed(args.model, args.backend, args.batch_size), **store.info()}
+    else:
+        from app.services.reporting import ReportingStore
+        reporting = ReportingStore(resources.REPORTING_DB_PATH)
+        report = {"path": reporting.path, "rows": reporting.rebuild(open_store(verify_embedding_model=False))}
+        reporting.close()
+    report["elapsed_s"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
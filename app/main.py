@@ -1,114 +1,314 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from services.pdf_processor import extract_text_from_pdf, process_zip_invoices, extract_amounts_from_text
-from services.llm_service import InvoiceAnalyzer
-from services.vector_store import VectorStore
-from models.schemas import InvoiceAnalysisRequest, ChatRequest, AnalysisResult,InvoiceResponse,ChatResponse
-from typing import List
-import uuid
-from datetime import datetime
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from app.services.pdf_processor import iter_zip_invoices, ZipLimitError
+from app.services.pipeline import stream_analysis_records, summarize_results
+from app.services.chat_context import next_history
+from app.services.llm_gateway import LLMUnavailableError
+from app.services import telemetry
+from app.services.resources import get_analyzer, get_chatbot, get_dedup_index, get_job_queue, get_pipeline, get_policy_registry, get_reporting_store, get_response_cache, get_retriever, get_rule_engine, get_vector_store
+from app.services import resources
+from app.models.schemas import ChatRequest
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import itertools
+import json
+import zipfile
+from datetime import date
 import os
 import uvicorn
-import requests
 
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model and build clients once, before the first request
+    if os.getenv("WARM_UP_ON_STARTUP", "1") == "1":
+        await run_in_threadpool(resources.warm_up)
+    job_queue = None
+    if os.getenv("JOB_WORKERS", "1") != "0":
+        job_queue = await run_in_threadpool(get_job_queue)
+        await job_queue.start()
+    yield
+    if job_queue is not None:
+        await job_queue.stop()
+    resources.reset()
+
 app = FastAPI(
     title="IAI Solution Invoice Reimbursement System",
     description="Automated invoice analysis against company policy",
-    version="1.0"
+    version="1.0",
+    lifespan=lifespan
 )
+if telemetry.enabled():
+    app.add_middleware(telemetry.TelemetryMiddleware)
+
+async def _prepare_batch(policy_pdf: UploadFile, invoices_zip: UploadFile):
+    """Validate uploads and return (policy, lazy invoice iterator)"""
+    if not policy_pdf.filename.endswith('.pdf'):
+        raise HTTPException(400, "Policy file must be PDF")
+    if not invoices_zip.filename.endswith('.zip'):
+        raise HTTPException(400, "Invoices must be in ZIP file")
+
+    # Process policy (parsed once per distinct PDF, then served from the registry)
+    policy = await run_in_threadpool(get_policy_registry().get_or_parse, await policy_pdf.read())
+    if not policy.text.strip():
+        raise HTTPException(400, "Could not extract text from policy PDF")
 
-analyzer = InvoiceAnalyzer()
-vector_db = VectorStore()
+    # Invoices are decompressed lazily as pipeline workers pick them up; pulling the
+    # first one here surfaces bad archives as a 400 before any response is sent
+    invoices = iter_zip_invoices(invoices_zip.file)
+    try:
+        first = await run_in_threadpool(next, invoices, None)
+    except (ZipLimitError, zipfile.BadZipFile) as e:
+        raise HTTPException(400, f"Invalid invoices ZIP: {str(e)}")
+    if first is None:
+        raise HTTPException(400, "No PDF invoices found in ZIP file")
+    return policy, itertools.chain([first], invoices)
 
 @app.post("/analyze-invoice", response_model=dict)
 async def analyze_invoice(
     policy_pdf: UploadFile = File(..., description="Company reimbursement policy PDF"),
     invoices_zip: UploadFile = File(..., description="ZIP file containing invoice PDFs"),
     employee_name: str = Form(..., min_length=2, max_length=100),
+    bypass_cache: bool = Form(False, description="Re-run the LLM even for cached invoices (audits)"),
+    analysis_mode: str = Form("single", pattern="^(single|batch)$",
+                              description="single: one LLM call per invoice; batch: packed JSON prompts"),
 ):
     try:
-        # Validate inputs
-        response = requests.post("http://localhost:8000/analyze-invoice", json={"abc": "def"})
-        print(response.json())
-
-        if not policy_pdf.filename.endswith('.pdf'):
-            raise HTTPException(400, "Policy file must be PDF")
-        if not invoices_zip.filename.endswith('.zip'):
-            raise HTTPException(400, "Invoices must be in ZIP file")
-
-        # Process policy
-        policy_text = extract_text_from_pdf(policy_pdf.file)
-        if not policy_text:
-            raise HTTPException(400, "Could not extract text from policy PDF")
-
-        # Process invoices
-        invoices = process_zip_invoices(invoices_zip.file)
-        if not invoices:
-            raise HTTPException(400, "No PDF invoices found in ZIP file")
-
-        results = []
-        for filename, invoice_file in invoices:
-            invoice_text = extract_text_from_pdf(invoice_file)
-            if not invoice_text:
-                continue
-                
-            analysis = analyzer.analyze_invoice(policy_text, invoice_text)
-            invoice_id = f"inv-{uuid.uuid4().hex[:8]}"
-            
-            vector_db.store_analysis(
-                invoice_id=invoice_id,
-                invoice_text=invoice_text,
-                analysis=analysis,
-                employee_name=employee_name
-            )
-            
-            results.append({
-                "invoice_id": invoice_id,
-                "status": analysis.status.value,
-                "reimbursed_amount": analysis.reimbursed_amount,
-                "reason": analysis.reason
-            })
+        policy, invoices = await _prepare_batch(policy_pdf, invoices_zip)
+        results = await get_pipeline().run(
+            policy, invoices, employee_name,
+            bypass_cache=bypass_cache, batch_mode=analysis_mode == "batch"
+        )
 
         return JSONResponse({
             "status": "success",
-            "processed_invoices": len(results),
+            **summarize_results(results),
             "results": results
         })
 
+    except HTTPException:
+        raise
+    except (ZipLimitError, zipfile.BadZipFile) as e:
+        raise HTTPException(400, f"Invalid invoices ZIP: {str(e)}")
     except Exception as e:
         raise HTTPException(500, f"Processing error: {str(e)}")
 
+@app.post("/analyze-invoice/stream")
+async def analyze_invoice_stream(
+    policy_pdf: UploadFile = File(..., description="Company reimbursement policy PDF"),
+    invoices_zip: UploadFile = File(..., description="ZIP file containing invoice PDFs"),
+    employee_name: str = Form(..., min_length=2, max_length=100),
+    bypass_cache: bool = Form(False, description="Re-run the LLM even for cached invoices (audits)"),
+    analysis_mode: str = Form("single", pattern="^(single|batch)$",
+                              description="single: one LLM call per invoice; batch: packed JSON prompts"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$", description="ndjson or sse"),
+):
+    """Stream one record per invoice as it finishes, then a summary record"""
+    policy, invoices = await _prepare_batch(policy_pdf, invoices_zip)
+    records = stream_analysis_records(
+        get_pipeline(), policy, invoices, employee_name,
+        bypass_cache=bypass_cache, batch_mode=analysis_mode == "batch"
+    )
+
+    async def body():
+        try:
+            async for record in records:
+                yield _encode_record(record, format)
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield _encode_record({"type": "error", "reason": f"Processing error: {str(e)}"}, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+def _encode_record(record: dict, format: str) -> str:
+    payload = json.dumps(record, ensure_ascii=False)
+    if format == "sse":
+        return f"event: {record['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+@app.post("/jobs", status_code=202, response_model=dict)
+async def create_job(
+    policy_pdf: UploadFile = File(..., description="Company reimbursement policy PDF"),
+    invoices_zip: UploadFile = File(..., description="ZIP file containing invoice PDFs"),
+    employee_name: str = Form(..., min_length=2, max_length=100),
+    bypass_cache: bool = Form(False, description="Re-run the LLM even for cached invoices (audits)"),
+    analysis_mode: str = Form("single", pattern="^(single|batch)$",
+                              description="single: one LLM call per invoice; batch: packed JSON prompts"),
+):
+    """Queue a background analysis and return its job id immediately"""
+    if not policy_pdf.filename.endswith('.pdf'):
+        raise HTTPException(400, "Policy file must be PDF")
+    if not invoices_zip.filename.endswith('.zip'):
+        raise HTTPException(400, "Invoices must be in ZIP file")
+    try:
+        job = await run_in_threadpool(
+            get_job_queue().submit, await policy_pdf.read(), invoices_zip.file,
+            employee_name, analysis_mode, bypass_cache
+        )
+    except (ZipLimitError, zipfile.BadZipFile) as e:
+        raise HTTPException(400, f"Invalid invoices ZIP: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return JSONResponse({**job, "status_url": f"/jobs/{job['job_id']}"}, status_code=202)
+
+@app.get("/jobs/{job_id}", response_model=dict)
+async def get_job(job_id: str, include_results: bool = Query(True)):
+    """Progress and per-invoice results (in ZIP order) of a job"""
+    return JSONResponse(await _job_call(get_job_queue().status, job_id, include_results))
+
+@app.post("/jobs/{job_id}/cancel", response_model=dict)
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one after its in-flight invoices"""
+    return JSONResponse(await _job_call(get_job_queue().cancel, job_id))
+
+@app.post("/jobs/{job_id}/resume", response_model=dict)
+async def resume_job(job_id: str):
+    """Re-queue a failed or cancelled job; finished invoices are skipped"""
+    return JSONResponse(await _job_call(get_job_queue().resume, job_id))
+
+async def _job_call(method, job_id: str, *args):
+    try:
+        return await run_in_threadpool(method, job_id, *args)
+    except KeyError:
+        raise HTTPException(404, f"Job {job_id} not found")
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+
+@app.get("/llm-usage", response_model=dict)
+async def llm_usage():
+    """LLM throughput and estimated cost per invoice per analysis mode, plus gateway counters"""
+    analyzer = get_analyzer()
+    return JSONResponse({
+        "modes": analyzer.usage.report(),
+        "gateway": analyzer.gateway.stats()
+    })
+
+@app.get("/reports/reimbursements", response_model=dict)
+async def reimbursement_report(
+    group_by: List[str] = Query([], description="employee, status, category, day, month, year (repeat or comma-separate)"),
+    employee: List[str] = Query([]),
+    status: List[str] = Query([]),
+    category: List[str] = Query([]),
+    date_from: Optional[date] = Query(None, description="inclusive"),
+    date_to: Optional[date] = Query(None, description="inclusive"),
+    percentiles: List[float] = Query([0.5, 0.9, 0.99]),
+    metric: str = Query("reimbursed_amount", pattern="^(reimbursed_amount|requested_amount)$"),
+    limit: int = Query(1000, ge=1, le=100000)
+):
+    """Invoice counts, amount totals and percentiles grouped by employee, category, status or period"""
+    def run():
+        # Building the vector store attaches (and catches up) the reporting mirror
+        get_vector_store()
+        store = get_reporting_store()
+        if store is None:
+            raise HTTPException(503, "Reporting is disabled (REPORTING_ENABLED=0)")
+        filters = {"employee": employee, "status": status, "category": category,
+                   "date_from": date_from, "date_to": date_to}
+        dimensions = [name.strip() for value in group_by for name in value.split(",") if name.strip()]
+        return store.aggregate(dimensions, filters, percentiles=percentiles, metric=metric, limit=limit)
+
+    try:
+        report = await run_in_threadpool(run)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except ImportError:
+        raise HTTPException(503, "Reporting needs the duckdb package")
+    report["filters"] = {key: value.isoformat() if isinstance(value, date) else value
+                         for key, value in report["filters"].items() if value}
+    return JSONResponse(report)
+
+@app.get("/stats", response_model=dict)
+async def stats():
+    """Hit rates and sizes of the search, response and policy caches, and dedup counts"""
+    rule_engine = get_rule_engine()
+    dedup_index = get_dedup_index()
+    return JSONResponse({
+        "vector_store": get_vector_store().cache_stats(),
+        "retriever": get_retriever().stats(),
+        "response_cache": get_response_cache().stats(),
+        "policy_registry": get_policy_registry().stats(),
+        "rules_engine": rule_engine.stats() if rule_engine else None,
+        "dedup": dedup_index.stats() if dedup_index else None
+    })
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage, LLM token, cache and HTTP metrics in the Prometheus text format"""
+    return PlainTextResponse(telemetry.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces/{correlation_id}", response_model=dict)
+async def get_trace(correlation_id: str):
+    """Recent spans recorded under a request ID (X-Request-ID) or job ID"""
+    spans = telemetry.trace(correlation_id)
+    if not spans:
+        raise HTTPException(404, "No spans recorded for this ID")
+    return JSONResponse({"correlation_id": correlation_id, "spans": spans})
+
 @app.post("/chat", response_model=dict)
 async def chat_with_bot(request: ChatRequest):
     try:
-        # Convert status filter to enum value if present
-        filters = request.filters or {}
-        if 'status' in filters:
-            filters['status'] = filters['status'].capitalize() + " Reimbursed"
-            
-        search_results = vector_db.search(
-            query=request.query,
-            filters=filters
+        result = await get_chatbot().aquery(
+            request.query, request.history, request.filters, request.k, request.cursor
         )
-        
-        # Format context for LLM
-        context = "\n\n".join([
-            f"Document {i+1}:\n{doc['document']}\nMetadata: {doc['metadata']}"
-            for i, doc in enumerate(search_results)
-        ])
-        
-        # Generate response (in real implementation, use LLM here)
-        response = {
-            "response": f"Found {len(search_results)} matching invoices:\n\n{context}",
-            "context": request.history + [{"role": "assistant", "content": request.query}]
-        }
-        
-        return JSONResponse(response)
-        
+        return JSONResponse({
+            "response": result["response"],
+            "sources": [_source(hit) for hit in result["sources"]],
+            "context": result["history"],
+            "next_cursor": result["next_cursor"],
+            "time_to_first_token_ms": result.get("first_token_ms")
+        })
+
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid filters or cursor: {str(e)}")
+    except LLMUnavailableError as e:
+        raise HTTPException(503, f"LLM unavailable: {str(e)}")
     except Exception as e:
         raise HTTPException(500, f"Chat error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$", description="ndjson or sse"),
+):
+    """Stream a sources record, then answer tokens as they arrive, then a done record"""
+    chatbot = get_chatbot()
+    try:
+        prepared = await run_in_threadpool(
+            chatbot.prepare, request.query, request.history, request.filters, request.k, request.cursor
+        )
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid filters or cursor: {str(e)}")
+
+    async def body():
+        yield _encode_record({
+            "type": "sources",
+            "sources": [_source(hit) for hit in prepared["sources"]],
+            "next_cursor": prepared["next_cursor"]
+        }, format)
+        answer = []
+        try:
+            async for text in chatbot.astream(prepared):
+                answer.append(text)
+                yield _encode_record({"type": "token", "text": text}, format)
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield _encode_record({"type": "error", "reason": f"Chat error: {str(e)}"}, format)
+            return
+        yield _encode_record({
+            "type": "done",
+            "context": next_history(prepared["history"], request.query, "".join(answer)),
+            "time_to_first_token_ms": prepared.get("first_token_ms"),
+            "total_ms": prepared.get("total_ms")
+        }, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+def _source(hit: dict) -> dict:
+    return {"id": hit["id"], "metadata": hit.get("metadata"), "score": hit.get("score")}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel, constr
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any
 from datetime import date
 
 class ReimbursementStatus(str, Enum):
@@ -27,6 +27,41 @@ class AnalysisResult(BaseModel):
     policy_references: List[str]
     # category: ExpenseCategory
 
+class PolicyRule(BaseModel):
+    """Single reimbursement limit extracted from a policy"""
+    category: str
+    limit: float
+    unit: str
+    source: str = "policy"
+
+class PolicyClause(BaseModel):
+    """Verbatim policy sentence that qualifies the limits (condition or exclusion)"""
+    text: str
+    kind: str
+    category: Optional[str] = None
+
+class PolicyDocument(BaseModel):
+    """Preprocessed company policy, keyed by the SHA-256 of the uploaded PDF"""
+    policy_hash: str
+    text: str
+    token_count: int
+    rules: List[PolicyRule]
+    exclusions: List[str]
+    clauses: List[PolicyClause] = []
+    compact_text: str
+    compact_token_count: int
+
+class PDFExtractionResult(BaseModel):
+    """Extracted PDF text plus per-page timing"""
+    text: str
+    backend: str
+    page_count: int
+    pages_extracted: int
+    truncated: bool
+    page_timings_ms: List[float]
+    total_ms: float
+    cached: bool = False
+
 class InvoiceAnalysisRequest(BaseModel):
     """Request model for invoice analysis"""
     employee_name: constr(min_length=2, max_length=100)
@@ -36,7 +71,11 @@ class ChatRequest(BaseModel):
     """Request model for chatbot queries"""
     query: constr(min_length=3)
     history: List[Dict[str, str]] = []
-    filters: Optional[Dict[str, str]] = None
+    # e.g. {"status": "declined", "reimbursed_amount": {"gt": 1000}}; see VectorStore.search
+    filters: Optional[Dict[str, Any]] = None
+    # Results per page (capped by RETRIEVER_MAX_K) and the next_cursor of the previous page
+    k: Optional[int] = None
+    cursor: Optional[str] = None
 
 class InvoiceResponse(BaseModel):
     """Response model for invoice analysis"""
@@ -0,0 +1,107 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from app.services.text_utils import estimate_tokens, sha256_text
+
+# Metadata worth showing the model; the rest (timestamps, raw floats) is noise
+CONTEXT_METADATA_FIELDS = ("employee", "category", "status", "requested_amount", "reimbursed_amount", "date")
+HISTORY_ROLES = {"user": "human", "human": "human", "assistant": "ai", "ai": "ai"}
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut text to roughly ``max_tokens`` (estimate_tokens counts ~4 chars per token)"""
+    max_chars = max(0, max_tokens * 4)
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - 3)].rstrip() + "..."
+
+
+class ContextBuilder:
+    """Assembles retrieved invoices into a bounded prompt context
+
+    Hits are deduplicated (by id and by document text), ordered by relevance
+    (fused score, then vector distance, then retrieval order), whitespace-
+    collapsed, truncated to ``max_document_tokens`` each and added until
+    ``token_budget`` is used up.
+    """
+
+    def __init__(self, token_budget: int = 2000, max_document_tokens: int = 300):
+        self.token_budget = token_budget
+        self.max_document_tokens = max_document_tokens
+
+    def build(self, hits: List[Dict]) -> Tuple[str, List[Dict]]:
+        """Return (context text, the hits that made it into the context)"""
+        blocks, used, seen = [], [], set()
+        remaining = self.token_budget
+        for hit in self._ordered(hits):
+            document = re.sub(r"\s+", " ", hit.get("document") or "").strip()
+            fingerprint = sha256_text(document)
+            if hit.get("id") in seen or fingerprint in seen:
+                continue
+            seen.update((hit.get("id"), fingerprint))
+
+            block = self._render(len(blocks) + 1, hit, _truncate(document, self.max_document_tokens))
+            cost = estimate_tokens(block)
+            if cost > remaining:
+                if blocks:
+                    break
+                block = _truncate(block, remaining)
+                cost = estimate_tokens(block)
+            blocks.append(block)
+            used.append(hit)
+            remaining -= cost
+        return "\n\n".join(blocks), used
+
+    @staticmethod
+    def _ordered(hits: List[Dict]) -> List[Dict]:
+        def relevance(item):
+            position, hit = item
+            score = hit.get("score")
+            distance = hit.get("distance")
+            return (-(score if score is not None else float("-inf")),
+                    distance if distance is not None else float("inf"),
+                    position)
+        return [hit for _, hit in sorted(enumerate(hits), key=relevance)]
+
+    @staticmethod
+    def _render(number: int, hit: Dict, document: str) -> str:
+        metadata = hit.get("metadata") or {}
+        details = ", ".join(
+            f"{field}: {str(metadata[field])[:10] if field == 'date' else metadata[field]}"
+            for field in CONTEXT_METADATA_FIELDS if field in metadata
+        )
+        return f"[{number}] id: {hit.get('id')} | {details}\n{document}"
+
+
+def window_history(history: Optional[List[Dict[str, str]]], max_messages: int = 6,
+                   token_budget: int = 1000, max_message_tokens: int = 300) -> List[Dict[str, str]]:
+    """Keep the most recent turns that fit in ``max_messages`` and ``token_budget``
+
+    Messages with unknown roles or no content are dropped and long ones are
+    truncated, so a client that keeps echoing the history back cannot grow
+    the prompt without bound.
+    """
+    window: List[Dict[str, str]] = []
+    remaining = token_budget
+    for message in reversed(history or []):
+        role = str(message.get("role", "")).lower()
+        content = _truncate(str(message.get("content") or "").strip(), max_message_tokens)
+        if role not in HISTORY_ROLES or not content:
+            continue
+        cost = estimate_tokens(content)
+        if len(window) >= max_messages or cost > remaining:
+            break
+        window.append({"role": role, "content": content})
+        remaining -= cost
+    window.reverse()
+    return window
+
+
+def next_history(history: List[Dict[str, str]], user_query: str, answer: str) -> List[Dict[str, str]]:
+    """History to send back to the client: the window plus this turn"""
+    return history + [{"role": "user", "content": user_query}, {"role": "assistant", "content": answer}]
+
+
+def history_messages(history: List[Dict[str, str]]) -> List[Tuple[str, str]]:
+    """Convert windowed history to (role, content) tuples for a ChatPromptTemplate"""
+    return [(HISTORY_ROLES[message["role"]], message["content"]) for message in history]
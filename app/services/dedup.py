@@ -0,0 +1,367 @@
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Set
+
+from app.services import telemetry
+from app.services.text_utils import sha256_text
+
+# MinHash signature length and its LSH banding (BANDS * ROWS = PERMUTATIONS).
+# Invoices built from one template share up to ~70% of their word shingles,
+# while a re-export or one edited field keeps ~90%; with 16 bands of 8 rows
+# pairs at 0.85 similarity become candidates 99% of the time and pairs at
+# 0.35 (typical for one template) almost never
+PERMUTATIONS = 128
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+SHINGLE_SIZE = 3
+TOKEN_PATTERN = re.compile(r"\w+")
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240101)
+# Fixed seeds: signatures must stay comparable across processes and restarts
+_COEFFICIENTS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(PERMUTATIONS)]
+
+
+def invoice_id_for(byte_hash: str) -> str:
+    """Stable invoice id derived from the PDF's SHA-256"""
+    return f"inv-{byte_hash[:16]}"
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of extracted invoice text"""
+    return " ".join(text.lower().split())
+
+
+def shingles(text: str) -> Set[str]:
+    """Word 3-grams of the normalized text (single words for very short texts)"""
+    tokens = TOKEN_PATTERN.findall(normalize_text(text))
+    if len(tokens) < SHINGLE_SIZE:
+        return set(tokens)
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> Optional[List[int]]:
+    """MinHash signature of the text's shingles (None when it has no words)"""
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+              for shingle in shingles(text)]
+    if not hashes:
+        return None
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _COEFFICIENTS]
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(x == y for x, y in zip(a, b)) / PERMUTATIONS
+
+
+def band_keys(signature: Sequence[int]) -> List[int]:
+    """One LSH bucket per band (signed 64-bit, as SQLite stores integers)"""
+    keys = []
+    for band in range(BANDS):
+        rows = array("Q", signature[band * ROWS:(band + 1) * ROWS]).tobytes()
+        keys.append(int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "big", signed=True))
+    return keys
+
+
+class DedupIndex:
+    """Fingerprints of every stored invoice, checked before extraction and analysis
+
+    Three checks, cheapest first: the SHA-256 of the PDF bytes (before
+    extraction), then the hash of the normalized text and a MinHash of its
+    word shingles (before analysis). A match returns the invoice it
+    duplicates. A miss *claims* the fingerprint, so an identical invoice
+    arriving while the first is still in flight is also caught (the match
+    then carries ``in_flight``); the caller ``commit``s the claim once the
+    analysis is stored, or ``release``s it when the invoice failed.
+
+    Claims live in the SQLite file next to the fingerprints, so every API
+    worker sharing ``path`` sees them; checks run in BEGIN IMMEDIATE
+    transactions. Claims of processes that died, or older than
+    ``claim_ttl`` seconds, are dropped.
+    """
+
+    def __init__(self, path: str = "./dedup.sqlite3", near_threshold: float = 0.85,
+                 claim_ttl: float = 3600.0):
+        if not 0 <= near_threshold <= 1:
+            raise ValueError("near_threshold must be between 0 and 1")
+        self.path = path
+        # 0 turns near-duplicate detection off
+        self.near_threshold = near_threshold
+        self.claim_ttl = claim_ttl
+        self.checks = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS invoice_fingerprints (
+                byte_hash TEXT PRIMARY KEY,
+                text_hash TEXT NOT NULL,
+                signature BLOB,
+                invoice_id TEXT NOT NULL,
+                filename TEXT,
+                status TEXT,
+                reimbursed_amount REAL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_fingerprints_text ON invoice_fingerprints(text_hash);
+            CREATE TABLE IF NOT EXISTS minhash_bands (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                byte_hash TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, byte_hash)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS invoice_claims (
+                byte_hash TEXT PRIMARY KEY,
+                invoice_id TEXT NOT NULL,
+                filename TEXT,
+                text_hash TEXT,
+                signature BLOB,
+                owner_pid INTEGER NOT NULL,
+                claimed_at REAL NOT NULL
+            );"""
+        )
+
+    def attach(self, vector_store) -> None:
+        """Keep fingerprints to invoices stored in ``vector_store``, now and after restores"""
+        self.reconcile(vector_store)
+        vector_store.add_listener(self._on_write, resync=self.reconcile)
+
+    def reconcile(self, vector_store, batch_size: int = 1000) -> int:
+        """Forget fingerprints of invoices missing from ``vector_store``; returns how many were dropped"""
+        # Ids are read inside the transaction: a fingerprint committed meanwhile waits for it
+        with self._transaction():
+            stored, offset = set(), 0
+            while True:
+                ids = vector_store.collection.get(limit=batch_size, offset=offset, include=[])["ids"]
+                if not ids:
+                    break
+                stored.update(ids)
+                offset += len(ids)
+            orphaned = [row["byte_hash"] for row in self._conn.execute(
+                "SELECT byte_hash, invoice_id FROM invoice_fingerprints"
+            ) if row["invoice_id"] not in stored]
+            for start in range(0, len(orphaned), 500):
+                chunk = orphaned[start:start + 500]
+                marks = ", ".join("?" * len(chunk))
+                self._conn.execute(f"DELETE FROM invoice_fingerprints WHERE byte_hash IN ({marks})", chunk)
+                self._conn.execute(f"DELETE FROM minhash_bands WHERE byte_hash IN ({marks})", chunk)
+        return len(orphaned)
+
+    def check_bytes(self, byte_hash: str, filename: str, force: bool = False) -> Optional[Dict]:
+        """Duplicate of an identical PDF, or None after claiming ``byte_hash``
+
+        With ``force`` nothing is looked up; the claim still records the
+        invoice once it is stored (re-analysis that replaces the old result).
+        """
+        with self._transaction():
+            self._expire_claims()
+            match = None
+            if not force:
+                row = self._conn.execute(
+                    "SELECT invoice_id, filename FROM invoice_claims WHERE byte_hash = ?", (byte_hash,)
+                ).fetchone()
+                if row is not None:
+                    match = {**dict(row), "in_flight": True}
+                else:
+                    row = self._conn.execute(
+                        "SELECT invoice_id, filename, status, reimbursed_amount FROM invoice_fingerprints "
+                        "WHERE byte_hash = ?", (byte_hash,)
+                    ).fetchone()
+                    match = dict(row) if row is not None else None
+            if match is None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO invoice_claims (byte_hash, invoice_id, filename, owner_pid, claimed_at) "
+                    "VALUES (?, ?, ?, ?, ?)", (byte_hash, invoice_id_for(byte_hash), filename, os.getpid(), time.time())
+                )
+        if match is None:
+            # Counted once check_text settles the outcome
+            return None
+        return self._result(match, "exact")
+
+    def check_text(self, byte_hash: str, text: str, force: bool = False) -> Optional[Dict]:
+        """Duplicate by normalized text or MinHash similarity, or None (the claim keeps the fingerprints)
+
+        Call after ``check_bytes`` returned None for ``byte_hash``. On a
+        match the claim is dropped; an exact text match of a stored invoice
+        also records ``byte_hash`` as another file of it.
+        """
+        text_hash = sha256_text(normalize_text(text))
+        signature = minhash(text)
+        with self._transaction():
+            claim = self._conn.execute(
+                "SELECT invoice_id, filename FROM invoice_claims WHERE byte_hash = ?", (byte_hash,)
+            ).fetchone()
+            if claim is None:
+                raise KeyError(f"{byte_hash} was not claimed with check_bytes")
+            match, kind = (None, None) if force else self._find_text(byte_hash, text_hash, signature)
+            if match is None:
+                self._conn.execute(
+                    "UPDATE invoice_claims SET text_hash = ?, signature = ? WHERE byte_hash = ?",
+                    (text_hash, _pack(signature), byte_hash)
+                )
+            else:
+                self._conn.execute("DELETE FROM invoice_claims WHERE byte_hash = ?", (byte_hash,))
+                if kind == "text" and not match.get("in_flight"):
+                    self._insert([(byte_hash, {**dict(claim), **match, "text_hash": text_hash,
+                                               "signature": signature})])
+        return self._result(match, kind)
+
+    def commit(self, stored: List[Dict]) -> None:
+        """Record claimed invoices once stored; each item has byte_hash, status and reimbursed_amount"""
+        with self._transaction():
+            entries = []
+            for item in stored:
+                claim = self._conn.execute(
+                    "SELECT invoice_id, filename, text_hash, signature FROM invoice_claims WHERE byte_hash = ?",
+                    (item["byte_hash"],)
+                ).fetchone()
+                if claim is None:
+                    continue
+                self._conn.execute("DELETE FROM invoice_claims WHERE byte_hash = ?", (item["byte_hash"],))
+                if claim["text_hash"] is not None:
+                    entries.append((item["byte_hash"], {**dict(claim), "signature": _unpack(claim["signature"]),
+                                                        "status": item.get("status"),
+                                                        "reimbursed_amount": item.get("reimbursed_amount")}))
+            self._insert(entries)
+
+    def release(self, byte_hash: str) -> None:
+        """Drop the claim of an invoice that was not stored, so a resubmission is processed again"""
+        with self._lock:
+            self._conn.execute("DELETE FROM invoice_claims WHERE byte_hash = ? AND owner_pid = ?",
+                               (byte_hash, os.getpid()))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            in_flight = self._conn.execute("SELECT COUNT(*) FROM invoice_claims").fetchone()[0]
+        return {"entries": len(self), "in_flight": in_flight,
+                "near_threshold": self.near_threshold, "checks": dict(self.checks)}
+
+    def clear(self) -> None:
+        with self._transaction():
+            self._conn.execute("DELETE FROM invoice_fingerprints")
+            self._conn.execute("DELETE FROM minhash_bands")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoice_fingerprints").fetchone()[0]
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _expire_claims(self) -> None:
+        """Drop claims older than ``claim_ttl`` and those of processes that are gone"""
+        self._conn.execute("DELETE FROM invoice_claims WHERE claimed_at < ?", (time.time() - self.claim_ttl,))
+        owners = [row[0] for row in self._conn.execute("SELECT DISTINCT owner_pid FROM invoice_claims")]
+        dead = [pid for pid in owners if not _process_alive(pid)]
+        if dead:
+            self._conn.execute(f"DELETE FROM invoice_claims WHERE owner_pid IN ({', '.join('?' * len(dead))})",
+                               dead)
+
+    def _find_text(self, byte_hash: str, text_hash: str, signature: Optional[List[int]]):
+        near = self.near_threshold > 0 and signature is not None
+        best = None
+        claims = self._conn.execute(
+            "SELECT invoice_id, filename, text_hash, signature FROM invoice_claims "
+            "WHERE byte_hash != ? AND text_hash IS NOT NULL", (byte_hash,)
+        ).fetchall()
+        for claim in claims:
+            match = {"invoice_id": claim["invoice_id"], "filename": claim["filename"], "in_flight": True}
+            if claim["text_hash"] == text_hash:
+                return match, "text"
+            if near and claim["signature"] is not None:
+                score = similarity(signature, _unpack(claim["signature"]))
+                if score >= self.near_threshold and (best is None or score > best["similarity"]):
+                    best = {**match, "similarity": score}
+
+        row = self._conn.execute(
+            "SELECT invoice_id, filename, status, reimbursed_amount FROM invoice_fingerprints "
+            "WHERE text_hash = ? LIMIT 1", (text_hash,)
+        ).fetchone()
+        if row is not None:
+            return dict(row), "text"
+        if not near:
+            return (best, "near") if best is not None else (None, None)
+
+        buckets = band_keys(signature)
+        candidates = self._conn.execute(
+            "SELECT invoice_id, filename, status, reimbursed_amount, signature FROM invoice_fingerprints "
+            "WHERE byte_hash IN (SELECT byte_hash FROM minhash_bands WHERE "
+            f"{' OR '.join(['(band = ? AND bucket = ?)'] * BANDS)})",
+            [value for pair in enumerate(buckets) for value in pair]
+        ).fetchall()
+        for row in candidates:
+            score = similarity(signature, _unpack(row["signature"]))
+            if score >= self.near_threshold and (best is None or score > best["similarity"]):
+                best = {key: row[key] for key in ("invoice_id", "filename", "status", "reimbursed_amount")}
+                best["similarity"] = score
+        return (best, "near") if best is not None else (None, None)
+
+    def _insert(self, entries) -> None:
+        """Write fingerprints (inside a transaction)"""
+        if not entries:
+            return
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO invoice_fingerprints (byte_hash, text_hash, signature, invoice_id, filename, "
+            "status, reimbursed_amount, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(byte_hash, entry["text_hash"], _pack(entry["signature"]), entry["invoice_id"], entry["filename"],
+              entry.get("status"), entry.get("reimbursed_amount"), now)
+             for byte_hash, entry in entries]
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO minhash_bands (band, bucket, byte_hash) VALUES (?, ?, ?)",
+            [(band, bucket, byte_hash) for byte_hash, entry in entries if entry["signature"] is not None
+             for band, bucket in enumerate(band_keys(entry["signature"]))]
+        )
+
+    def _result(self, match: Optional[Dict], kind: Optional[str]) -> Optional[Dict]:
+        self.checks[kind or "new"] += 1
+        telemetry.DEDUP_CHECKS.inc(result=kind or "new")
+        if match is None:
+            return None
+        return {"match": kind, **match}
+
+    def _on_write(self, ids: List[str], documents: List[str], metadatas: List[Dict], reset: bool) -> None:
+        if reset:
+            self.clear()
+
+
+def _pack(signature: Optional[Sequence[int]]) -> Optional[bytes]:
+    return array("Q", signature).tobytes() if signature is not None else None
+
+
+def _unpack(blob: Optional[bytes]) -> Optional[array]:
+    return array("Q", blob) if blob is not None else None
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid() or os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
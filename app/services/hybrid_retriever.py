@@ -0,0 +1,251 @@
+import base64
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.services.text_utils import sha256_text
+from app.services.vector_store import VectorStore, build_where, matches_where
+
+TOKEN_PATTERN = re.compile(r"\w+(?:-\w+)*")
+STOPWORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of",
+    "on", "or", "the", "to", "was", "were", "with", "any", "all", "me", "show", "find", "which",
+))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; hyphenated ids are kept whole and also split"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "-" in token:
+            tokens.extend(part for part in token.split("-") if part and part not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring
+
+    Documents can be added, replaced and removed one at a time, so the index
+    follows the vector store write by write instead of being rebuilt. The
+    metadata of each document is kept for filtering.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_df_ratio: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        # Terms in more than this share of documents add almost nothing to the
+        # score but cost a full posting scan, so they are skipped when the
+        # query has rarer terms (e.g. the "inv" in "inv-3f2a...")
+        self.max_df_ratio = max_df_ratio
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, Tuple[str, ...]] = {}
+        self.metadata: Dict[str, Dict] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict] = None) -> None:
+        counts = Counter(tokenize(f"{doc_id} {text}"))
+        with self._lock:
+            self.remove(doc_id)
+            for term, count in counts.items():
+                self._postings.setdefault(term, {})[doc_id] = count
+            length = sum(counts.values())
+            self._lengths[doc_id] = length
+            self._terms[doc_id] = tuple(counts)
+            self.metadata[doc_id] = metadata or {}
+            self._total_length += length
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            if doc_id not in self._lengths:
+                return
+            for term in self._terms.pop(doc_id):
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths.pop(doc_id)
+            del self.metadata[doc_id]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._terms.clear()
+            self.metadata.clear()
+            self._total_length = 0
+
+    def search(self, query: str, k: int = 10, where: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """Top ``k`` (doc_id, score) pairs, restricted to metadata matching ``where``"""
+        terms = set(tokenize(query))
+        scores: Dict[str, float] = {}
+        with self._lock:
+            count = len(self._lengths)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            postings_by_term = [(term, self._postings[term]) for term in terms if term in self._postings]
+            selective = [(term, postings) for term, postings in postings_by_term
+                         if len(postings) <= self.max_df_ratio * count]
+            for term, postings in selective or postings_by_term:
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            if where:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if matches_where(self.metadata[doc_id], where)}
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60,
+                           weights: Optional[List[float]] = None) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: score(d) = sum(weight / (rrf_k + rank)), rank starting at 1"""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever:
+    """BM25 + vector retrieval fused with reciprocal rank fusion
+
+    The BM25 index is built from the collection on first use and then kept
+    up to date through VectorStore.add_listener; it is rebuilt when the
+    collection's size no longer matches (writes by another process sharing
+    a Chroma server). ``search`` returns a page of ``k`` results and an
+    opaque cursor for the next page; cursors are tied to the query and
+    filters they were issued for. Every page is cut from the same fused
+    candidate list of ``max_k * depth_multiplier`` hits per ranking (at
+    most ``max_depth``), so paging neither repeats nor skips results.
+    """
+
+    def __init__(self, vector_store: VectorStore, k: int = 5, max_k: int = 50, rrf_k: int = 60,
+                 depth_multiplier: int = 2, max_depth: int = 1000,
+                 lexical_weight: float = 1.0, vector_weight: float = 1.0):
+        self.vector_store = vector_store
+        self.k = k
+        self.max_k = max_k
+        self.rrf_k = rrf_k
+        self.depth_multiplier = depth_multiplier
+        self.max_depth = max_depth
+        self.weights = [lexical_weight, vector_weight]
+        self.depth = min(max_depth, max_k * depth_multiplier)
+        self.index = BM25Index()
+        self._built = False
+        self._build_lock = threading.Lock()
+        vector_store.add_listener(self._on_write, resync=lambda store: self.build())
+
+    def build(self, batch_size: int = 1000) -> int:
+        """(Re)build the BM25 index from every stored document"""
+        with self._build_lock:
+            self.index.clear()
+            for ids, documents, metadatas, _ in self.vector_store.iter_records(batch_size):
+                for doc_id, document, metadata in zip(ids, documents, metadatas):
+                    self.index.add(doc_id, document, metadata)
+            self._built = True
+        return len(self.index)
+
+    def search(self, query: Optional[str], filters: Optional[Dict] = None, k: Optional[int] = None,
+               cursor: Optional[str] = None) -> Dict:
+        """Return {"results": [...], "next_cursor": str or None}
+
+        Each result carries id, document, metadata, the fused ``score`` and
+        its ``lexical_rank``/``vector_rank`` (None when absent from a list).
+        Raises ValueError on invalid filters or a cursor from another query.
+        """
+        k = max(1, min(k or self.k, self.max_k))
+        where = build_where(filters)
+        fingerprint = self._fingerprint(query, filters)
+        offset = self._decode_cursor(cursor, fingerprint) if cursor else 0
+
+        if not query or not query.strip():
+            # Bounded like the ranked path: no page reaches past ``depth`` results
+            end = min(offset + k, self.depth)
+            hits = self.vector_store.search(None, filters, n_results=end + 1) if end > offset else []
+            page = [{**hit, "score": None, "lexical_rank": None, "vector_rank": None}
+                    for hit in hits[offset:end]]
+            more = end < self.depth and len(hits) > end
+            return {"results": page, "next_cursor": self._encode_cursor(end, fingerprint) if more else None}
+
+        self._ensure_built()
+        lexical = [doc_id for doc_id, _ in self.index.search(query, self.depth, where)]
+        vector_hits = {hit["id"]: hit for hit in self.vector_store.search(query, filters, n_results=self.depth)}
+        fused = reciprocal_rank_fusion([lexical, list(vector_hits)], self.rrf_k, self.weights)
+
+        lexical_ranks = {doc_id: rank for rank, doc_id in enumerate(lexical, start=1)}
+        vector_ranks = {doc_id: rank for rank, doc_id in enumerate(vector_hits, start=1)}
+        page_ids = [doc_id for doc_id, _ in fused[offset:offset + k]]
+        missing = [doc_id for doc_id in page_ids if doc_id not in vector_hits]
+        documents = self._fetch(missing)
+
+        results = []
+        for doc_id, score in fused[offset:offset + k]:
+            hit = vector_hits.get(doc_id) or documents.get(doc_id)
+            if hit is None:
+                # Deleted since it was indexed
+                continue
+            results.append({
+                **hit,
+                "score": score,
+                "lexical_rank": lexical_ranks.get(doc_id),
+                "vector_rank": vector_ranks.get(doc_id),
+            })
+        more = len(fused) > offset + k
+        return {"results": results, "next_cursor": self._encode_cursor(offset + k, fingerprint) if more else None}
+
+    def stats(self) -> Dict:
+        return {"indexed_documents": len(self.index), "built": self._built, "candidate_depth": self.depth}
+
+    def _ensure_built(self) -> None:
+        if not self._built or self.vector_store.collection.count() != len(self.index):
+            self.build()
+
+    def _on_write(self, ids: List[str], documents: List[str], metadatas: List[Dict], reset: bool) -> None:
+        if reset:
+            self.index.clear()
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self.index.add(doc_id, document, metadata)
+
+    def _fetch(self, ids: List[str]) -> Dict[str, Dict]:
+        if not ids:
+            return {}
+        found = self.vector_store.collection.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            doc_id: {"id": doc_id, "document": document, "metadata": metadata}
+            for doc_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+
+    @staticmethod
+    def _fingerprint(query: Optional[str], filters: Optional[Dict]) -> str:
+        return sha256_text(json.dumps([query or "", filters or {}], sort_keys=True, default=str))[:16]
+
+    @staticmethod
+    def _encode_cursor(offset: int, fingerprint: str) -> str:
+        payload = json.dumps({"o": offset, "f": fingerprint}).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, fingerprint: str) -> int:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            offset = int(payload["o"])
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("Malformed cursor")
+        if payload.get("f") != fingerprint or offset < 0:
+            raise ValueError("Cursor does not belong to this query and filters")
+        return offset
@@ -0,0 +1,417 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from app.services import telemetry
+from app.services.pdf_processor import iter_zip_invoices, list_zip_invoices
+
+class JobNotFoundError(KeyError):
+    """No job with the given id"""
+
+
+class JobExpiredError(ValueError):
+    """The job's uploads were deleted, so it cannot be resumed"""
+
+
+class JobStore:
+    """SQLite tables for jobs and their per-invoice checkpoints
+
+    One connection guarded by a lock, in WAL mode so several API processes
+    can share the file; claims use BEGIN IMMEDIATE so a queued job is only
+    picked up once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                employee_name TEXT NOT NULL,
+                analysis_mode TEXT NOT NULL,
+                bypass_cache INTEGER NOT NULL,
+                policy_hash TEXT NOT NULL,
+                job_dir TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+            CREATE TABLE IF NOT EXISTS job_items (
+                job_id TEXT NOT NULL,
+                item_index INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                status TEXT NOT NULL,
+                invoice_id TEXT,
+                reimbursed_amount REAL NOT NULL,
+                reason TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, item_index)
+            );"""
+        )
+
+    def create(self, job: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, employee_name, analysis_mode, bypass_cache, policy_hash, "
+                "job_dir, total, created_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["employee_name"], job["analysis_mode"], int(job["bypass_cache"]),
+                 job["policy_hash"], job["job_dir"], job["total"], time.time())
+            )
+
+    def get(self, job_id: str) -> Dict:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFoundError(job_id)
+        return dict(row)
+
+    def items(self, job_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_index, filename, status, invoice_id, reimbursed_amount, reason "
+                "FROM job_items WHERE job_id = ? ORDER BY item_index", (job_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def completed_indexes(self, job_id: str) -> set:
+        """Items that need no further work (failed ones are retried on resume)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_index FROM job_items WHERE job_id = ? AND status != 'Failed'", (job_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def claim(self, stale_after: float) -> Optional[Dict]:
+        """Atomically move the oldest queued (or abandoned running) job to running"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND heartbeat_at < ?) ORDER BY created_at LIMIT 1",
+                    (now - stale_after,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), "
+                        "heartbeat_at = ?, error = NULL WHERE id = ?", (now, now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def checkpoint(self, job_id: str, index: int, record: Dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_items (job_id, item_index, filename, status, invoice_id, "
+                "reimbursed_amount, reason, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, index, record["filename"], record["status"], record.get("invoice_id"),
+                 float(record.get("reimbursed_amount") or 0.0), record.get("reason"), now)
+            )
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (now, job_id))
+
+    def heartbeat(self, job_id: str) -> bool:
+        """Refresh the running job's heartbeat; returns True if cancellation was requested"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    def request_cancel(self, job_id: str) -> str:
+        """Cancel a queued job now, or flag a running one; returns the resulting status"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,)
+            )
+        return self.get(job_id)["status"]
+
+    def requeue(self, job_id: str) -> str:
+        """Put a failed or cancelled job whose uploads are still kept back in the queue"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', cancel_requested = 0, error = NULL, finished_at = NULL "
+                "WHERE id = ? AND status IN ('failed', 'cancelled') AND job_dir != ''", (job_id,)
+            )
+        return self.get(job_id)["status"]
+
+    def expired(self, finished_before: float) -> List[Dict]:
+        """Failed or cancelled jobs finished before the cutoff that still have uploads"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, job_dir FROM jobs WHERE status IN ('failed', 'cancelled') "
+                "AND job_dir != '' AND finished_at < ?", (finished_before,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def forget_uploads(self, job_id: str) -> None:
+        """Record that the job's directory was deleted (an empty job_dir)"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET job_dir = '' WHERE id = ?", (job_id,))
+
+
+class JobQueue:
+    """Background analysis jobs with per-invoice checkpoints, no broker needed
+
+    ``submit`` stores the uploads under ``job_root`` and queues a job row;
+    ``workers`` asyncio tasks (started with ``start`` on the server's event
+    loop) claim jobs and run them through ``pipeline.stream(durable=True)``,
+    recording every invoice as it is persisted. A job interrupted by a crash
+    or restart is picked up again once its heartbeat is ``stale_after``
+    seconds old, and invoices already done are skipped without being
+    decompressed.
+
+    The uploads of a completed job are deleted right away. Those of failed
+    or cancelled jobs are kept ``retention`` seconds so the job can be
+    resumed, then removed by a sweep the idle workers run every
+    ``sweep_interval`` seconds; such a job can no longer be resumed.
+    """
+
+    def __init__(self, pipeline, policy_registry, db_path: str, job_root: str,
+                 workers: int = 1, poll_interval: float = 2.0, stale_after: float = 30.0,
+                 retention: float = 86400.0, sweep_interval: float = 300.0):
+        self.pipeline = pipeline
+        self.policy_registry = policy_registry
+        self.store = JobStore(db_path)
+        self.job_root = job_root
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.retention = retention
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        os.makedirs(job_root, exist_ok=True)
+
+    def submit(self, policy_pdf: bytes, invoices_zip, employee_name: str,
+               analysis_mode: str = "single", bypass_cache: bool = False) -> Dict:
+        """Persist the uploads and queue a job; raises ValueError for unusable input
+
+        ``invoices_zip`` is a file object (copied in chunks) or bytes.
+        """
+        policy = self.policy_registry.get_or_parse(policy_pdf)
+        if not policy.text.strip():
+            raise ValueError("Could not extract text from policy PDF")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.job_root, job_id)
+        os.makedirs(job_dir)
+        try:
+            with open(os.path.join(job_dir, "policy.pdf"), "wb") as f:
+                f.write(policy_pdf)
+            zip_path = os.path.join(job_dir, "invoices.zip")
+            with open(zip_path, "wb") as f:
+                if isinstance(invoices_zip, bytes):
+                    f.write(invoices_zip)
+                else:
+                    shutil.copyfileobj(invoices_zip, f, 1024 * 1024)
+            total = len(list_zip_invoices(zip_path))
+            if not total:
+                raise ValueError("No PDF invoices found in ZIP file")
+            self.store.create({
+                "id": job_id, "employee_name": employee_name, "analysis_mode": analysis_mode,
+                "bypass_cache": bypass_cache, "policy_hash": policy.policy_hash,
+                "job_dir": job_dir, "total": total
+            })
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        self._wake()
+        return self.status(job_id, include_items=False)
+
+    def status(self, job_id: str, include_items: bool = True) -> Dict:
+        job = self.store.get(job_id)
+        items = self.store.items(job_id)
+        failed = sum(item["status"] == "Failed" for item in items)
+        duplicates = sum(item["status"] == "Duplicate" for item in items)
+        report = {
+            "job_id": job["id"],
+            "status": job["status"],
+            "employee_name": job["employee_name"],
+            "analysis_mode": job["analysis_mode"],
+            "cancel_requested": bool(job["cancel_requested"]),
+            "error": job["error"],
+            "uploads_kept": bool(job["job_dir"]),
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "progress": {
+                "total": job["total"],
+                "processed": len(items) - failed - duplicates,
+                "failed": failed,
+                "duplicates": duplicates,
+                "remaining": job["total"] - len(items),
+                "total_reimbursed": round(sum(item["reimbursed_amount"] for item in items
+                                              if item["status"] != "Failed"), 2),
+            },
+        }
+        if include_items:
+            report["results"] = [{"index": item.pop("item_index"), **item} for item in items]
+        return report
+
+    def cancel(self, job_id: str) -> Dict:
+        self.store.request_cancel(job_id)
+        return self.status(job_id, include_items=False)
+
+    def resume(self, job_id: str) -> Dict:
+        """Requeue a failed or cancelled job; raises JobExpiredError once its uploads are gone"""
+        if self.store.requeue(job_id) in ("failed", "cancelled"):
+            raise JobExpiredError(f"Uploads of job {job_id} were deleted after {self.retention:g}s; "
+                                  "submit it again")
+        self._wake()
+        return self.status(job_id, include_items=False)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers; running jobs stay 'running' and resume after restart"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _wake(self) -> None:
+        # submit() usually runs on a request thread, not the workers' loop
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.stale_after)
+            if job is None:
+                if time.monotonic() >= self._next_sweep:
+                    self._next_sweep = time.monotonic() + self.sweep_interval
+                    await asyncio.to_thread(self.sweep)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Dict) -> None:
+        job_id = job["id"]
+        # Spans of a job are traced under its id (GET /traces/{job_id})
+        token = telemetry.correlation_id.set(job_id)
+        try:
+            with telemetry.span("job", job_id=job_id):
+                status, error = await self._process(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self.store.finish, job_id, "failed", f"{type(e).__name__}: {e}")
+        else:
+            await asyncio.to_thread(self.store.finish, job_id, status, error)
+            if status == "completed":
+                await asyncio.to_thread(self._delete_uploads, job_id, job["job_dir"])
+        finally:
+            telemetry.correlation_id.reset(token)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Delete the uploads of failed or cancelled jobs older than ``retention``; returns the count"""
+        expired = self.store.expired((now or time.time()) - self.retention)
+        for job in expired:
+            self._delete_uploads(job["id"], job["job_dir"])
+        return len(expired)
+
+    def _delete_uploads(self, job_id: str, job_dir: str) -> None:
+        # Forget the directory first: a job must never be resumed without its files
+        self.store.forget_uploads(job_id)
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    async def _process(self, job: Dict) -> Tuple[str, Optional[str]]:
+        """Run the job's unfinished invoices; returns its final (status, error)
+
+        A job with invoices that still failed ends as "failed" so its uploads
+        are kept and ``resume`` retries just those invoices.
+        """
+        job_id = job["id"]
+        policy = await asyncio.to_thread(self._load_policy, job)
+        zip_path = os.path.join(job["job_dir"], "invoices.zip")
+        done = await asyncio.to_thread(self.store.completed_indexes, job_id)
+        # Pipeline indexes count only the invoices fed to it; map them back to ZIP positions
+        pending = [index for index in range(job["total"]) if index not in done]
+        if not pending:
+            return "completed", None
+
+        records = self.pipeline.stream(
+            policy, iter_zip_invoices(zip_path, skip=done), job["employee_name"],
+            bypass_cache=bool(job["bypass_cache"]), batch_mode=job["analysis_mode"] == "batch",
+            durable=True
+        )
+        cancelled = asyncio.Event()
+        consumer = asyncio.create_task(self._consume(job_id, records, pending))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, consumer, cancelled))
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            if not cancelled.is_set():
+                raise
+            return "cancelled", None
+        finally:
+            consumer.cancel()
+            heartbeat.cancel()
+        failed = job["total"] - len(await asyncio.to_thread(self.store.completed_indexes, job_id))
+        if failed:
+            return "failed", f"{failed} of {job['total']} invoices failed; resume the job to retry them"
+        return "completed", None
+
+    async def _consume(self, job_id: str, records, pending: List[int]) -> None:
+        try:
+            async for record in records:
+                await asyncio.to_thread(self.store.checkpoint, job_id, pending[record["index"]], record)
+        finally:
+            # Stops the pipeline's workers if we leave early
+            await records.aclose()
+
+    async def _heartbeat(self, job_id: str, consumer: asyncio.Task, cancelled: asyncio.Event) -> None:
+        while True:
+            if await asyncio.to_thread(self.store.heartbeat, job_id):
+                cancelled.set()
+                consumer.cancel()
+                return
+            await asyncio.sleep(min(self.poll_interval, self.stale_after / 3))
+
+    def _load_policy(self, job: Dict):
+        policy = self.policy_registry.get(job["policy_hash"])
+        if policy is None:
+            with open(os.path.join(job["job_dir"], "policy.pdf"), "rb") as f:
+                policy = self.policy_registry.get_or_parse(f.read())
+        return policy
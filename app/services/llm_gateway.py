@@ -0,0 +1,417 @@
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.services.text_utils import estimate_tokens, sha256_text
+
+
+class LLMUnavailableError(RuntimeError):
+    """The provider could not serve the call (retries exhausted, timeout or open circuit)"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Calls are short-circuited after repeated provider failures"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate_per_minute``"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take ``amount`` tokens and return how long the caller must wait first"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+            self._updated = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_per_second
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures, half-opens after ``reset_timeout``
+
+    While half-open exactly one probe call is let through at a time; its
+    outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError if the call may not proceed; True when it is the half-open probe"""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("LLM circuit breaker is open; provider is failing")
+                self.state = "half_open"
+            if self._probing:
+                raise CircuitOpenError("LLM circuit breaker is half-open; a probe call is in flight")
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self.state = "closed"
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def abandon_probe(self) -> None:
+        """The probe ended without a verdict (cancelled); let the next call probe instead"""
+        with self._lock:
+            self._probing = False
+
+
+RETRYABLE_STATUS = frozenset((408, 429, 500, 502, 503, 504))
+# Transient errors of the Google API core, httpx and OpenAI-style clients, matched by class
+# name anywhere in the MRO so none of those libraries has to be imported here
+RETRYABLE_TYPES = frozenset((
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "BadGateway", "RateLimitError", "APIConnectionError",
+    "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout", "RemoteProtocolError",
+))
+# Exact provider messages, only consulted for errors that carry no status code
+RETRYABLE_PHRASES = ("resource has been exhausted", "rate limit exceeded", "quota exceeded",
+                     "the model is overloaded", "service is currently unavailable", "deadline exceeded")
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for candidate in (getattr(error, "status_code", None), getattr(error, "code", None),
+                      getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(candidate, int) and 100 <= candidate < 600:
+            return candidate
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, timeouts and transient 5xx/connection errors are retried
+
+    Decided by exception type and HTTP status (following ``__cause__`` for
+    wrapped errors); any other status, e.g. a 400 whose message mentions a
+    timeout, is final. Message text only matters without a status.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (asyncio.TimeoutError, concurrent.futures.TimeoutError,
+                              TimeoutError, ConnectionError)):
+            return True
+        if any(cls.__name__ in RETRYABLE_TYPES for cls in type(error).__mro__):
+            return True
+        status = _status_code(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS
+        if any(phrase in str(error).lower() for phrase in RETRYABLE_PHRASES):
+            return True
+        error = error.__cause__
+    return False
+
+
+class _LeaderCancelled(Exception):
+    """The caller running a coalesced call was cancelled; its waiters run the call themselves"""
+
+
+class LLMGateway:
+    """Shared front door for every chat model call
+
+    Provides a requests/tokens-per-minute token bucket, per-call timeouts,
+    jittered exponential backoff on retryable errors, a circuit breaker and
+    in-flight deduplication of identical prompts. Works with any LangChain
+    chat model, so tests can pass a fake one. Use ``wrap(llm)`` in place of
+    the model inside a chain.
+
+    Coalesced callers each wait on a future of their own: cancelling a
+    waiter never affects the shared call, and if the caller running it is
+    cancelled the waiters retry instead of seeing its cancellation. The
+    synchronous ``invoke`` runs the async path on a gateway-owned event loop,
+    so a timeout cancels the model call rather than abandoning a thread
+    (models without a native ``ainvoke`` still run ``invoke`` in LangChain's
+    executor).
+    """
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 1_000_000,
+                 max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 timeout: float = 60.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 retryable: Callable[[Exception], bool] = is_retryable):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.retryable = retryable
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "timeouts": 0,
+                       "deduplicated": 0, "rate_limited_s": 0.0, "short_circuited": 0}
+
+    def wrap(self, llm) -> "RunnableLambda":
+        """Runnable that routes a chain's model call through the gateway"""
+        from langchain_core.runnables import RunnableLambda
+        return RunnableLambda(
+            lambda prompt: self.invoke(llm, prompt),
+            afunc=lambda prompt: self.ainvoke(llm, prompt),
+            name=f"gateway[{getattr(llm, 'model', type(llm).__name__)}]"
+        )
+
+    def invoke(self, llm, prompt) -> Any:
+        """Blocking call (not from the gateway's own loop)"""
+        return asyncio.run_coroutine_threadsafe(self.ainvoke(llm, prompt), self._background_loop()).result()
+
+    async def ainvoke(self, llm, prompt) -> Any:
+        while True:
+            key, shared, leader = self._join_inflight(llm, prompt)
+            if leader:
+                return await self._lead(key, shared, llm, prompt)
+            try:
+                return await _wait_shared(shared)
+            except _LeaderCancelled:
+                continue
+
+    async def astream(self, llm, prompt) -> AsyncIterator[Any]:
+        """Stream chunks with rate limiting and the circuit breaker (no mid-stream retries)
+
+        Every chunk, the first included, must arrive within ``timeout``
+        seconds; a stalled stream raises LLMUnavailableError.
+        """
+        probe = await self._async_admit(prompt)
+        chunks = llm.astream(prompt).__aiter__()
+        settled = False
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError as e:
+                    settled = True
+                    self._count("timeouts")
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    raise LLMUnavailableError(f"LLM stream stalled for {self.timeout:g}s") from e
+                except Exception as e:
+                    settled = True
+                    self._count("failures")
+                    if self.retryable(e):
+                        self.breaker.record_failure()
+                    else:
+                        # The provider answered; this says nothing about its availability
+                        self.breaker.record_success()
+                    raise
+                yield chunk
+            settled = True
+            self.breaker.record_success()
+        finally:
+            if not settled and probe:
+                # The consumer stopped early or was cancelled
+                self.breaker.abandon_probe()
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {**self._stats, "circuit_state": self.breaker.state,
+                    "inflight": len(self._inflight)}
+
+    async def _lead(self, key: str, shared: concurrent.futures.Future, llm, prompt) -> Any:
+        """Run the call for everyone waiting on ``key`` and hand them the outcome"""
+        try:
+            result = await self._acall_with_retries(llm, prompt)
+        except asyncio.CancelledError:
+            self._settle(key, shared, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._settle(key, shared, error=e)
+            raise
+        self._settle(key, shared, result=result)
+        return result
+
+    def _settle(self, key: str, shared: concurrent.futures.Future, result: Any = None,
+                error: Optional[BaseException] = None) -> None:
+        # Leave the table first, so waiters that retry start a new call instead of rejoining this one
+        with self._inflight_lock:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+        if shared.done():
+            return
+        if error is not None:
+            shared.set_exception(error)
+        else:
+            shared.set_result(result)
+
+    async def _acall_with_retries(self, llm, prompt) -> Any:
+        for attempt in range(self.max_retries + 1):
+            probe = False
+            try:
+                probe = await self._async_admit(prompt)
+                result = await asyncio.wait_for(llm.ainvoke(prompt), timeout=self.timeout)
+            except asyncio.CancelledError:
+                if probe:
+                    self.breaker.abandon_probe()
+                raise
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._on_error(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _admit(self, prompt) -> Tuple[float, bool]:
+        """Check the breaker and reserve rate-limit capacity; returns (wait in seconds, is probe)"""
+        try:
+            probe = self.breaker.before_call()
+        except CircuitOpenError:
+            self._count("short_circuited")
+            raise
+        self._count("calls")
+        wait = max(self.request_bucket.reserve(1),
+                   self.token_bucket.reserve(estimate_tokens(self._prompt_text(prompt))))
+        if wait:
+            self._count("rate_limited_s", wait)
+        return wait, probe
+
+    async def _async_admit(self, prompt) -> bool:
+        wait, probe = self._admit(prompt)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                if probe:
+                    self.breaker.abandon_probe()
+                raise
+        return probe
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _on_error(self, error: Exception, attempt: int) -> float:
+        """Record a failed attempt; raise if it should not be retried, else return the backoff"""
+        timed_out = isinstance(error, (asyncio.TimeoutError, concurrent.futures.TimeoutError))
+        if timed_out:
+            self._count("timeouts")
+        retryable = timed_out or self.retryable(error)
+        if retryable:
+            self.breaker.record_failure()
+        if not retryable:
+            # The provider answered (e.g. a 400), so a half-open breaker closes again
+            self.breaker.record_success()
+            self._count("failures")
+            raise error
+        if attempt >= self.max_retries:
+            self._count("failures")
+            detail = f"timed out after {self.timeout:g}s" if timed_out else str(error)
+            raise LLMUnavailableError(f"LLM call failed after {attempt + 1} attempts: {detail}") from error
+        self._count("retries")
+        # Full jitter: uniform in [0, min(max_delay, base * 2^attempt)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _join_inflight(self, llm, prompt):
+        key = self._dedup_key(llm, prompt)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._count("deduplicated")
+                return key, future, False
+            future = concurrent.futures.Future()
+            self._inflight[key] = future
+            return key, future, True
+
+    def _dedup_key(self, llm, prompt) -> str:
+        model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+        temperature = getattr(llm, "temperature", None)
+        return sha256_text(f"{id(llm)}|{model}|{temperature}|{self._prompt_text(prompt)}")
+
+    @staticmethod
+    def _prompt_text(prompt) -> str:
+        if hasattr(prompt, "to_string"):
+            return prompt.to_string()
+        return str(prompt)
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._stats_lock:
+            self._stats[name] += amount
+
+
+async def _wait_shared(shared: concurrent.futures.Future) -> Any:
+    """Await a coalesced call through a future of our own, so cancelling this waiter cancels nothing else"""
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+
+    def relay(done: concurrent.futures.Future) -> None:
+        try:
+            loop.call_soon_threadsafe(_copy_outcome, done, waiter)
+        except RuntimeError:
+            pass  # the waiter's loop is already closed
+
+    shared.add_done_callback(relay)
+    return await waiter
+
+
+def _copy_outcome(source: concurrent.futures.Future, target: asyncio.Future) -> None:
+    if target.done():
+        return  # the waiter was cancelled
+    error = source.exception()
+    if error is not None:
+        target.set_exception(error)
+    else:
+        target.set_result(source.result())
+
+
+_default_gateway: Optional[LLMGateway] = None
+_default_gateway_lock = threading.Lock()
+
+
+def get_default_gateway() -> LLMGateway:
+    """Process-wide gateway shared by InvoiceAnalyzer and Chatbot"""
+    global _default_gateway
+    if _default_gateway is None:
+        with _default_gateway_lock:
+            if _default_gateway is None:
+                _default_gateway = LLMGateway(
+                    requests_per_minute=float(os.getenv("LLM_RPM", "60")),
+                    tokens_per_minute=float(os.getenv("LLM_TPM", "1000000")),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                    timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+                    failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+                    reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30"))
+                )
+    return _default_gateway
@@ -1,35 +1,100 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+# langchain and the Gemini client are imported inside the constructors so
+# importing this module (e.g. at API startup) stays cheap
 import os
-from app.models.schemas import ReimbursementStatus, AnalysisResult
-from typing import Dict, Any
+from app.models.schemas import ReimbursementStatus, AnalysisResult, PolicyDocument
+from app.services.chat_context import ContextBuilder, history_messages, next_history, window_history
+from app.services.llm_gateway import LLMGateway, LLMUnavailableError, get_default_gateway
+from app.services.response_cache import ResponseCache
+from app.services.rules_engine import RuleEngine
+from app.services import telemetry
+from app.services.text_utils import estimate_tokens, sha256_text
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
+import asyncio
+import json
+import logging
 import re
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class InvoiceAnalyzer:
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens for gemini-1.5-flash (prompts <= 128k tokens)
+INPUT_PRICE_PER_M = float(os.getenv("LLM_INPUT_PRICE_PER_M", "0.075"))
+OUTPUT_PRICE_PER_M = float(os.getenv("LLM_OUTPUT_PRICE_PER_M", "0.30"))
+
+class LLMUsageStats:
+    """Per-mode LLM call accounting: throughput and estimated cost per invoice"""
+
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            temperature=0,
-            google_api_key=os.getenv("GEMINI_API_KEY")
-        )
+        self._lock = threading.Lock()
+        self._modes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, invoices: int, prompt_tokens: int, completion_tokens: int,
+               elapsed_s: float) -> None:
+        with self._lock:
+            stats = self._modes.setdefault(mode, {
+                "calls": 0, "invoices": 0, "prompt_tokens": 0, "completion_tokens": 0, "elapsed_s": 0.0
+            })
+            stats["calls"] += 1
+            stats["invoices"] += invoices
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["elapsed_s"] += elapsed_s
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            report = {}
+            for mode, stats in self._modes.items():
+                cost = (stats["prompt_tokens"] * INPUT_PRICE_PER_M
+                        + stats["completion_tokens"] * OUTPUT_PRICE_PER_M) / 1_000_000
+                invoices = stats["invoices"] or 1
+                report[mode] = {
+                    **stats,
+                    "invoices_per_llm_second": stats["invoices"] / stats["elapsed_s"] if stats["elapsed_s"] else 0.0,
+                    "tokens_per_invoice": (stats["prompt_tokens"] + stats["completion_tokens"]) / invoices,
+                    "cost_usd": cost,
+                    "cost_per_invoice_usd": cost / invoices,
+                }
+            return report
+
+def _gemini_client(model: str, temperature: float):
+    """Gemini chat model; retries and rate limiting are left to the gateway"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        google_api_key=os.getenv("GEMINI_API_KEY"),
+        max_retries=1
+    )
+
+class InvoiceAnalyzer:
+    MODEL_NAME = "gemini-1.5-flash"
+    # Bump whenever the analysis prompt changes so cached responses are not reused
+    PROMPT_VERSION = "3"
+    BATCH_PROMPT_VERSION = "batch-2"
+
+    def __init__(self, cache: Optional[ResponseCache] = None, rules: Optional[RuleEngine] = None,
+                 batch_token_budget: int = 12000, max_batch_size: int = 10,
+                 gateway: Optional[LLMGateway] = None, llm=None):
+        self.cache = cache
+        self.rules = rules
+        self.batch_token_budget = batch_token_budget
+        self.max_batch_size = max_batch_size
+        self.usage = LLMUsageStats()
+        self.gateway = gateway or get_default_gateway()
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.prompts import ChatPromptTemplate
+        self.llm = llm or _gemini_client(self.MODEL_NAME, temperature=0)
         self.output_parser = StrOutputParser()
         
         # Define the prompt as a template
         self.prompt_template = ChatPromptTemplate.from_messages([
             ("system", """You are an expert invoice reimbursement analyst for IAI Solution. 
-            Analyze the invoice against the provided policy and determine reimbursement status:
-            
-            Policy Guidelines to Consider:
-            1. Food/Beverages: ₹200/meal max (alcohol strictly excluded)
-            2. Travel: 
-               - Flights/Buses: ₹2000/trip max (inclusive of all taxes)
-               - Cabs: ₹150/day for office commutes (toll fees excluded)
-            3. Accommodation: ₹500/night max
+            Analyze the invoice against the provided policy and determine reimbursement status.
+            The COMPANY POLICY section lists the per-category limits, conditions and exclusions to apply.
             
             Required Analysis:
             1. Determine expense category
@@ -51,26 +116,262 @@ class InvoiceAnalyzer:
         ])
         
         # Create the chain
-        self.analysis_chain = self.prompt_template | self.llm | self.output_parser
+        self.analysis_chain = self.prompt_template | self.gateway.wrap(self.llm) | self.output_parser
+
+        # Batch mode: several invoices per call, answered as a JSON array
+        self.batch_prompt_template = ChatPromptTemplate.from_messages([
+            ("system", """You are an expert invoice reimbursement analyst for IAI Solution.
+            Analyze EACH invoice independently against the provided policy.
+            The COMPANY POLICY section lists the per-category limits, conditions and exclusions to apply.
+            
+            Respond with ONLY a JSON array (no markdown, no prose) containing exactly one
+            object per invoice, in the same order, each with an "invoice_index" key plus
+            the fields of this JSON schema:
+            {schema}
+            "status" must be one of "Fully Reimbursed", "Partially Reimbursed", "Declined"."""),
+            ("human", "COMPANY POLICY:\n{policy_text}\n\nINVOICES:\n{invoices}")
+        ])
+        self.batch_chain = self.batch_prompt_template | self.gateway.wrap(self.llm) | self.output_parser
+        self._result_schema = json.dumps(AnalysisResult.model_json_schema())
+
+    @telemetry.traced("llm_analyze")
+    def analyze_invoice(self, policy: Union[str, PolicyDocument], invoice_text: str,
+                        bypass_cache: bool = False) -> AnalysisResult:
+        resolved = self._apply_rules(policy, invoice_text, bypass_cache)
+        if resolved is not None:
+            return resolved
+
+        cache_key, cached = self._cache_lookup(policy, invoice_text, bypass_cache)
+        if cached is not None:
+            return cached
 
-    def analyze_invoice(self, policy_text: str, invoice_text: str) -> AnalysisResult:
         try:
             # Invoke the chain
-            response = self.analysis_chain.invoke({
-                "policy_text": policy_text,
+            started = time.perf_counter()
+            inputs = {
+                "policy_text": self._policy_prompt_text(policy),
                 "invoice_text": invoice_text
-            })
+            }
+            response = self.analysis_chain.invoke(inputs)
+            self._record_usage("single", 1, self.prompt_template, inputs, response, started)
             
-            return self._parse_response(response)
+            result = self._parse_response(response)
+        except LLMUnavailableError:
+            # Provider outages are not a verdict on the invoice; let callers retry or fail it
+            raise
         except Exception as e:
-            # Fallback response if parsing fails
-            return AnalysisResult(
-                status=ReimbursementStatus.DECLINED,
-                reimbursed_amount=0.0,
-                requested_amount=0.0,
-                reason=f"Analysis failed: {str(e)}",
-                policy_references=[]
-            )
+            return self._fallback_result(e)
+
+        self._cache_store(cache_key, response, result, bypass_cache)
+        return result
+
+    @telemetry.traced("llm_analyze")
+    async def aanalyze_invoice(self, policy: Union[str, PolicyDocument], invoice_text: str,
+                               bypass_cache: bool = False) -> AnalysisResult:
+        """Async variant of analyze_invoice that does not block the event loop"""
+        resolved = self._apply_rules(policy, invoice_text, bypass_cache)
+        if resolved is not None:
+            return resolved
+
+        cache_key, cached = self._cache_lookup(policy, invoice_text, bypass_cache)
+        if cached is not None:
+            return cached
+
+        response, result = await self._analyze_single_uncached(policy, invoice_text)
+        if response is not None:
+            self._cache_store(cache_key, response, result, bypass_cache)
+        return result
+
+    @telemetry.traced("llm_analyze_batch")
+    async def aanalyze_batch(self, policy: Union[str, PolicyDocument], invoice_texts: List[str],
+                             bypass_cache: bool = False) -> List[AnalysisResult]:
+        """Analyze many invoices with as few LLM calls as the token budget allows
+
+        Rules and cache hits are resolved first; the remaining invoices are
+        packed into prompts of at most ``batch_token_budget`` tokens. A batch
+        whose response does not validate is re-run one invoice at a time.
+        """
+        results: List[Optional[AnalysisResult]] = [None] * len(invoice_texts)
+        cache_keys: Dict[int, Optional[str]] = {}
+        pending = []
+        for index, invoice_text in enumerate(invoice_texts):
+            resolved = self._apply_rules(policy, invoice_text, bypass_cache)
+            if resolved is None:
+                key, resolved = self._cache_lookup(policy, invoice_text, bypass_cache,
+                                                   self.BATCH_PROMPT_VERSION)
+                cache_keys[index] = key
+            if resolved is not None:
+                results[index] = resolved
+            else:
+                pending.append(index)
+
+        batches = self.pack_batches([invoice_texts[i] for i in pending], policy)
+        outcomes = await asyncio.gather(*(
+            self._run_batch(policy, [pending[i] for i in batch], invoice_texts)
+            for batch in batches
+        ))
+        for batch_results in outcomes:
+            for index, (raw, result) in batch_results.items():
+                results[index] = result
+                if raw is not None:
+                    self._cache_store(cache_keys.get(index), raw, result, bypass_cache)
+        return results
+
+    def analyze_batch(self, policy: Union[str, PolicyDocument], invoice_texts: List[str],
+                      bypass_cache: bool = False) -> List[AnalysisResult]:
+        """Synchronous wrapper around aanalyze_batch"""
+        return asyncio.run(self.aanalyze_batch(policy, invoice_texts, bypass_cache))
+
+    def pack_batches(self, invoice_texts: List[str],
+                     policy: Union[str, PolicyDocument, None] = None) -> List[List[int]]:
+        """Greedily group invoice indexes so each prompt stays within the token budget"""
+        overhead = estimate_tokens(self._policy_prompt_text(policy) or "") + 300
+        batches, current, used = [], [], overhead
+        for index, invoice_text in enumerate(invoice_texts):
+            cost = estimate_tokens(invoice_text) + 10
+            if current and (used + cost > self.batch_token_budget or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, used = [], overhead
+            current.append(index)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _run_batch(self, policy: Union[str, PolicyDocument], indexes: List[int],
+                         invoice_texts: List[str]) -> Dict[int, Tuple[Optional[str], AnalysisResult]]:
+        """Run one packed prompt; fall back to single calls if it cannot be parsed"""
+        if len(indexes) > 1:
+            try:
+                started = time.perf_counter()
+                inputs = {
+                    "schema": self._result_schema,
+                    "policy_text": self._policy_prompt_text(policy),
+                    "invoices": "\n\n".join(
+                        f"### Invoice {position}\n{invoice_texts[index]}"
+                        for position, index in enumerate(indexes)
+                    )
+                }
+                response = await self.batch_chain.ainvoke(inputs)
+                try:
+                    parsed = self._parse_batch_response(response, len(indexes))
+                except Exception:
+                    # Tokens are spent either way; invoices only count once validated
+                    self._record_usage("batch", 0, self.batch_prompt_template, inputs, response, started)
+                    raise
+                self._record_usage("batch", len(indexes), self.batch_prompt_template, inputs, response, started)
+                return {
+                    index: (json.dumps(parsed[position][1], ensure_ascii=False), parsed[position][0])
+                    for position, index in enumerate(indexes)
+                }
+            except LLMUnavailableError:
+                raise
+            except Exception:
+                # Unparseable batch: re-run these invoices one at a time below
+                pass
+
+        singles = await asyncio.gather(*(
+            self._analyze_single_uncached(policy, invoice_texts[index]) for index in indexes
+        ))
+        return dict(zip(indexes, singles))
+
+    async def _analyze_single_uncached(self, policy: Union[str, PolicyDocument],
+                                       invoice_text: str) -> Tuple[Optional[str], AnalysisResult]:
+        try:
+            started = time.perf_counter()
+            inputs = {
+                "policy_text": self._policy_prompt_text(policy),
+                "invoice_text": invoice_text
+            }
+            response = await self.analysis_chain.ainvoke(inputs)
+            self._record_usage("single", 1, self.prompt_template, inputs, response, started)
+            return response, self._parse_response(response)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            return None, self._fallback_result(e)
+
+    def _parse_batch_response(self, text: str, expected: int) -> List[Tuple[AnalysisResult, Dict]]:
+        """Validate a JSON array response straight into AnalysisResult objects"""
+        payload = text.strip()
+        fenced = re.search(r'```(?:json)?\s*(.*?)```', payload, re.DOTALL)
+        if fenced:
+            payload = fenced.group(1)
+        items = json.loads(payload)
+        if not isinstance(items, list) or len(items) != expected:
+            raise ValueError(f"Expected a JSON array of {expected} results")
+
+        ordered: List[Optional[Tuple[AnalysisResult, Dict]]] = [None] * expected
+        for position, item in enumerate(items):
+            index = item.pop("invoice_index", position)
+            if not isinstance(index, int) or not 0 <= index < expected or ordered[index] is not None:
+                raise ValueError(f"Invalid invoice_index {index!r}")
+            ordered[index] = (AnalysisResult.model_validate(item), item)
+        return ordered
+
+    def _record_usage(self, mode: str, invoices: int, template: "ChatPromptTemplate",
+                      inputs: Dict[str, str], response: str, started: float) -> None:
+        prompt_tokens = sum(
+            estimate_tokens(str(message.content)) for message in template.format_messages(**inputs)
+        )
+        completion_tokens = estimate_tokens(response)
+        self.usage.record(mode, invoices, prompt_tokens, completion_tokens, time.perf_counter() - started)
+        telemetry.LLM_TOKENS.inc(prompt_tokens, mode=mode, direction="prompt")
+        telemetry.LLM_TOKENS.inc(completion_tokens, mode=mode, direction="completion")
+
+    def _apply_rules(self, policy: Union[str, PolicyDocument], invoice_text: str,
+                     bypass_cache: bool = False) -> Optional[AnalysisResult]:
+        """Resolve clear-cut invoices deterministically before any LLM call
+
+        Skipped with ``bypass_cache`` so audits always reach the model.
+        """
+        if self.rules is None or bypass_cache:
+            return None
+        return self.rules.evaluate(invoice_text, policy)
+
+    def _cache_lookup(self, policy: Union[str, PolicyDocument], invoice_text: str,
+                      bypass_cache: bool,
+                      prompt_version: Optional[str] = None) -> Tuple[Optional[str], Optional[AnalysisResult]]:
+        """Return (cache key, cached result) for this invoice/policy pair"""
+        if self.cache is None:
+            return None, None
+        policy_hash = policy.policy_hash if isinstance(policy, PolicyDocument) else sha256_text(policy)
+        key = ResponseCache.make_key(self.MODEL_NAME, prompt_version or self.PROMPT_VERSION,
+                                     policy_hash, invoice_text)
+        entry = self.cache.get(key, bypass=bypass_cache)
+        result = None
+        if entry is not None:
+            try:
+                result = AnalysisResult.model_validate(entry["result"])
+            except (KeyError, ValueError):
+                pass
+        telemetry.CACHE_REQUESTS.inc(cache="llm_response", result="miss" if result is None else "hit")
+        return key, result
+
+    def _cache_store(self, key: Optional[str], response: str, result: AnalysisResult,
+                     bypass_cache: bool) -> None:
+        # Only successfully parsed responses are cached; failures are retried next time
+        if self.cache is not None and key is not None:
+            self.cache.put(key, response, result.model_dump(mode="json"), bypass=bypass_cache)
+
+    @staticmethod
+    def _policy_prompt_text(policy: Union[str, PolicyDocument]) -> str:
+        """Compact rules for preprocessed policies, raw text otherwise"""
+        if isinstance(policy, PolicyDocument):
+            return policy.compact_text
+        return policy
+
+    def _fallback_result(self, error: Exception) -> AnalysisResult:
+        """Fallback response if the LLM call or parsing fails"""
+        telemetry.current_span().fail()
+        return AnalysisResult(
+            category="Unknown",
+            status=ReimbursementStatus.DECLINED,
+            reimbursed_amount=0.0,
+            requested_amount=0.0,
+            reason=f"Analysis failed: {str(error)}",
+            policy_references=[]
+        )
     
     def _parse_response(self, text: str) -> AnalysisResult:
         try:
@@ -105,37 +406,90 @@ class InvoiceAnalyzer:
         return [line.strip() for line in ref_section.split("\n") if line.strip().startswith("-")]
 
 class Chatbot:
-    def __init__(self, vector_db):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            temperature=0.3,
-            google_api_key=os.getenv("GEMINI_API_KEY")
-        )
-        self.vector_db = vector_db
-        self.output_parser = StrOutputParser()
+    """Answers questions about stored analyses, grounded in retrieved invoices
+
+    ``retriever`` is a HybridRetriever (or anything with the same ``search``).
+    Retrieved hits go through a ContextBuilder and the client-supplied
+    history through window_history, so the prompt stays bounded. Answers are
+    streamed through the gateway and time-to-first-token is logged.
+    """
+
+    def __init__(self, retriever, gateway: Optional[LLMGateway] = None, llm=None,
+                 context_builder: Optional[ContextBuilder] = None, history_messages: int = 6,
+                 history_token_budget: int = 1000):
+        self.gateway = gateway or get_default_gateway()
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        self.llm = llm or _gemini_client("gemini-1.5-flash", temperature=0.3)
+        self.retriever = retriever
+        self.context_builder = context_builder or ContextBuilder()
+        self.history_messages = history_messages
+        self.history_token_budget = history_token_budget
         
         # Define the prompt template
         self.prompt_template = ChatPromptTemplate.from_messages([
-            ("system", """You are an invoice reimbursement assistant. Use the provided invoice data to answer questions.
+            ("system", """You are an invoice reimbursement assistant. Use only the provided invoice data to answer questions.
+            If the invoices do not contain the answer, say so.
             Respond in clear markdown format with:
             - **Answer**: Direct response to query
-            - **Sources**: Relevant invoice excerpts
+            - **Sources**: Relevant invoice ids in [n] form
             - **Confidence**: High/Medium/Low"""),
+            MessagesPlaceholder("history"),
             ("human", """User query: {query}
             
             Relevant invoices:
             {search_results}""")
         ])
-        
-        # Create the chain
-        self.chat_chain = self.prompt_template | self.llm | self.output_parser
 
-    def query_invoices(self, user_query: str, chat_history: list = None):
-        search_results = self.vector_db.search_with_filters(user_query)
-        
-        response = self.chat_chain.invoke({
-            "query": user_query,
-            "search_results": search_results
-        })
-        
-        return response
\ No newline at end of file
+    def prepare(self, user_query: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                filters: Optional[Dict] = None, k: Optional[int] = None,
+                cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Retrieve, build the bounded context and format the prompt"""
+        with telemetry.span("retrieve"):
+            page = self.retriever.search(user_query, filters, k, cursor)
+        context, sources = self.context_builder.build(page["results"])
+        history = window_history(chat_history, self.history_messages, self.history_token_budget)
+        prompt = self.prompt_template.format_prompt(
+            query=user_query,
+            search_results=context or "No matching invoices.",
+            history=history_messages(history)
+        )
+        return {"prompt": prompt, "sources": sources, "history": history,
+                "next_cursor": page.get("next_cursor")}
+
+    async def astream(self, prepared: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream answer text for a prepared prompt, logging time-to-first-token"""
+        started = time.perf_counter()
+        first_token_ms = None
+        async for chunk in self.gateway.astream(self.llm, prepared["prompt"]):
+            text = _chunk_text(chunk)
+            if not text:
+                continue
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+                prepared["first_token_ms"] = first_token_ms
+                telemetry.CHAT_FIRST_TOKEN.observe(first_token_ms / 1000)
+                logger.info("chat time_to_first_token_ms=%.1f sources=%d",
+                            first_token_ms, len(prepared["sources"]))
+            yield text
+        prepared["total_ms"] = (time.perf_counter() - started) * 1000
+        # A span cannot straddle the yields of this generator, so the stage is observed directly
+        telemetry.SPAN_SECONDS.observe(prepared["total_ms"] / 1000, span="chat_llm")
+
+    async def aquery(self, user_query: str, chat_history: Optional[List[Dict[str, str]]] = None,
+                     filters: Optional[Dict] = None, k: Optional[int] = None,
+                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        prepared = await asyncio.to_thread(self.prepare, user_query, chat_history, filters, k, cursor)
+        answer = "".join([text async for text in self.astream(prepared)])
+        return {**prepared, "response": answer,
+                "history": next_history(prepared["history"], user_query, answer)}
+
+    def query_invoices(self, user_query: str, chat_history: list = None,
+                       filters: Optional[Dict] = None, k: Optional[int] = None) -> Dict[str, Any]:
+        return asyncio.run(self.aquery(user_query, chat_history, filters, k))
+
+
+def _chunk_text(chunk) -> str:
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content if isinstance(content, str) else str(content)
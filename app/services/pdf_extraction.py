@@ -0,0 +1,235 @@
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from app.models.schemas import PDFExtractionResult
+from app.services.text_utils import sha256_bytes
+
+
+class PDFBackend:
+    """Interface for PDF text extraction libraries"""
+    name = "base"
+    # Page threads only help when the library does its work outside the GIL
+    releases_gil = False
+
+    @classmethod
+    def available(cls) -> bool:
+        raise NotImplementedError
+
+    def open(self, data: bytes):
+        """Open a document handle; each worker thread opens its own"""
+        raise NotImplementedError
+
+    def page_count(self, document) -> int:
+        raise NotImplementedError
+
+    def page_text(self, document, page_number: int, layout: bool = False) -> str:
+        raise NotImplementedError
+
+    def close(self, document) -> None:
+        pass
+
+
+class PyMuPDFBackend(PDFBackend):
+    """PyMuPDF (fitz): C-based and much faster than the pure-Python parsers"""
+    name = "pymupdf"
+    releases_gil = True
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import fitz  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open(self, data: bytes):
+        import fitz
+        return fitz.open(stream=data, filetype="pdf")
+
+    def page_count(self, document) -> int:
+        return document.page_count
+
+    def page_text(self, document, page_number: int, layout: bool = False) -> str:
+        # sort=True orders blocks top-to-bottom, left-to-right
+        return document[page_number].get_text("text", sort=layout) or ""
+
+    def close(self, document) -> None:
+        document.close()
+
+
+class PypdfBackend(PDFBackend):
+    """pypdf, the maintained successor of PyPDF2, with layout-mode extraction"""
+    name = "pypdf"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import pypdf  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open(self, data: bytes):
+        from pypdf import PdfReader
+        return PdfReader(io.BytesIO(data))
+
+    def page_count(self, document) -> int:
+        return len(document.pages)
+
+    def page_text(self, document, page_number: int, layout: bool = False) -> str:
+        page = document.pages[page_number]
+        if layout:
+            return page.extract_text(extraction_mode="layout") or ""
+        return page.extract_text() or ""
+
+
+class PyPDF2Backend(PDFBackend):
+    """PyPDF2 (the original extractor, always installed)"""
+    name = "pypdf2"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import PyPDF2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open(self, data: bytes):
+        from PyPDF2 import PdfReader
+        return PdfReader(io.BytesIO(data))
+
+    def page_count(self, document) -> int:
+        return len(document.pages)
+
+    def page_text(self, document, page_number: int, layout: bool = False) -> str:
+        # extract_text() returns None for image-only pages
+        return document.pages[page_number].extract_text() or ""
+
+
+# Fastest first; the first installed backend is used unless one is requested
+BACKENDS = [PyMuPDFBackend, PypdfBackend, PyPDF2Backend]
+
+
+def get_backend(name: Optional[str] = None) -> PDFBackend:
+    """Return the named backend, or the fastest one that is installed"""
+    for backend_cls in BACKENDS:
+        if name and backend_cls.name != name:
+            continue
+        if backend_cls.available():
+            return backend_cls()
+        if name:
+            raise ValueError(f"PDF backend '{name}' is not installed")
+    raise ValueError(f"Unknown or unavailable PDF backend: {name or 'any'}")
+
+
+class PDFExtractionEngine:
+    """Page-parallel PDF text extraction with a page cap and a hash-keyed cache
+
+    With a backend that releases the GIL (PyMuPDF), documents with at least
+    ``parallel_threshold`` pages are split into contiguous page ranges
+    extracted on a thread pool, each range with its own document handle.
+    The pure-Python backends read pages sequentially: their threads would
+    only contend for the GIL and re-parse the document. Only the first
+    ``max_pages`` pages are read.
+    """
+
+    def __init__(self, backend: Optional[PDFBackend] = None, max_pages: int = 50,
+                 parallel_threshold: int = 8, max_workers: int = 4,
+                 cache_size: int = 256, layout: bool = False):
+        self.backend = backend or get_backend()
+        self.max_pages = max_pages
+        self.parallel_threshold = parallel_threshold
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.layout = layout
+        self._cache: "OrderedDict[str, PDFExtractionResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def extract(self, data: bytes) -> PDFExtractionResult:
+        key = sha256_bytes(data)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached.model_copy(update={"cached": True})
+
+        result = self._extract_uncached(data)
+
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _extract_uncached(self, data: bytes) -> PDFExtractionResult:
+        started = time.perf_counter()
+        document = self.backend.open(data)
+        try:
+            page_count = self.backend.page_count(document)
+            pages = list(range(min(page_count, self.max_pages)))
+            if (not self.backend.releases_gil or len(pages) < self.parallel_threshold
+                    or self.max_workers <= 1):
+                extracted = self._extract_range(pages, document)
+            else:
+                extracted = self._extract_parallel(data, pages)
+        finally:
+            self.backend.close(document)
+
+        return PDFExtractionResult(
+            text="".join(text for text, _ in extracted),
+            backend=self.backend.name,
+            page_count=page_count,
+            pages_extracted=len(pages),
+            truncated=len(pages) < page_count,
+            page_timings_ms=[elapsed for _, elapsed in extracted],
+            total_ms=(time.perf_counter() - started) * 1000
+        )
+
+    def _extract_parallel(self, data: bytes, pages: List[int]) -> List[Tuple[str, float]]:
+        workers = min(self.max_workers, len(pages))
+        chunk_size = -(-len(pages) // workers)
+        chunks = [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(lambda chunk: self._extract_range(chunk, None, data), chunks)
+            return [page for part in parts for page in part]
+
+    def _extract_range(self, pages: Sequence[int], document=None,
+                       data: Optional[bytes] = None) -> List[Tuple[str, float]]:
+        """Extract a page range, returning (text, elapsed ms) per page"""
+        own_document = document is None
+        if own_document:
+            document = self.backend.open(data)
+        try:
+            extracted = []
+            for page_number in pages:
+                started = time.perf_counter()
+                text = self.backend.page_text(document, page_number, layout=self.layout)
+                extracted.append((text, (time.perf_counter() - started) * 1000))
+            return extracted
+        finally:
+            if own_document:
+                self.backend.close(document)
+
+
+_default_engine: Optional[PDFExtractionEngine] = None
+_default_engine_lock = threading.Lock()
+
+
+def get_default_engine() -> PDFExtractionEngine:
+    """Process-wide engine configured from PDF_BACKEND / PDF_MAX_PAGES / PDF_LAYOUT"""
+    global _default_engine
+    if _default_engine is None:
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = PDFExtractionEngine(
+                    backend=get_backend(os.getenv("PDF_BACKEND") or None),
+                    max_pages=int(os.getenv("PDF_MAX_PAGES", "50")),
+                    layout=os.getenv("PDF_LAYOUT", "").lower() in ("1", "true", "yes")
+                )
+    return _default_engine
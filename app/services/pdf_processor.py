@@ -1,15 +1,40 @@
 import zipfile
-from PyPDF2 import PdfReader
-from typing import List, Dict
-import io
+from app.services import telemetry
+from app.services.pdf_extraction import get_default_engine
+from app.models.schemas import PDFExtractionResult
+from typing import Container, List, Dict, IO, Iterator, Optional, Tuple
+import os
 import re
+import shutil
+import tempfile
 
+# Zip bomb guards for uploaded invoice archives
+MAX_ZIP_MEMBERS = 1000
+MAX_MEMBER_SIZE = 50 * 1024 * 1024
+MAX_TOTAL_SIZE = 500 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 100
+# Uploads/members larger than this are spooled to disk instead of memory
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+COPY_CHUNK_SIZE = 64 * 1024
+
+class ZipLimitError(ValueError):
+    """Raised when an uploaded ZIP exceeds the configured safety limits"""
+
+@telemetry.traced("pdf_extract")
 def extract_text_from_pdf(pdf_file) -> str:
-    reader = PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text()
-    return text
+    """Extract text from a PDF path or file object"""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as f:
+            return extract_text_from_bytes(f.read())
+    return extract_text_from_bytes(pdf_file.read())
+
+def extract_text_from_bytes(data: bytes) -> str:
+    """Extract text from raw PDF bytes (picklable entry point for process pools)"""
+    return get_default_engine().extract(data).text
+
+def extract_pdf_from_bytes(data: bytes) -> PDFExtractionResult:
+    """Text plus page count, truncation and per-page timings (picklable, for process pools)"""
+    return get_default_engine().extract(data)
 
 def extract_amounts_from_text(text: str) -> Dict[str, float]:
     """Extract currency amounts from invoice text"""
@@ -20,13 +45,101 @@ def extract_amounts_from_text(text: str) -> Dict[str, float]:
         amounts['INR'] = float(inr_amounts[-1])  # Assuming last amount is total
     return amounts
 
+def spool_upload(fileobj, max_memory: int = SPOOL_MAX_MEMORY) -> IO[bytes]:
+    """Copy an upload stream into a temp file that only spills to disk when large"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    shutil.copyfileobj(fileobj, spooled, COPY_CHUNK_SIZE)
+    spooled.seek(0)
+    return spooled
+
+def iter_zip_invoices(zip_file, max_members: int = MAX_ZIP_MEMBERS,
+                      max_member_size: int = MAX_MEMBER_SIZE,
+                      max_compression_ratio: float = MAX_COMPRESSION_RATIO,
+                      spool_max_memory: int = SPOOL_MAX_MEMORY,
+                      skip: Optional[Container[int]] = None,
+                      max_total_size: int = MAX_TOTAL_SIZE) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Lazily yield (filename, stream) for each PDF in a ZIP
+
+    Accepts a path or a file object. Non-seekable streams are spooled first.
+    Each member is decompressed into its own spooled temp file, so memory use
+    stays flat regardless of archive size; callers should close the streams.
+    PDFs whose position (as in list_zip_invoices) is in ``skip`` are not
+    decompressed or yielded. Raises ZipLimitError when the archive exceeds
+    the member count, per-member size, total size or compression ratio
+    limits (declared sizes are checked up front, actual ones while copying).
+    """
+    if hasattr(zip_file, "read") and not (hasattr(zip_file, "seekable") and zip_file.seekable()):
+        zip_file = spool_upload(zip_file, spool_max_memory)
+
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+        members = _pdf_members(zip_ref, max_members, max_member_size, max_compression_ratio,
+                               max_total_size)
+
+        total = 0
+        for position, info in enumerate(members):
+            if skip is not None and position in skip:
+                continue
+            stream = tempfile.SpooledTemporaryFile(max_size=spool_max_memory)
+            try:
+                total += _copy_member(zip_ref, info, stream, max_member_size, max_compression_ratio,
+                                      max_total_size - total)
+            except Exception:
+                stream.close()
+                raise
+            stream.seek(0)
+            yield info.filename, stream
+
+def list_zip_invoices(zip_file, max_members: int = MAX_ZIP_MEMBERS,
+                      max_member_size: int = MAX_MEMBER_SIZE,
+                      max_compression_ratio: float = MAX_COMPRESSION_RATIO,
+                      max_total_size: int = MAX_TOTAL_SIZE) -> List[str]:
+    """Names of the PDFs iter_zip_invoices would yield, validated but not decompressed"""
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+        return [info.filename for info in
+                _pdf_members(zip_ref, max_members, max_member_size, max_compression_ratio, max_total_size)]
+
+def _pdf_members(zip_ref: zipfile.ZipFile, max_members: int, max_member_size: int,
+                 max_compression_ratio: float, max_total_size: int) -> List[zipfile.ZipInfo]:
+    members = [
+        info for info in zip_ref.infolist()
+        if not info.is_dir() and info.filename.lower().endswith('.pdf')
+    ]
+    if len(members) > max_members:
+        raise ZipLimitError(f"ZIP contains {len(members)} PDFs (limit {max_members})")
+    # Validate declared sizes up front so a bad archive fails before any work starts
+    for info in members:
+        _check_member_limits(info.filename, info.file_size, info.compress_size,
+                             max_member_size, max_compression_ratio)
+    total = sum(info.file_size for info in members)
+    if total > max_total_size:
+        raise ZipLimitError(f"ZIP expands to {total} bytes of PDFs (limit {max_total_size})")
+    return members
+
+def _check_member_limits(filename: str, size: int, compressed_size: int,
+                         max_member_size: int, max_compression_ratio: float) -> None:
+    if size > max_member_size:
+        raise ZipLimitError(f"{filename} is {size} bytes (limit {max_member_size})")
+    if size and size / max(compressed_size, 1) > max_compression_ratio:
+        raise ZipLimitError(f"{filename} has a suspicious compression ratio")
+
+def _copy_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, stream: IO[bytes],
+                 max_member_size: int, max_compression_ratio: float, remaining_total: int) -> int:
+    """Decompress one member, enforcing limits on the actual (not declared) size; returns its size"""
+    written = 0
+    with zip_ref.open(info) as member:
+        while True:
+            chunk = member.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            _check_member_limits(info.filename, written, info.compress_size,
+                                 max_member_size, max_compression_ratio)
+            if written > remaining_total:
+                raise ZipLimitError(f"ZIP expands past the total size limit at {info.filename}")
+            stream.write(chunk)
+    return written
+
+@telemetry.traced("zip_unpack")
 def process_zip_invoices(zip_file) -> List[tuple]:
     """Process ZIP file containing multiple invoices"""
-    invoices = []
-    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-        for file_info in zip_ref.infolist():
-            if file_info.filename.lower().endswith('.pdf'):
-                with zip_ref.open(file_info) as file:
-                    content = file.read()
-                    invoices.append((file_info.filename, io.BytesIO(content)))
-    return invoices
\ No newline at end of file
+    return list(iter_zip_invoices(zip_file))
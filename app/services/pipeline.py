@@ -0,0 +1,387 @@
+import asyncio
+import itertools
+from concurrent.futures import Executor
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from app.models.schemas import PDFExtractionResult, PolicyDocument
+from app.services import telemetry
+from app.services.dedup import invoice_id_for
+from app.services.pdf_processor import extract_pdf_from_bytes
+from app.services.text_utils import sha256_bytes
+
+
+class _Deferred(NamedTuple):
+    """An invoice whose duplicate check waits for an in-flight original"""
+    data: bytes
+
+
+class InvoicePipeline:
+    """Bounded-concurrency analysis pipeline for a batch of invoices
+
+    Each invoice goes through three stages: PDF text extraction (offloaded to
+    ``executor``, typically a process pool), LLM analysis (``ainvoke`` guarded
+    by a semaphore) and a vector store write (buffered and flushed in batches
+    on a worker thread). A failure in one invoice never aborts the batch.
+
+    In batch mode each worker takes up to ``analysis_batch_size`` invoices
+    at a time and analyzes them with a single packed LLM prompt.
+
+    Invoice ids are derived from the PDF bytes. With a ``dedup`` index,
+    invoices already stored (same file, same text or near-identical text)
+    are answered with a "Duplicate" record instead of being re-processed;
+    ``bypass_cache`` re-analyzes them and replaces the stored result. An
+    invoice matching one that is still in flight is set aside and checked
+    again after the rest of the batch was stored, so it is only reported as
+    a duplicate if the original was stored (or is still running elsewhere).
+    """
+
+    def __init__(self, analyzer, vector_db, max_workers: int = 4,
+                 max_llm_calls: Optional[int] = None, write_batch_size: int = 16,
+                 executor: Optional[Executor] = None, analysis_batch_size: int = 8,
+                 dedup=None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.analyzer = analyzer
+        self.vector_db = vector_db
+        self.max_workers = max_workers
+        self.max_llm_calls = max_llm_calls or max_workers
+        self.write_batch_size = max(1, write_batch_size)
+        self.executor = executor
+        self.analysis_batch_size = max(1, analysis_batch_size)
+        self.dedup = dedup
+
+    async def run(self, policy: Union[str, PolicyDocument], invoices: Iterable[Tuple[str, object]],
+                  employee_name: str, bypass_cache: bool = False,
+                  batch_mode: bool = False) -> List[Dict]:
+        """Analyze every invoice and return results in the original ZIP order"""
+        results = {record["index"]: record async for record in self.stream(
+            policy, invoices, employee_name, bypass_cache=bypass_cache, batch_mode=batch_mode
+        )}
+        return [results[index] for index in sorted(results)]
+
+    async def stream(self, policy: Union[str, PolicyDocument], invoices: Iterable[Tuple[str, object]],
+                     employee_name: str, bypass_cache: bool = False,
+                     batch_mode: bool = False, durable: bool = False) -> AsyncIterator[Dict]:
+        """Yield each invoice's result as soon as it finishes (completion order)
+
+        Every record carries ``index``, its position in the ZIP, so callers can
+        restore the original order. With ``durable`` an analyzed invoice is
+        only yielded once its vector store batch has been written (with its
+        final status), so callers can checkpoint it. Otherwise it is yielded
+        before the write, and yielded again with status "Failed" if the write
+        fails; the later record for an ``index`` supersedes the earlier one.
+        """
+        loop = asyncio.get_running_loop()
+        llm_semaphore = asyncio.Semaphore(self.max_llm_calls)
+        invoice_iter = enumerate(iter(invoices))
+        iter_lock = asyncio.Lock()
+        group_size = self.analysis_batch_size if batch_mode else 1
+        finished: asyncio.Queue = asyncio.Queue()
+        pending_writes: List[Tuple[Dict, Dict]] = []
+        write_lock = asyncio.Lock()
+        claims: List[str] = []
+        deferred: List[Tuple[int, Tuple[str, bytes]]] = []
+        done = object()
+
+        async def flush(force: bool = False) -> None:
+            async with write_lock:
+                if not pending_writes or (not force and len(pending_writes) < self.write_batch_size):
+                    return
+                batch = pending_writes[:]
+                pending_writes.clear()
+            await self._write_batch(batch)
+            for response, _ in batch:
+                if durable or response["status"] == "Failed":
+                    finished.put_nowait(dict(response))
+
+        async def next_group() -> List:
+            # Sources may decompress on next(), so pull on a thread, one worker at a time
+            async with iter_lock:
+                with telemetry.span("zip_read"):
+                    return await asyncio.to_thread(lambda: list(itertools.islice(invoice_iter, group_size)))
+
+        async def next_deferred() -> List:
+            group = deferred[:group_size]
+            del deferred[:group_size]
+            return group
+
+        async def worker(groups, defer: bool) -> None:
+            # Workers pull lazily so at most max_workers groups are in flight
+            while True:
+                group = await groups()
+                if not group:
+                    return
+                records = await self._process_group(
+                    loop, llm_semaphore, group, policy, employee_name, bypass_cache, batch_mode, claims,
+                    deferred if defer else None
+                )
+                for index, record in records:
+                    record["response"]["index"] = index
+                    if not (durable and record.get("write")):
+                        finished.put_nowait(dict(record["response"]))
+                    if record.get("write"):
+                        async with write_lock:
+                            pending_writes.append((record["response"], record["write"]))
+                await flush()
+
+        async def produce() -> None:
+            try:
+                await asyncio.gather(*(worker(next_group, True) for _ in range(self.max_workers)))
+                await flush(force=True)
+                if deferred:
+                    # Their originals are now stored or released; check them once more
+                    await asyncio.gather(*(worker(next_deferred, False) for _ in range(self.max_workers)))
+                    await flush(force=True)
+            finally:
+                finished.put_nowait(done)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                record = await finished.get()
+                if record is done:
+                    break
+                yield record
+            await producer
+        finally:
+            # Consumer went away early (e.g. client disconnect): stop the workers
+            if not producer.done():
+                producer.cancel()
+            # Claims of invoices that were never stored must not turn resubmissions into duplicates
+            if self.dedup is not None:
+                for byte_hash in claims:
+                    self.dedup.release(byte_hash)
+
+    async def _process_group(self, loop, llm_semaphore: asyncio.Semaphore, group: List,
+                             policy: Union[str, PolicyDocument], employee_name: str,
+                             bypass_cache: bool, batch_mode: bool, claims: List[str],
+                             deferred: Optional[List] = None) -> List[Tuple[int, Dict]]:
+        """Extract and analyze a group of (index, (filename, stream)), isolating failures
+
+        Invoices matching one still in flight are appended to ``deferred``
+        as (index, (filename, bytes)) and get no record yet.
+        """
+        extracted = await asyncio.gather(*(
+            self._extract(loop, filename, invoice_file, bypass_cache, claims, defer=deferred is not None)
+            for _, (filename, invoice_file) in group
+        ))
+        records: Dict[int, Dict] = {}
+        ready = []
+        for (index, (filename, _)), (extraction, byte_hash, response) in zip(group, extracted):
+            if isinstance(response, _Deferred):
+                deferred.append((index, (filename, response.data)))
+            elif response is not None:
+                records[index] = {"response": response}
+            else:
+                ready.append((index, filename, extraction, byte_hash))
+
+        try:
+            if batch_mode and len(ready) > 1:
+                async with llm_semaphore:
+                    analyses = await self.analyzer.aanalyze_batch(
+                        policy, [extraction.text for _, _, extraction, _ in ready], bypass_cache=bypass_cache
+                    )
+            else:
+                analyses = []
+                for _, _, extraction, _ in ready:
+                    async with llm_semaphore:
+                        analyses.append(await self.analyzer.aanalyze_invoice(
+                            policy, extraction.text, bypass_cache=bypass_cache
+                        ))
+        except Exception as e:
+            for index, filename, _, byte_hash in ready:
+                self._release(byte_hash)
+                records[index] = {"response": self._failure(filename, f"Processing error: {str(e)}")}
+        else:
+            for (index, filename, extraction, byte_hash), analysis in zip(ready, analyses):
+                records[index] = self._success(filename, extraction, analysis, employee_name, byte_hash)
+
+        return [(index, records[index]) for index, _ in group if index in records]
+
+    async def _extract(self, loop, filename: str, invoice_file, bypass_cache: bool, claims: List[str],
+                       defer: bool = False
+                       ) -> Tuple[Optional[PDFExtractionResult], Optional[str], Union[Dict, "_Deferred", None]]:
+        """Return (extraction, byte hash, None) or (None, byte hash, failure or duplicate response)
+
+        Duplicates are checked before extraction (file hash) and before
+        analysis (text hashes), so neither runs twice for the same invoice.
+        With ``defer`` a match of an invoice still in flight returns
+        ``_Deferred`` instead of a duplicate response.
+        """
+        byte_hash = None
+        try:
+            data = self._read_invoice(invoice_file)
+            byte_hash = sha256_bytes(data)
+            if self.dedup is not None:
+                duplicate = await asyncio.to_thread(self.dedup.check_bytes, byte_hash, filename, bypass_cache)
+                if duplicate is not None:
+                    if defer and duplicate.get("in_flight"):
+                        return None, byte_hash, _Deferred(data)
+                    return None, byte_hash, self._duplicate(filename, duplicate)
+                claims.append(byte_hash)
+            # Timed and recorded here rather than inside the worker, whose metrics a process pool would not see
+            with telemetry.span("pdf_extract") as extract_span:
+                extraction = await loop.run_in_executor(self.executor, extract_pdf_from_bytes, data)
+                extract_span.set(pages=extraction.page_count, truncated=extraction.truncated,
+                                 cached=extraction.cached)
+            record_extraction(extraction)
+            invoice_text = extraction.text
+            if invoice_text and invoice_text.strip() and self.dedup is not None:
+                duplicate = await asyncio.to_thread(self.dedup.check_text, byte_hash, invoice_text, bypass_cache)
+                if duplicate is not None:
+                    claims.remove(byte_hash)
+                    if defer and duplicate.get("in_flight"):
+                        return None, byte_hash, _Deferred(data)
+                    return None, byte_hash, self._duplicate(filename, duplicate)
+        except Exception as e:
+            self._release(byte_hash)
+            return None, byte_hash, self._failure(filename, f"Processing error: {str(e)}")
+        if not invoice_text or not invoice_text.strip():
+            self._release(byte_hash)
+            return None, byte_hash, self._failure(filename, "Could not extract text from invoice")
+        return extraction, byte_hash, None
+
+    def _release(self, byte_hash: Optional[str]) -> None:
+        if self.dedup is not None and byte_hash is not None:
+            self.dedup.release(byte_hash)
+
+    @staticmethod
+    def _success(filename: str, extraction: PDFExtractionResult, analysis, employee_name: str,
+                 byte_hash: str) -> Dict:
+        invoice_id = invoice_id_for(byte_hash)
+        response = {
+            "invoice_id": invoice_id,
+            "filename": filename,
+            "status": analysis.status.value,
+            "reimbursed_amount": analysis.reimbursed_amount,
+            "reason": analysis.reason
+        }
+        if extraction.truncated:
+            response["warnings"] = [f"Only the first {extraction.pages_extracted} of {extraction.page_count} "
+                                    "pages were read (PDF_MAX_PAGES)"]
+        return {
+            "response": response,
+            "write": {
+                "invoice_id": invoice_id,
+                "invoice_text": extraction.text,
+                "analysis": analysis,
+                "employee_name": employee_name,
+                "byte_hash": byte_hash
+            }
+        }
+
+    @staticmethod
+    def _duplicate(filename: str, match: Dict) -> Dict:
+        """Response for an invoice that is not processed again (it adds nothing to totals)"""
+        kind = match["match"]
+        if kind == "near":
+            reason = (f"Possible duplicate of {match['invoice_id']} "
+                      f"(~{match['similarity']:.0%} of the text matches); not processed")
+        else:
+            how = "identical file" if kind == "exact" else "same invoice text"
+            reason = f"Duplicate of {match['invoice_id']} ({how}"
+            if match.get("status"):
+                reason += f", already {match['status']} with ₹{match['reimbursed_amount']:.2f}"
+            elif match.get("in_flight"):
+                reason += ", still being processed"
+            reason += ")"
+        if match.get("filename") and match["filename"] != filename:
+            reason += f"; first seen as {match['filename']}"
+        return {
+            # A near-duplicate is a different file; nothing was stored under its own id
+            "invoice_id": None if kind == "near" else match["invoice_id"],
+            "filename": filename,
+            "status": "Duplicate",
+            "reimbursed_amount": 0.0,
+            "reason": reason,
+            "duplicate_of": match["invoice_id"],
+            "duplicate_match": kind
+        }
+
+    @staticmethod
+    def _read_invoice(invoice_file) -> bytes:
+        """Read an invoice stream into bytes and release its spooled storage"""
+        if not hasattr(invoice_file, "read"):
+            return invoice_file
+        try:
+            return invoice_file.read()
+        finally:
+            invoice_file.close()
+
+    async def _write_batch(self, batch: List[Tuple[Dict, Dict]]) -> None:
+        """Persist a batch of analyses on a worker thread (one embedding pass per batch)"""
+        try:
+            await asyncio.to_thread(self._store_batch, [write for _, write in batch])
+        except Exception as e:
+            for response, write in batch:
+                self._release(write["byte_hash"])
+                response["status"] = "Failed"
+                response["reason"] = f"Storage error: {str(e)}"
+
+    def _store_batch(self, writes: List[Dict]) -> None:
+        self.vector_db.store_analyses_bulk(writes, batch_size=self.write_batch_size)
+        if self.dedup is not None:
+            self.dedup.commit([{"byte_hash": write["byte_hash"], "status": write["analysis"].status.value,
+                                "reimbursed_amount": write["analysis"].reimbursed_amount} for write in writes])
+
+    @staticmethod
+    def _failure(filename: str, reason: str) -> Dict:
+        return {
+            "invoice_id": None,
+            "filename": filename,
+            "status": "Failed",
+            "reimbursed_amount": 0.0,
+            "reason": reason
+        }
+
+
+def record_extraction(extraction: PDFExtractionResult) -> None:
+    """Feed an extraction's per-page timings and truncation to the metrics"""
+    if not extraction.cached:
+        for elapsed_ms in extraction.page_timings_ms:
+            telemetry.PDF_PAGE_SECONDS.observe(elapsed_ms / 1000)
+    if extraction.truncated:
+        telemetry.PDF_TRUNCATED.inc()
+
+
+def summarize_results(results: List[Dict]) -> Dict:
+    """Final summary record for a batch"""
+    processed = [r for r in results if r["status"] not in ("Failed", "Duplicate")]
+    duplicates = sum(r["status"] == "Duplicate" for r in results)
+    return {
+        "processed_invoices": len(processed),
+        "failed_invoices": len(results) - len(processed) - duplicates,
+        "duplicate_invoices": duplicates,
+        "total_reimbursed": round(sum(r["reimbursed_amount"] for r in processed), 2),
+    }
+
+
+async def stream_analysis_records(pipeline: InvoicePipeline, policy: Union[str, PolicyDocument],
+                                  invoices: Iterable[Tuple[str, object]], employee_name: str,
+                                  bypass_cache: bool = False, batch_mode: bool = False) -> AsyncIterator[Dict]:
+    """Typed records for streaming clients: a "result" per invoice, then one "summary" record
+
+    An invoice whose storage failed after its result was sent is sent again
+    as a "result_update" record; the summary counts the final status.
+    """
+    results: Dict[int, Dict] = {}
+    async for record in pipeline.stream(policy, invoices, employee_name,
+                                        bypass_cache=bypass_cache, batch_mode=batch_mode):
+        kind = "result_update" if record["index"] in results else "result"
+        results[record["index"]] = record
+        yield {"type": kind, **record}
+    yield {"type": "summary", **summarize_results(list(results.values()))}
+
+
+def iter_sync(agen: AsyncIterator[Dict]) -> Iterator[Dict]:
+    """Drive an async generator from synchronous code (e.g. Streamlit)"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
@@ -0,0 +1,241 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.models.schemas import PolicyClause, PolicyDocument, PolicyRule
+from app.services import telemetry
+from app.services.pdf_processor import extract_text_from_bytes
+from app.services.text_utils import estimate_tokens, sha256_bytes
+
+# Limits previously hard-coded in the InvoiceAnalyzer system prompt; used for
+# any category the uploaded policy does not state explicitly.
+DEFAULT_POLICY_RULES = [
+    PolicyRule(category="Food", limit=200.0, unit="meal", source="default"),
+    PolicyRule(category="Travel", limit=2000.0, unit="trip", source="default"),
+    PolicyRule(category="Cab", limit=150.0, unit="day", source="default"),
+    PolicyRule(category="Accommodation", limit=500.0, unit="night", source="default"),
+]
+DEFAULT_EXCLUSIONS = [
+    "Alcohol is strictly excluded from food reimbursement",
+    "Toll fees are excluded from cab reimbursement",
+]
+
+# Checked in order, so "office cabs" under a travel section resolves to Cab
+CATEGORY_KEYWORDS = [
+    ("Cab", ("cab", "taxi", "commute")),
+    ("Accommodation", ("accommodation", "hotel", "lodging", "stay")),
+    ("Food", ("food", "meal", "beverage", "dining")),
+    ("Travel", ("travel", "flight", "bus", "train", "trip")),
+]
+UNIT_CATEGORIES = {"meal": "Food", "trip": "Travel", "day": "Cab", "night": "Accommodation"}
+DEFAULT_UNITS = {rule.category: rule.unit for rule in DEFAULT_POLICY_RULES}
+
+AMOUNT_PATTERN = re.compile(r'[₹¥]\s*(\d[\d,]*\.?\d*)(?:\s*(?:/|per)\s*(\w+))?', re.IGNORECASE)
+EXCLUSION_PATTERN = re.compile(
+    r'not\s+(?:be\s+)?reimburs|exclud|prohibit|no\s+alcohol|will\s+not\s+be', re.IGNORECASE
+)
+# Eligibility, restrictions and qualifiers of a limit ("excluding taxes", "depending on ...")
+CONDITION_PATTERN = re.compile(
+    r'eligib|allowed|\bonly\b|\bmust\b|requir|restrict|approved|subject\s+to|unless|except|depending',
+    re.IGNORECASE
+)
+# A segment ending in a top-level number ("Accommodations 4.") closes the current section
+SECTION_END_PATTERN = re.compile(r'(?:^|\s)\d+\.$')
+# Below this saving the compact form is not worth losing the policy's own wording
+COMPACT_MAX_RATIO = 0.5
+# Part of the on-disk cache name; bump when parsing or rendering changes
+PARSER_VERSION = 2
+
+
+def _segments(text: str) -> List[str]:
+    """Split policy text into bullet/sentence segments with normalized whitespace"""
+    normalized = re.sub(r'\s+', ' ', text).replace(' :', ':')
+    parts = re.split(r'●|•|(?<=[.!?])\s+(?=[A-Z0-9])', normalized)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _category_for(segment: str) -> Optional[str]:
+    lowered = segment.lower()
+    for category, keywords in CATEGORY_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return category
+    return None
+
+
+def parse_policy_rules(text: str) -> Tuple[List[PolicyRule], List[PolicyClause]]:
+    """Extract category limits and the clauses qualifying them from raw policy text
+
+    Clauses (exclusions, eligibility conditions, restrictions and limit
+    sentences with qualifiers) are kept verbatim, tagged with the category
+    of their section or None when they apply to every expense.
+    """
+    rules: Dict[str, PolicyRule] = {}
+    clauses: List[PolicyClause] = []
+    section = None
+
+    for segment in _segments(text):
+        matches = list(AMOUNT_PATTERN.finditer(segment))
+        category = _category_for(segment)
+        if not matches:
+            if category:
+                section = category
+            if EXCLUSION_PATTERN.search(segment):
+                kind = "exclusion"
+            elif CONDITION_PATTERN.search(segment):
+                kind = "condition"
+            else:
+                kind = None
+            if kind and all(clause.text != segment for clause in clauses):
+                clauses.append(PolicyClause(text=segment, kind=kind, category=category or section))
+            if SECTION_END_PATTERN.search(segment):
+                section = None
+            continue
+
+        units = [(match.group(2) or "").lower().rstrip("s,.") for match in matches]
+        for match, unit in zip(matches, units):
+            rule_category = category or UNIT_CATEGORIES.get(unit) or section
+            if rule_category is None or rule_category in rules:
+                continue
+            rules[rule_category] = PolicyRule(
+                category=rule_category,
+                limit=float(match.group(1).replace(",", "")),
+                unit=unit if unit in UNIT_CATEGORIES else DEFAULT_UNITS.get(rule_category, "claim")
+            )
+        if EXCLUSION_PATTERN.search(segment) or CONDITION_PATTERN.search(segment):
+            clause_category = category or UNIT_CATEGORIES.get(units[0]) or section
+            clauses.append(PolicyClause(text=segment, kind="condition", category=clause_category))
+
+    for default in DEFAULT_POLICY_RULES:
+        rules.setdefault(default.category, default)
+
+    ordered = [rules[default.category] for default in DEFAULT_POLICY_RULES]
+    if not any(clause.kind == "exclusion" for clause in clauses):
+        clauses.extend(default_clauses())
+    return ordered, clauses
+
+
+def default_clauses() -> List[PolicyClause]:
+    """DEFAULT_EXCLUSIONS as clauses, for policies that state none"""
+    return [PolicyClause(text=exclusion, kind="exclusion", category=_category_for(exclusion))
+            for exclusion in DEFAULT_EXCLUSIONS]
+
+
+def render_compact_policy(rules: List[PolicyRule], clauses: List[PolicyClause]) -> str:
+    """Render the compact policy form sent with every invoice prompt"""
+    lines = ["Limits:"]
+    lines.extend(f"- {rule.category}: ₹{rule.limit:g} per {rule.unit}" for rule in rules)
+    for kind, heading in (("condition", "Conditions:"), ("exclusion", "Exclusions:")):
+        selected = [clause for clause in clauses if clause.kind == kind]
+        if selected:
+            lines.append(heading)
+            lines.extend(f"- ({clause.category or 'All'}) {clause.text}" for clause in selected)
+    return "\n".join(lines)
+
+
+def build_policy_document(policy_hash: str, text: str) -> PolicyDocument:
+    """Preprocess extracted policy text into a PolicyDocument
+
+    ``compact_text`` is the raw text when the compact form would not at
+    least halve the prompt (short policies lose nothing by being sent whole).
+    """
+    rules, clauses = parse_policy_rules(text)
+    token_count = estimate_tokens(text)
+    compact_text = render_compact_policy(rules, clauses)
+    if text.strip() and estimate_tokens(compact_text) > token_count * COMPACT_MAX_RATIO:
+        compact_text = text
+    return PolicyDocument(
+        policy_hash=policy_hash,
+        text=text,
+        token_count=token_count,
+        rules=rules,
+        exclusions=[clause.text for clause in clauses if clause.kind == "exclusion"],
+        clauses=clauses,
+        compact_text=compact_text,
+        compact_token_count=estimate_tokens(compact_text)
+    )
+
+
+class PolicyRegistry:
+    """LRU + on-disk cache of preprocessed policies keyed by PDF content hash"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = 32):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, PolicyDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_or_parse(self, pdf_bytes: bytes) -> PolicyDocument:
+        """Return the cached policy for these bytes, parsing the PDF only on a miss"""
+        policy_hash = sha256_bytes(pdf_bytes)
+        policy = self.get(policy_hash)
+        telemetry.CACHE_REQUESTS.inc(cache="policy", result="miss" if policy is None else "hit")
+        if policy is not None:
+            return policy
+
+        self.misses += 1
+        with telemetry.span("policy_parse"):
+            policy = build_policy_document(policy_hash, extract_text_from_bytes(pdf_bytes))
+        if policy.text.strip():
+            self._remember(policy)
+            self._write_disk(policy)
+        return policy
+
+    def get(self, policy_hash: str) -> Optional[PolicyDocument]:
+        """Look up a policy by hash in memory, then on disk"""
+        with self._lock:
+            policy = self._entries.get(policy_hash)
+            if policy is not None:
+                self._entries.move_to_end(policy_hash)
+                self.hits += 1
+                return policy
+
+        policy = self._read_disk(policy_hash)
+        if policy is not None:
+            self.disk_hits += 1
+            self._remember(policy)
+        return policy
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def _remember(self, policy: PolicyDocument) -> None:
+        with self._lock:
+            self._entries[policy.policy_hash] = policy
+            self._entries.move_to_end(policy.policy_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, policy_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{policy_hash}.v{PARSER_VERSION}.json")
+
+    def _read_disk(self, policy_hash: str) -> Optional[PolicyDocument]:
+        if not self.cache_dir or not os.path.exists(self._path(policy_hash)):
+            return None
+        try:
+            with open(self._path(policy_hash), "r", encoding="utf-8") as f:
+                return PolicyDocument.model_validate(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, policy: PolicyDocument) -> None:
+        if not self.cache_dir:
+            return
+        # Write then rename so concurrent readers never see a partial file; the temp
+        # name is per thread because concurrent first uploads of a policy all write it
+        tmp_path = f"{self._path(policy.policy_hash)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(policy.model_dump(), f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(policy.policy_hash))
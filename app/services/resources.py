@@ -0,0 +1,271 @@
+"""Process-wide singletons for the heavy components
+
+Everything here is built on first use and then reused, so Streamlit reruns
+and FastAPI requests never reload the embedding model or rebuild clients.
+Heavy libraries (langchain, chromadb, sentence-transformers) are only
+imported when the corresponding getter is first called. Tests and
+benchmarks can inject fakes with ``override``.
+"""
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict
+
+# Pipeline tuning (invoices in flight, concurrent LLM calls, vector write batch size)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", str(PIPELINE_WORKERS)))
+VECTOR_WRITE_BATCH = int(os.getenv("VECTOR_WRITE_BATCH", "16"))
+# Batch analysis mode: invoices per packed prompt and the prompt token budget
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "12000"))
+# LLM response cache (in-memory LRU in front of SQLite); TTL in seconds, 0 disables expiry
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./response_cache.sqlite3")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0")) or None
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "100000"))
+# Deterministic rules stage that resolves clear-cut invoices without an LLM call
+RULES_ENGINE_ENABLED = os.getenv("RULES_ENGINE_ENABLED", "1") == "1"
+POLICY_CACHE_DIR = os.getenv("POLICY_CACHE_DIR", "./policy_cache")
+# "sentence-transformers" (default) or "onnx" (onnxruntime, no torch needed)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# Local persistent Chroma directory, or a Chroma server when CHROMA_HOST is set
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+CHROMA_HOST = os.getenv("CHROMA_HOST") or None
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+# API worker processes (read by uvicorn and gunicorn); a local CHROMA_PATH supports only one
+API_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Chat search caches: query embeddings and result lists. Writes from other processes are
+# only seen once a cached result expires (TTL in seconds, 0 disables expiry)
+SEARCH_QUERY_CACHE_SIZE = int(os.getenv("SEARCH_QUERY_CACHE_SIZE", "1024"))
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "512"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30")) or None
+# Hybrid (BM25 + vector) chat retrieval: default and maximum results per page
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "5"))
+RETRIEVER_MAX_K = int(os.getenv("RETRIEVER_MAX_K", "50"))
+RETRIEVER_LEXICAL_WEIGHT = float(os.getenv("RETRIEVER_LEXICAL_WEIGHT", "1.0"))
+# Background analysis jobs: SQLite job table, stored uploads and worker count
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./jobs.sqlite3")
+JOB_DIR = os.getenv("JOB_DIR", "./jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# Hours the uploads of failed or cancelled jobs are kept for resume (completed jobs: none)
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+# Analyses per vector write in jobs; each written batch is one checkpoint
+JOB_WRITE_BATCH = int(os.getenv("JOB_WRITE_BATCH", "1"))
+# DuckDB mirror of the stored analyses behind the reporting endpoint
+REPORTING_ENABLED = os.getenv("REPORTING_ENABLED", "1") == "1"
+REPORTING_DB_PATH = os.getenv("REPORTING_DB_PATH", "./reporting.duckdb")
+# Content-hash deduplication of invoices across uploads; near-duplicates are texts
+# whose estimated shingle overlap reaches DEDUP_NEAR_THRESHOLD (0 turns that check off)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", "./dedup.sqlite3")
+DEDUP_NEAR_THRESHOLD = float(os.getenv("DEDUP_NEAR_THRESHOLD", "0.85"))
+# Chat prompt bounds: retrieved-invoice context and client-supplied history
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "2000"))
+CHAT_HISTORY_MESSAGES = int(os.getenv("CHAT_HISTORY_MESSAGES", "6"))
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1000"))
+
+logger = logging.getLogger(__name__)
+
+_instances: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def _singleton(name: str, factory: Callable[[], Any]) -> Any:
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+
+def override(**instances: Any) -> None:
+    """Replace components (e.g. with fakes) before they are first used"""
+    with _lock:
+        _instances.update(instances)
+
+
+def reset() -> None:
+    """Drop every cached component (shutting down executors)
+
+    Stop the job queue first (``await get_job_queue().stop()``) when it runs.
+    """
+    with _lock:
+        executor = _instances.pop("pdf_executor", None)
+        reporting_store = _instances.pop("reporting_store", None)
+        dedup_index = _instances.pop("dedup_index", None)
+        _instances.clear()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if reporting_store is not None:
+        reporting_store.close()
+    if dedup_index is not None:
+        dedup_index.close()
+
+
+def get_response_cache():
+    def build():
+        from app.services.response_cache import (
+            MemoryCacheBackend, ResponseCache, SQLiteCacheBackend, TieredCacheBackend
+        )
+        return ResponseCache(
+            TieredCacheBackend(
+                MemoryCacheBackend(max_entries=1024, ttl_seconds=RESPONSE_CACHE_TTL),
+                SQLiteCacheBackend(RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_SIZE,
+                                   ttl_seconds=RESPONSE_CACHE_TTL)
+            )
+        )
+    return _singleton("response_cache", build)
+
+
+def get_rule_engine():
+    def build():
+        from app.services.rules_engine import RuleEngine
+        return RuleEngine()
+    return _singleton("rule_engine", build) if RULES_ENGINE_ENABLED else None
+
+
+def get_analyzer():
+    def build():
+        from app.services.llm_service import InvoiceAnalyzer
+        return InvoiceAnalyzer(
+            cache=get_response_cache(),
+            rules=get_rule_engine(),
+            batch_token_budget=LLM_BATCH_TOKEN_BUDGET,
+            max_batch_size=LLM_BATCH_SIZE
+        )
+    return _singleton("analyzer", build)
+
+
+def get_vector_store():
+    def build():
+        from app.services.vector_store import VectorStore
+        if API_WORKERS > 1 and not CHROMA_HOST:
+            raise RuntimeError(f"WEB_CONCURRENCY={API_WORKERS} needs a Chroma server (CHROMA_HOST); "
+                               "a local CHROMA_PATH can only be served by one process")
+        # The local directory is claimed for this process, so a second worker fails fast
+        store = VectorStore(
+            persist_path=CHROMA_PATH,
+            embedding_backend=EMBEDDING_BACKEND,
+            embedding_model=EMBEDDING_MODEL,
+            host=CHROMA_HOST,
+            port=CHROMA_PORT,
+            query_cache_size=SEARCH_QUERY_CACHE_SIZE,
+            result_cache_size=SEARCH_RESULT_CACHE_SIZE,
+            search_cache_ttl=SEARCH_CACHE_TTL,
+            exclusive=True
+        )
+        if REPORTING_ENABLED:
+            # Every writer gets the store from here, so this is where the mirror hooks in
+            try:
+                get_reporting_store().attach(store)
+            except Exception as e:
+                # e.g. another process holds the DuckDB file; analyses still get stored
+                logger.warning("Reporting store unavailable, reports will not include new analyses: %s", e)
+        return store
+    return _singleton("vector_store", build)
+
+
+def get_reporting_store():
+    """DuckDB reporting mirror (None when REPORTING_ENABLED=0)
+
+    It is attached to the vector store by get_vector_store; call that first
+    so a freshly opened mirror has caught up with the collection.
+    """
+    def build():
+        from app.services.reporting import ReportingStore
+        return ReportingStore(REPORTING_DB_PATH)
+    return _singleton("reporting_store", build) if REPORTING_ENABLED else None
+
+
+def get_dedup_index():
+    """Fingerprints of stored invoices (None when DEDUP_ENABLED=0)"""
+    def build():
+        from app.services.dedup import DedupIndex
+        index = DedupIndex(DEDUP_DB_PATH, near_threshold=DEDUP_NEAR_THRESHOLD)
+        index.attach(get_vector_store())
+        return index
+    return _singleton("dedup_index", build) if DEDUP_ENABLED else None
+
+
+def get_retriever():
+    def build():
+        from app.services.hybrid_retriever import HybridRetriever
+        return HybridRetriever(get_vector_store(), k=RETRIEVER_K, max_k=RETRIEVER_MAX_K,
+                               lexical_weight=RETRIEVER_LEXICAL_WEIGHT)
+    return _singleton("retriever", build)
+
+
+def get_chatbot():
+    def build():
+        from app.services.chat_context import ContextBuilder
+        from app.services.llm_service import Chatbot
+        return Chatbot(
+            get_retriever(),
+            context_builder=ContextBuilder(token_budget=CHAT_CONTEXT_TOKENS),
+            history_messages=CHAT_HISTORY_MESSAGES,
+            history_token_budget=CHAT_HISTORY_TOKENS
+        )
+    return _singleton("chatbot", build)
+
+
+def get_policy_registry():
+    def build():
+        from app.services.policy_registry import PolicyRegistry
+        return PolicyRegistry(cache_dir=POLICY_CACHE_DIR)
+    return _singleton("policy_registry", build)
+
+
+def get_pdf_executor():
+    def build():
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Forking a server with live threads (gateway loop, torch, sqlite handles) can
+        # deadlock the children, so workers start from a fresh interpreter
+        return ProcessPoolExecutor(max_workers=PIPELINE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _singleton("pdf_executor", build)
+
+
+def get_pipeline():
+    def build():
+        from app.services.pipeline import InvoicePipeline
+        return InvoicePipeline(
+            get_analyzer(),
+            get_vector_store(),
+            max_workers=PIPELINE_WORKERS,
+            max_llm_calls=LLM_CONCURRENCY,
+            write_batch_size=VECTOR_WRITE_BATCH,
+            executor=get_pdf_executor(),
+            analysis_batch_size=LLM_BATCH_SIZE,
+            dedup=get_dedup_index()
+        )
+    return _singleton("pipeline", build)
+
+
+def get_job_queue():
+    def build():
+        from app.services.job_queue import JobQueue
+        from app.services.pipeline import InvoicePipeline
+        # Same components as get_pipeline, but small write batches so a crash loses little work
+        pipeline = InvoicePipeline(
+            get_analyzer(),
+            get_vector_store(),
+            max_workers=PIPELINE_WORKERS,
+            max_llm_calls=LLM_CONCURRENCY,
+            write_batch_size=JOB_WRITE_BATCH,
+            executor=get_pdf_executor(),
+            analysis_batch_size=LLM_BATCH_SIZE,
+            dedup=get_dedup_index()
+        )
+        return JobQueue(pipeline, get_policy_registry(), db_path=JOB_DB_PATH,
+                        job_root=JOB_DIR, workers=JOB_WORKERS, retention=JOB_RETENTION_HOURS * 3600)
+    return _singleton("job_queue", build)
+
+
+def warm_up() -> None:
+    """Build every component and load the embedding model ahead of the first request"""
+    get_policy_registry()
+    get_analyzer()
+    get_vector_store().warm_up()
@@ -0,0 +1,248 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.services.text_utils import sha256_text
+
+
+class CacheBackend:
+    """Interface for response cache storage"""
+
+    def get(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU with optional TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (created_at, value), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """On-disk cache in a single SQLite table, evicting least recently used rows
+
+    Expired and least recently used rows are only deleted once the table
+    holds more than ``max_entries``. The size is tracked in memory and
+    recounted at each eviction, so rows added by other processes sharing
+    the file are picked up then.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache(accessed_at)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._delete(key)
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict) -> None:
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM response_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            if exists is None:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._delete(key)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+            self._size = 0
+
+    def _delete(self, key: str) -> None:
+        self._size -= self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,)).rowcount
+
+    def _evict(self, now: float) -> None:
+        """Drop expired rows, then the least recently used ones beyond ``max_entries``"""
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._size = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        overflow = self._size - self.max_entries
+        if overflow > 0:
+            # Walks idx_response_cache_accessed from the oldest row
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+            )
+            self._size -= overflow
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class TieredCacheBackend(CacheBackend):
+    """Memory LRU in front of a persistent backend"""
+
+    def __init__(self, front: CacheBackend, back: CacheBackend):
+        self.front = front
+        self.back = back
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is not None:
+                self.front.set(key, value)
+        return value
+
+    def set(self, key: str, value: Dict) -> None:
+        self.front.set(key, value)
+        self.back.set(key, value)
+
+    def delete(self, key: str) -> None:
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def clear(self) -> None:
+        self.front.clear()
+        self.back.clear()
+
+    def __len__(self) -> int:
+        return len(self.back)
+
+
+class ResponseCache:
+    """Content-addressed cache of deterministic LLM responses
+
+    Entries are keyed on (model, prompt template version, policy hash, invoice
+    text hash) and hold both the raw response and the parsed result. Setting
+    ``bypass`` (or passing ``bypass=True`` per call) skips lookups and writes,
+    e.g. for audits that must re-run the model.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, bypass: bool = False):
+        self.backend = backend or MemoryCacheBackend()
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, policy_hash: str, invoice_text: str) -> str:
+        return sha256_text("\x1f".join([model, prompt_version, policy_hash, sha256_text(invoice_text)]))
+
+    def get(self, key: str, bypass: bool = False) -> Optional[Dict]:
+        """Return the cached entry ({"raw": ..., "result": ...}) or None"""
+        if self.bypass or bypass:
+            self.bypassed += 1
+            return None
+        try:
+            entry = self.backend.get(key)
+        except Exception:
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, raw_response: str, result: Dict, bypass: bool = False) -> None:
+        if self.bypass or bypass:
+            return
+        try:
+            self.backend.set(key, {"raw": raw_response, "result": result})
+        except Exception:
+            # A broken cache must never fail an analysis
+            pass
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
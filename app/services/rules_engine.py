@@ -0,0 +1,165 @@
+import re
+import threading
+from typing import Dict, List, Optional, Union
+
+from app.models.schemas import AnalysisResult, PolicyDocument, PolicyRule, ReimbursementStatus
+from app.services.policy_registry import DEFAULT_POLICY_RULES, default_clauses
+
+# Invoice-side keywords per category, in the spirit of VectorStore._detect_category
+INVOICE_KEYWORDS = {
+    "Food": ("restaurant", "meal", "food", "cafe", "dine", "dining", "lunch", "dinner",
+             "breakfast", "table no", "biriyani", "thali", "menu"),
+    "Cab": ("cab", "taxi", "uber", "ola", "ride", "driver", "pickup", "drop"),
+    "Travel": ("flight", "airline", "boarding", "pnr", "bus", "train", "railway", "ticket"),
+    "Accommodation": ("hotel", "room", "check-in", "check in", "checkout", "lodging", "stay", "night"),
+}
+KEYWORD_PATTERNS = {
+    category: re.compile(r'\b(?:' + '|'.join(map(re.escape, keywords)) + r')\b', re.IGNORECASE)
+    for category, keywords in INVOICE_KEYWORDS.items()
+}
+# Anything that needs judgement (excluded items, tolls, multi-unit claims) goes to the LLM
+AMBIGUOUS_PATTERN = re.compile(
+    r'whisk(?:e)?y|beer|wine|vodka|rum\b|liquor|alcohol|\bbar\b|toll|nights|days|meals', re.IGNORECASE
+)
+# Policy exclusions the engine can check: (pattern on the exclusion, pattern on the invoice).
+# Any other exclusion that applies to an invoice's category sends it to the LLM.
+CHECKABLE_EXCLUSIONS = [
+    (re.compile(r'alcohol|liquor', re.IGNORECASE),
+     re.compile(r'whisk(?:e)?y|beer|wine|vodka|rum\b|liquor|alcohol|\bbar\b', re.IGNORECASE)),
+    (re.compile(r'\btolls?\b', re.IGNORECASE), re.compile(r'\btolls?\b', re.IGNORECASE)),
+]
+
+# One explicit total line: "Total: ₹1,180.00", "Grand Total Rs. 770", "Amount Payable INR 1,00,000.50".
+# Sub totals and tax lines do not match; amounts may use Western or Indian digit grouping.
+TOTAL_LINE_PATTERN = re.compile(
+    r'^[ \t]*(?:grand[ \t]+total|total(?:[ \t]+amount)?|amount[ \t]+payable)[ \t]*[:\-]?[ \t]*'
+    r'(?:₹|rs\.?|inr)?[ \t]*(\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:\.\d+)?)[ \t]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def extract_total_amount(invoice_text: str) -> Optional[float]:
+    """Amount on the invoice's single Total/Grand Total/Amount Payable line
+
+    Returns None when no such line exists or several do; the rules stage
+    then leaves the invoice to the LLM rather than guessing.
+    """
+    matches = TOTAL_LINE_PATTERN.findall(invoice_text)
+    if len(matches) != 1:
+        return None
+    return float(matches[0].replace(",", ""))
+
+
+class RuleEngine:
+    """Deterministic pre-LLM stage that resolves obvious invoices
+
+    An invoice is resolved without a model call only when its category is
+    unambiguous (enough keyword hits, nearly all for one category), it has
+    exactly one total line (extract_total_amount), nothing in it needs
+    judgement, and the total is within the category limit. The policy's
+    clauses must also allow it: a condition on the category (eligibility,
+    restrictions, qualified limits) or an exclusion the engine cannot check
+    (CHECKABLE_EXCLUSIONS) leaves the call to the LLM. Clauses for every
+    expense (receipts, deadlines) are procedural and not checked here.
+    Everything else returns None and falls through to the LLM.
+    """
+
+    def __init__(self, rules: Optional[List[PolicyRule]] = None,
+                 min_keyword_hits: int = 2, min_confidence: float = 0.8):
+        self.rules = rules or DEFAULT_POLICY_RULES
+        self.clauses = default_clauses()
+        self.min_keyword_hits = min_keyword_hits
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"evaluated": 0, "resolved": 0, "fallthrough": 0}
+        self._resolved_by_category: Dict[str, int] = {}
+
+    def evaluate(self, invoice_text: str,
+                 policy: Union[str, PolicyDocument, None] = None) -> Optional[AnalysisResult]:
+        """Return an AnalysisResult for clear-cut invoices, None otherwise"""
+        result = self._evaluate(invoice_text, policy)
+        with self._lock:
+            self._stats["evaluated"] += 1
+            if result is None:
+                self._stats["fallthrough"] += 1
+            else:
+                self._stats["resolved"] += 1
+                self._resolved_by_category[result.category] = (
+                    self._resolved_by_category.get(result.category, 0) + 1
+                )
+        return result
+
+    def classify(self, invoice_text: str) -> Optional[Dict]:
+        """Best category with a confidence score, or None if nothing matched"""
+        scores = {
+            category: len(pattern.findall(invoice_text))
+            for category, pattern in KEYWORD_PATTERNS.items()
+        }
+        total = sum(scores.values())
+        if not total:
+            return None
+        category = max(scores, key=scores.get)
+        return {"category": category, "hits": scores[category], "confidence": scores[category] / total}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "llm_calls_saved": self._stats["resolved"],
+                "resolved_by_category": dict(self._resolved_by_category),
+            }
+
+    def _evaluate(self, invoice_text: str,
+                  policy: Union[str, PolicyDocument, None]) -> Optional[AnalysisResult]:
+        if not invoice_text or AMBIGUOUS_PATTERN.search(invoice_text):
+            return None
+
+        classification = self.classify(invoice_text)
+        if (classification is None
+                or classification["hits"] < self.min_keyword_hits
+                or classification["confidence"] < self.min_confidence):
+            return None
+
+        amount = extract_total_amount(invoice_text)
+        if not amount or amount <= 0:
+            return None
+
+        rule = self._rule_for(classification["category"], policy)
+        if rule is None or amount > rule.limit:
+            return None
+        if not self._clauses_allow(rule.category, invoice_text, policy):
+            return None
+
+        return AnalysisResult(
+            category=rule.category,
+            status=ReimbursementStatus.FULLY,
+            reimbursed_amount=amount,
+            requested_amount=amount,
+            reason=(f"{rule.category} expense of ₹{amount:g} is within the policy limit of "
+                    f"₹{rule.limit:g} per {rule.unit} (resolved by policy rules)"),
+            policy_references=[f"- {rule.category}: ₹{rule.limit:g} per {rule.unit}"]
+        )
+
+    def _clauses_allow(self, category: str, invoice_text: str,
+                       policy: Union[str, PolicyDocument, None]) -> bool:
+        clauses = policy.clauses if isinstance(policy, PolicyDocument) else self.clauses
+        for clause in clauses:
+            if clause.kind == "condition":
+                if clause.category == category:
+                    return False
+                continue
+            if clause.category not in (None, category):
+                continue
+            checks = [invoice_pattern for policy_pattern, invoice_pattern in CHECKABLE_EXCLUSIONS
+                      if policy_pattern.search(clause.text)]
+            if not checks or any(pattern.search(invoice_text) for pattern in checks):
+                return False
+        return True
+
+    def _rule_for(self, category: str,
+                  policy: Union[str, PolicyDocument, None]) -> Optional[PolicyRule]:
+        rules = policy.rules if isinstance(policy, PolicyDocument) else self.rules
+        for rule in rules:
+            if rule.category == category:
+                return rule
+        return None
@@ -0,0 +1,424 @@
+"""Spans, metrics and an on-demand sampling profiler
+
+Stages are timed with ``span(name)`` or the ``traced(name)`` decorator.
+Every finished span feeds the ``span_duration_seconds`` histogram (and
+``span_failures_total`` when it raised); spans that run under a correlation
+ID (set per HTTP request by TelemetryMiddleware and per background job) are
+also kept in a bounded buffer so ``trace(correlation_id)`` can show where a
+slow request spent its time. ``REGISTRY.render()`` produces the Prometheus
+text format.
+
+With TELEMETRY_ENABLED=0 spans, counters and histograms return before doing
+any work, and traced functions call straight through.
+
+Metrics are per process; scrape each API worker separately.
+"""
+import bisect
+import functools
+import inspect
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as _Tally, deque
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000"))
+# Sampling profiler: share of requests to profile, whether "X-Profile: 1" forces it, output dir
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ON_HEADER = os.getenv("PROFILE_ON_HEADER", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+_enabled = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+# Client-supplied request IDs end up in file names and headers; anything else is replaced
+CORRELATION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool) -> None:
+    global _enabled
+    _enabled = value
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def accept_correlation_id(value: Optional[str]) -> str:
+    """``value`` if it is a safe request ID, else a freshly generated one"""
+    if value and CORRELATION_ID_PATTERN.fullmatch(value):
+        return value
+    return new_correlation_id()
+
+
+def profile_path(profile_dir: str, cid: str) -> str:
+    """Where the profile of request ``cid`` is written; refuses paths outside ``profile_dir``"""
+    if not CORRELATION_ID_PATTERN.fullmatch(cid):
+        raise ValueError(f"Unsafe correlation ID {cid!r}")
+    root = os.path.realpath(profile_dir)
+    path = os.path.realpath(os.path.join(root, f"{cid}.folded"))
+    if os.path.dirname(path) != root:
+        raise ValueError(f"Profile path {path} escapes {root}")
+    return path
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if not _enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        if not _enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][position] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return sum(state[0]) if state else 0
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = Registry()
+SPAN_SECONDS = REGISTRY.histogram("span_duration_seconds", "Duration of traced stages", ("span",))
+SPAN_FAILURES = REGISTRY.counter("span_failures_total", "Traced stages that raised or fell back", ("span",))
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Estimated LLM tokens by analysis mode and direction",
+                              ("mode", "direction"))
+CACHE_REQUESTS = REGISTRY.counter("cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by route and status",
+                                 ("method", "route", "status"))
+HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP request duration including streaming",
+                                  ("method", "route"))
+DEDUP_CHECKS = REGISTRY.counter("dedup_checks_total", "Invoice duplicate checks by outcome (new, exact, text, near)",
+                               ("result",))
+PDF_PAGE_SECONDS = REGISTRY.histogram("pdf_page_extract_seconds", "Text extraction time per PDF page",
+                                      buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PDF_TRUNCATED = REGISTRY.counter("pdf_truncated_total", "PDFs with more pages than PDF_MAX_PAGES")
+CHAT_FIRST_TOKEN = REGISTRY.histogram("chat_time_to_first_token_seconds", "Time to the first streamed answer token")
+
+_recent_spans: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+class Span:
+    """Times a block; use through ``span``"""
+
+    __slots__ = ("name", "attributes", "span_id", "parent", "started", "duration", "_token", "_wall")
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self._wall = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.duration = time.perf_counter() - self.started
+        _current_span.reset(self._token)
+        SPAN_SECONDS.observe(self.duration, span=self.name)
+        if exc_type is not None:
+            SPAN_FAILURES.inc(span=self.name)
+            self.set(error=f"{exc_type.__name__}: {exc}"[:200])
+        cid = correlation_id.get()
+        if cid is not None:
+            self.span_id = uuid.uuid4().hex[:8]
+            _recent_spans.append((cid, self))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span=%s duration_ms=%.2f correlation_id=%s", self.name, self.duration * 1000, cid)
+        return False
+
+    def set(self, **attributes) -> None:
+        if self.attributes is None:
+            self.attributes = {}
+        self.attributes.update(attributes)
+
+    def fail(self) -> None:
+        """Count a failure that was handled rather than raised (e.g. a fallback result)"""
+        SPAN_FAILURES.inc(span=self.name)
+
+    def to_dict(self) -> Dict:
+        parent = self.parent
+        return {
+            "span": self.name,
+            "span_id": getattr(self, "span_id", None),
+            "parent_id": getattr(parent, "span_id", None) if parent is not None else None,
+            "start": self._wall,
+            "duration_ms": round(self.duration * 1000, 3),
+            **(self.attributes or {}),
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def fail(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Context manager timing a stage (a shared no-op when telemetry is disabled)"""
+    return Span(name, attributes or None) if _enabled else NOOP_SPAN
+
+
+def current_span():
+    """The innermost open span, or a no-op stand-in"""
+    return (_current_span.get() if _enabled else None) or NOOP_SPAN
+
+
+def traced(name: str) -> Callable:
+    """Decorator running the function (sync or async) inside ``span(name)``"""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await function(*args, **kwargs)
+                with Span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def trace(cid: str) -> List[Dict]:
+    """Finished spans recorded under a correlation ID, oldest first"""
+    spans = [item.to_dict() for key, item in list(_recent_spans) if key == cid]
+    return sorted(spans, key=lambda item: item["start"])
+
+
+class SamplingProfiler:
+    """Samples every thread's stack into folded-stack counts (flamegraph.pl / speedscope input)
+
+    Idle frames (threads blocked in wait/select/poll) are skipped, so the
+    output shows where CPU time went while the profiled request ran.
+    """
+
+    IDLE_FUNCTIONS = frozenset(("wait", "select", "poll", "_wait_for_tstate_lock", "accept", "sleep"))
+    _active = threading.Semaphore(1)
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: _Tally = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    @classmethod
+    def try_start(cls, interval: float = 0.005) -> Optional["SamplingProfiler"]:
+        """Start a profiler unless one is already running (bounds the overhead)"""
+        if not cls._active.acquire(blocking=False):
+            return None
+        profiler = cls(interval)
+        profiler._thread.start()
+        return profiler
+
+    def stop(self) -> _Tally:
+        self._stop.set()
+        self._thread.join()
+        self._active.release()
+        return self.samples
+
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_name in self.IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+
+class TelemetryMiddleware:
+    """ASGI middleware: correlation IDs, per-route HTTP metrics and request profiling
+
+    The correlation ID comes from the ``X-Request-ID`` header when it is
+    1-64 characters of ``[A-Za-z0-9_-]`` (otherwise one is generated) and is
+    echoed back on the response. Profiled requests write
+    ``<PROFILE_DIR>/<correlation id>.folded``.
+    """
+
+    def __init__(self, app, profile_sample_rate: float = PROFILE_SAMPLE_RATE,
+                 profile_on_header: bool = PROFILE_ON_HEADER, profile_dir: str = PROFILE_DIR):
+        self.app = app
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_on_header = profile_on_header
+        self.profile_dir = profile_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _enabled:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        cid = accept_correlation_id(headers.get(b"x-request-id", b"").decode("latin-1"))
+        token = correlation_id.set(cid)
+        status = 500
+        profiler = None
+        if (self.profile_on_header and headers.get(b"x-profile") == b"1") or \
+                (self.profile_sample_rate and random.random() < self.profile_sample_rate):
+            profiler = SamplingProfiler.try_start()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers") or []) + [(b"x-request-id", cid.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            with Span("request", {"method": scope.get("method"), "path": scope.get("path")}) as request_span:
+                await self.app(scope, receive, send_with_id)
+        finally:
+            duration = time.perf_counter() - started
+            # Route templates (/jobs/{job_id}) keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope.get("method"), route=route, status=status)
+            HTTP_SECONDS.observe(duration, method=scope.get("method"), route=route)
+            request_span.set(route=route, status=status)
+            if profiler is not None:
+                profiler.stop()
+                path = profiler.save(profile_path(self.profile_dir, cid))
+                request_span.set(profile=path)
+                logger.info("profiled request correlation_id=%s samples=%d file=%s",
+                            cid, sum(profiler.samples.values()), path)
+            correlation_id.reset(token)
+
@@ -0,0 +1,19 @@
+import hashlib
+import math
+
+
+def sha256_bytes(data: bytes) -> str:
+    """Hex SHA-256 digest of raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_text(text: str) -> str:
+    """Hex SHA-256 digest of UTF-8 encoded text"""
+    return sha256_bytes(text.encode("utf-8"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for Gemini/GPT tokenizers)"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
@@ -1,58 +1,454 @@
-import chromadb
-from chromadb import Client
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
-from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
-from sentence_transformers import SentenceTransformer
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
-from app.models.schemas import AnalysisResult
+from app.models.schemas import AnalysisResult, ExpenseCategory, ReimbursementStatus
+from app.services.response_cache import MemoryCacheBackend
+from app.services import telemetry
+import gzip
+import json
+import logging
 import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+COLLECTION_NAME = "invoice_analyses"
+# Bump when the stored document/metadata layout changes; the collection name carries it
+SCHEMA_VERSION = 1
+
+class LazyEmbeddingFunction:
+    """Chroma embedding function that loads its model on first use
+
+    ``backend`` is "sentence-transformers" (torch) or "onnx" (chromadb's
+    bundled ONNX export of all-MiniLM-L6-v2, run with onnxruntime). Both
+    produce the same 384-dim embeddings.
+    """
+
+    def __init__(self, backend: str = "sentence-transformers", model_name: str = EMBEDDING_MODEL):
+        self.backend = backend
+        self.model_name = model_name
+        self._fn = None
+        self._lock = threading.Lock()
+
+    def __call__(self, input):
+        return self._load()(input)
+
+    def _load(self):
+        if self._fn is None:
+            with self._lock:
+                if self._fn is None:
+                    from chromadb.utils import embedding_functions
+                    if self.backend == "onnx":
+                        if self.model_name != EMBEDDING_MODEL:
+                            raise ValueError(f"The onnx backend only provides {EMBEDDING_MODEL}")
+                        self._fn = embedding_functions.ONNXMiniLM_L6_V2()
+                    elif self.backend == "sentence-transformers":
+                        self._fn = embedding_functions.SentenceTransformerEmbeddingFunction(
+                            model_name=self.model_name
+                        )
+                    else:
+                        raise ValueError(f"Unknown embedding backend: {self.backend}")
+        return self._fn
+
+class EmbeddingModelMismatchError(RuntimeError):
+    """The collection was embedded with a different model than the one configured"""
+
+
+class ChromaPathInUseError(RuntimeError):
+    """Another process already serves this local Chroma directory"""
+
+
+_owned_paths: Dict[str, object] = {}
+_owned_paths_lock = threading.Lock()
+
+
+def claim_chroma_path(persist_path: str) -> None:
+    """Make this process the only one serving ``persist_path`` until it exits
+
+    Chroma 0.4's PersistentClient keeps its vector index in memory, so a
+    second process writing the same directory corrupts both views. Raises
+    ChromaPathInUseError when another process holds the claim. Without
+    fcntl (Windows) this is not enforced.
+    """
+    if fcntl is None:
+        return
+    path = os.path.realpath(persist_path)
+    with _owned_paths_lock:
+        if path in _owned_paths:
+            return
+        os.makedirs(path, exist_ok=True)
+        handle = open(os.path.join(path, ".owner.lock"), "a+")
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.seek(0)
+            owner = handle.read().strip()
+            handle.close()
+            raise ChromaPathInUseError(
+                f"{persist_path} is already served by another process{f' (pid {owner})' if owner else ''}; "
+                "run a single API worker or point CHROMA_HOST at a Chroma server"
+            )
+        handle.truncate(0)
+        handle.write(str(os.getpid()))
+        handle.flush()
+        # Kept open: the lock lasts as long as the process
+        _owned_paths[path] = handle
+
+
+class InterProcessLock:
+    """Exclusive lock shared by every process using one Chroma directory
+
+    Uses fcntl.flock where available (Linux/macOS); elsewhere it only
+    serializes threads of the current process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
 
 class VectorStore:
-    def __init__(self, persist_path: str = None):
+    """Invoice analyses in a persistent, schema-versioned Chroma collection
+
+    The collection records ``schema_version`` and ``embedding_model`` in its
+    metadata; opening it with a different embedding model raises
+    EmbeddingModelMismatchError until ``reembed`` (``python -m app.cli
+    reembed``) has migrated it. Writes, snapshots and migrations take an
+    inter-process file lock so several workers can share one directory. Pass
+    ``host`` to use a Chroma server instead of a local directory.
+
+    ``search`` keeps an LRU of query embeddings and of result lists. Every
+    write bumps ``generation``, which is part of the result cache key, so a
+    cached result is never served after the collection changed in this
+    process. The generation is per process, so ``search_cache_ttl`` (None
+    disables expiry) bounds how long writes from other processes go unseen.
+    """
+
+    def __init__(self, persist_path: str = None, embedding_backend: str = "sentence-transformers",
+                 embedding_model: str = EMBEDDING_MODEL, host: Optional[str] = None, port: int = 8000,
+                 verify_embedding_model: bool = True, query_cache_size: int = 1024,
+                 result_cache_size: int = 512, search_cache_ttl: Optional[float] = 30.0,
+                 exclusive: bool = False):
         # Use temp directory if no path specified
         if persist_path is None:
             persist_path = os.path.join(os.getcwd(), "chroma_db")
-        
-        # Create directory if it doesn't exist
-        os.makedirs(persist_path, exist_ok=True)
+        if exclusive and not host:
+            claim_chroma_path(persist_path)
+        self.persist_path = persist_path
+        self.embedding_backend = embedding_backend
+        self.embedding_model = embedding_model
+        self.collection_name = f"{COLLECTION_NAME}_v{SCHEMA_VERSION}"
+        self._listeners: List[Tuple[Callable, Optional[Callable]]] = []
+        self._stale_listeners = set()
+        self.generation = 0
+        self._query_embeddings = MemoryCacheBackend(max_entries=query_cache_size)
+        self._results = MemoryCacheBackend(max_entries=result_cache_size, ttl_seconds=search_cache_ttl)
+        self._cache_lock = threading.Lock()
+        self._cache_counts = {"embedding_hits": 0, "embedding_misses": 0, "result_hits": 0, "result_misses": 0}
         
         try:
-            embedding_fn = SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-            
-            # ✅ NEW CLIENT INITIALIZATION
-            self.client = Client(
-                Settings(
-                    persist_directory=persist_path,
-                    anonymized_telemetry=False
-                )
-            )
-            
-            # Get or create collection with embedding function
-            self.collection = self.client.get_or_create_collection(
-                name="invoice_analyses",
-                embedding_function=embedding_fn
-            )
+            # chromadb is imported here so importing this module stays cheap
+            import chromadb
+            from chromadb.config import Settings
+
+            embedding_fn = LazyEmbeddingFunction(embedding_backend, embedding_model)
+            self.embedding_fn = embedding_fn
+            settings = Settings(anonymized_telemetry=False)
+
+            if host:
+                self.client = chromadb.HttpClient(host=host, port=port, settings=settings)
+                self.lock = threading.RLock()
+            else:
+                # Create directory if it doesn't exist
+                os.makedirs(persist_path, exist_ok=True)
+                self.client = chromadb.PersistentClient(path=persist_path, settings=settings)
+                self.lock = InterProcessLock(os.path.join(persist_path, ".vector_store.lock"))
+
+            with self.lock:
+                self.collection = self._open_collection(self.collection_name, embedding_fn)
 
         except Exception as e:
             # Clean up if initialization fails
             if hasattr(self, 'client'):
                 del self.client
             raise RuntimeError(f"Failed to initialize VectorStore: {str(e)}")
-    
-    # ... [keep all your existing methods unchanged] ...
+
+        stored_model = (self.collection.metadata or {}).get("embedding_model")
+        if verify_embedding_model and stored_model != embedding_model:
+            raise EmbeddingModelMismatchError(
+                f"Collection '{self.collection_name}' was embedded with '{stored_model}' but "
+                f"'{embedding_model}' is configured; run `python -m app.cli reembed` to migrate it"
+            )
+
+    def _open_collection(self, name: str, embedding_fn, embedding_model: Optional[str] = None):
+        """Get or create a collection, stamping schema metadata on creation"""
+        collection = self.client.get_or_create_collection(name=name, embedding_function=embedding_fn)
+        if not collection.metadata:
+            collection.modify(metadata={
+                "schema_version": SCHEMA_VERSION,
+                "embedding_model": embedding_model or self.embedding_model,
+            })
+            collection = self.client.get_collection(name=name, embedding_function=embedding_fn)
+        return collection
+
+    def warm_up(self) -> None:
+        """Load the embedding model now instead of on the first write or search"""
+        self.embedding_fn(["warm up"])
+
+    def add_listener(self, callback: Callable[[List[str], List[str], List[Dict], bool], None],
+                     resync: Optional[Callable[["VectorStore"], object]] = None) -> None:
+        """Call ``callback(ids, documents, metadatas, reset)`` after every write
+
+        ``reset`` is True when the collection was emptied first (restore with
+        replace), e.g. so a side index can drop its contents. A failing
+        callback is logged and never fails the write or the other listeners;
+        its mirror is brought back in line with ``resync(store)`` before the
+        next write (or by ``resync_listeners``).
+        """
+        self._listeners.append((callback, resync))
+
+    def resync_listeners(self) -> int:
+        """Resync the mirrors whose listener failed; returns how many are still stale"""
+        for callback, resync in list(self._stale_listeners):
+            try:
+                if resync is not None:
+                    resync(self)
+            except Exception:
+                logger.exception("Resyncing vector store listener %s failed", _listener_name(callback))
+            else:
+                self._stale_listeners.discard((callback, resync))
+        return len(self._stale_listeners)
+
+    def _notify(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+                reset: bool = False) -> None:
+        with self._cache_lock:
+            self.generation += 1
+        if self._stale_listeners:
+            self.resync_listeners()
+        for listener in self._listeners:
+            if listener in self._stale_listeners:
+                # Its resync failed too; it catches up with everything once a resync succeeds
+                continue
+            callback = listener[0]
+            try:
+                callback(ids, documents, metadatas, reset)
+            except Exception:
+                logger.exception("Vector store listener %s failed; resyncing it before the next write",
+                                 _listener_name(callback))
+                self._stale_listeners.add(listener)
+
+    def iter_records(self, batch_size: int = 500, embeddings: bool = False):
+        """Yield (ids, documents, metadatas, embeddings) pages of the whole collection"""
+        return self._iter_records(self.collection, batch_size, embeddings)
+
+    def info(self) -> Dict:
+        metadata = self.collection.metadata or {}
+        return {
+            "collection": self.collection_name,
+            "path": self.persist_path,
+            "schema_version": metadata.get("schema_version"),
+            "embedding_model": metadata.get("embedding_model"),
+            "configured_embedding_model": self.embedding_model,
+            "count": self.collection.count(),
+        }
+
+    def snapshot(self, path: str, batch_size: int = 500) -> Dict:
+        """Export ids, documents, metadata and embeddings to a gzipped JSONL file
+
+        The first line is a header with the schema version and embedding
+        model, so ``restore`` knows whether the stored vectors can be reused.
+        """
+        header = {**self.info(), "type": "header", "created_at": datetime.now().isoformat()}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Write then rename so an interrupted snapshot never replaces a good one
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self.lock, gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for ids, documents, metadatas, embeddings in self._iter_records(self.collection, batch_size):
+                for record in zip(ids, documents, metadatas, embeddings):
+                    f.write(json.dumps({
+                        "id": record[0], "document": record[1], "metadata": record[2],
+                        "embedding": list(map(float, record[3]))
+                    }, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        return header
+
+    def restore(self, path: str, replace: bool = False, batch_size: int = 500) -> int:
+        """Load a snapshot; records are re-embedded if it used another model"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("type") != "header":
+                raise ValueError(f"{path} is not a vector store snapshot")
+            if (header.get("schema_version") or 0) > SCHEMA_VERSION:
+                raise ValueError(
+                    f"Snapshot schema v{header['schema_version']} is newer than v{SCHEMA_VERSION}"
+                )
+            reuse_embeddings = header.get("embedding_model") == self.embedding_model
+
+            with self.lock:
+                if replace:
+                    self.client.delete_collection(self.collection_name)
+                    self.collection = self._open_collection(self.collection_name, self.embedding_fn)
+                    self._notify([], [], [], reset=True)
+                restored = 0
+                batch: List[Dict] = []
+                for line in f:
+                    batch.append(json.loads(line))
+                    if len(batch) >= batch_size:
+                        restored += self._upsert(self.collection, batch, reuse_embeddings)
+                        batch = []
+                restored += self._upsert(self.collection, batch, reuse_embeddings)
+        return restored
+
+    def reembed(self, embedding_model: Optional[str] = None, embedding_backend: Optional[str] = None,
+                batch_size: int = 256) -> int:
+        """Re-embed every record with a new model and swap the collection in place
+
+        Records are copied into a staging collection and the old one is only
+        dropped once the copy is complete, so an interrupted migration can
+        simply be re-run.
+        """
+        embedding_model = embedding_model or self.embedding_model
+        embedding_fn = LazyEmbeddingFunction(embedding_backend or self.embedding_backend, embedding_model)
+        staging_name = f"{self.collection_name}__reembed"
+
+        with self.lock:
+            try:
+                self.client.delete_collection(staging_name)
+            except ValueError:
+                pass
+            staging = self._open_collection(staging_name, embedding_fn, embedding_model)
+            copied = 0
+            for ids, documents, metadatas, _ in self._iter_records(self.collection, batch_size,
+                                                                    embeddings=False):
+                staging.add(ids=ids, documents=documents, metadatas=metadatas,
+                            embeddings=[list(map(float, e)) for e in embedding_fn(documents)])
+                copied += len(ids)
+
+            self.client.delete_collection(self.collection_name)
+            staging.modify(name=self.collection_name)
+            self.embedding_fn = embedding_fn
+            self.embedding_model = embedding_model
+            self.collection = self.client.get_collection(self.collection_name, embedding_function=embedding_fn)
+            self._query_embeddings.clear()
+            with self._cache_lock:
+                self.generation += 1
+        return copied
+
+    @staticmethod
+    def _iter_records(collection, batch_size: int, embeddings: bool = True):
+        include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+        offset = 0
+        while True:
+            page = collection.get(limit=batch_size, offset=offset, include=include)
+            if not page["ids"]:
+                return
+            yield (page["ids"], page["documents"], page["metadatas"],
+                   page.get("embeddings") if embeddings else [None] * len(page["ids"]))
+            offset += len(page["ids"])
+
+    def _upsert(self, collection, records: List[Dict], reuse_embeddings: bool) -> int:
+        if not records:
+            return 0
+        documents = [record["document"] for record in records]
+        if reuse_embeddings:
+            embeddings = [record["embedding"] for record in records]
+        else:
+            embeddings = [list(map(float, e)) for e in self.embedding_fn(documents)]
+        ids = [record["id"] for record in records]
+        metadatas = [record["metadata"] for record in records]
+        collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        self._notify(ids, documents, metadatas)
+        return len(records)
+
         
+    @telemetry.traced("vector_store")
     def store_analysis(self, invoice_id: str, invoice_text: str, 
                      analysis: AnalysisResult, employee_name: str) -> None:
-        """Store analysis results with detailed metadata"""
+        """Store analysis results with detailed metadata (replacing any earlier analysis of the id)"""
+        document_text, metadata = self._build_record(analysis, employee_name)
+        
+        with self.lock:
+            self.collection.upsert(
+                documents=[document_text],
+                metadatas=[metadata],
+                ids=[invoice_id]
+            )
+        self._notify([invoice_id], [document_text], [metadata])
+
+    @telemetry.traced("vector_store")
+    def store_analyses_bulk(self, records: List[Dict], batch_size: int = 64) -> None:
+        """Store many analyses with one embedding call per batch and a single upsert
+
+        Each record takes the same keys as store_analysis: invoice_id,
+        invoice_text, analysis and employee_name. Invoice ids are derived
+        from content, so records replace earlier ones with the same id (the
+        last one wins within a call).
+        """
+        records = list({record["invoice_id"]: record for record in records}.values())
+        if not records:
+            return
+
+        ids, documents, metadatas = [], [], []
+        for record in records:
+            document_text, metadata = self._build_record(record["analysis"], record["employee_name"])
+            ids.append(record["invoice_id"])
+            documents.append(document_text)
+            metadatas.append(metadata)
+
+        embeddings = []
+        with telemetry.span("embed", documents=len(documents)):
+            for start in range(0, len(documents), max(1, batch_size)):
+                embeddings.extend(self.embedding_fn(documents[start:start + batch_size]))
+
+        # Chroma caps the size of a single add; only very large runs are split
+        max_add = getattr(self.client, "max_batch_size", None) or len(ids)
+        with self.lock:
+            for start in range(0, len(ids), max_add):
+                end = start + max_add
+                self.collection.upsert(
+                    ids=ids[start:end],
+                    documents=documents[start:end],
+                    metadatas=metadatas[start:end],
+                    embeddings=[list(map(float, e)) for e in embeddings[start:end]]
+                )
+        self._notify(ids, documents, metadatas)
+
+    def _build_record(self, analysis: AnalysisResult, employee_name: str) -> Tuple[str, Dict]:
+        """Build the document text and metadata stored for one analysis"""
+        now = datetime.now()
+        # Amounts and timestamp are stored as numbers so range filters run inside Chroma
         metadata = {
             "employee": employee_name,
             "status": analysis.status.value,
-            "date": datetime.now().isoformat(),
-            "reimbursed_amount": str(analysis.reimbursed_amount),
-            "requested_amount": str(analysis.requested_amount),
-            "category": self._detect_category(analysis.reason)
+            "date": now.isoformat(),
+            "timestamp": now.timestamp(),
+            "reimbursed_amount": float(analysis.reimbursed_amount),
+            "requested_amount": float(analysis.requested_amount),
+            "category": normalize_category(analysis.category) or self._detect_category(analysis.reason)
         }
         
         document_text = f"""
@@ -63,12 +459,7 @@ class VectorStore:
         Reason: {analysis.reason}
         Policy References: {', '.join(analysis.policy_references)}
         """
-        
-        self.collection.add(
-            documents=[document_text],
-            metadatas=[metadata],
-            ids=[invoice_id]
-        )
+        return document_text, metadata
     
     def _detect_category(self, reason: str) -> str:
         """Detect expense category from reason text"""
@@ -81,38 +472,211 @@ class VectorStore:
             return "Cab"
         return "Other"
     
-    def search(self, query: str, filters: Optional[Dict] = None, n_results: int = 5) -> List[Dict]:
-        """Search with both vector similarity and metadata filtering"""
-        if filters is None:
-            filters = {}
-            
-        # Convert amount filters to numeric comparisons
-        amount_filters = {}
-        for key in ['reimbursed_amount', 'requested_amount']:
-            if key in filters:
-                amount_filters[key] = float(filters[key])
-                del filters[key]
-        
-        results = self.collection.query(
-            query_texts=[query],
-            where=filters,
-            n_results=n_results
-        )
-        
-        # Apply amount filters post-query if needed
-        if amount_filters:
-            filtered_results = []
-            for doc, meta in zip(results['documents'], results['metadatas']):
-                include = True
-                for key, value in amount_filters.items():
-                    if float(meta[key]) < value:
-                        include = False
-                        break
-                if include:
-                    filtered_results.append({
-                        'document': doc,
-                        'metadata': meta
-                    })
-            return filtered_results
-            
-        return [{'document': d, 'metadata': m} for d, m in zip(results['documents'], results['metadatas'])]
\ No newline at end of file
+    @telemetry.traced("vector_search")
+    def search(self, query: Optional[str], filters: Optional[Dict] = None, n_results: int = 5) -> List[Dict]:
+        """Search with both vector similarity and metadata filtering
+
+        Filters are pushed down into the Chroma ``where`` clause (see
+        build_where). Without a query the search is metadata-only and
+        never embeds anything.
+        """
+        where = build_where(filters)
+        query = (query or "").strip()
+        key = json.dumps([self.generation, query, where, n_results], sort_keys=True, ensure_ascii=False)
+        cached = self._results.get(key)
+        self._count("result", cached is not None)
+        if cached is not None:
+            return [dict(hit) for hit in cached]
+
+        if not query:
+            results = self.collection.get(
+                where=where,
+                limit=n_results,
+                include=["documents", "metadatas"]
+            )
+            hits = [
+                {'id': i, 'document': d, 'metadata': m}
+                for i, d, m in zip(results['ids'], results['documents'], results['metadatas'])
+            ]
+        else:
+            results = self.collection.query(
+                query_embeddings=[self._embed_query(query)],
+                where=where,
+                n_results=n_results
+            )
+
+            # Chroma returns one result list per query text
+            distances = (results.get('distances') or [[None] * len(results['ids'][0])])[0]
+            hits = [
+                {'id': i, 'document': d, 'metadata': m, 'distance': dist}
+                for i, d, m, dist in zip(results['ids'][0], results['documents'][0],
+                                         results['metadatas'][0], distances)
+            ]
+
+        self._results.set(key, hits)
+        return [dict(hit) for hit in hits]
+
+    def cache_stats(self) -> Dict:
+        with self._cache_lock:
+            counts = dict(self._cache_counts)
+            generation = self.generation
+        return {
+            "generation": generation,
+            "query_embeddings": _cache_report(len(self._query_embeddings),
+                                              counts["embedding_hits"], counts["embedding_misses"]),
+            "results": _cache_report(len(self._results), counts["result_hits"], counts["result_misses"]),
+        }
+
+    def _embed_query(self, query: str) -> List[float]:
+        embedding = self._query_embeddings.get(query)
+        self._count("embedding", embedding is not None)
+        if embedding is None:
+            embedding = [float(v) for v in self.embedding_fn([query])[0]]
+            self._query_embeddings.set(query, embedding)
+        return embedding
+
+    def _count(self, cache: str, hit: bool) -> None:
+        with self._cache_lock:
+            self._cache_counts[f"{cache}_hits" if hit else f"{cache}_misses"] += 1
+        telemetry.CACHE_REQUESTS.inc(cache=f"search_{cache}", result="hit" if hit else "miss")
+
+
+def _listener_name(callback: Callable) -> str:
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+def _cache_report(entries: int, hits: int, misses: int) -> Dict:
+    lookups = hits + misses
+    return {"entries": entries, "hits": hits, "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0}
+
+
+NUMERIC_FIELDS = {"reimbursed_amount", "requested_amount", "timestamp"}
+FILTER_OPERATORS = {
+    "eq": "$eq", "ne": "$ne", "gt": "$gt", "gte": "$gte",
+    "lt": "$lt", "lte": "$lte", "in": "$in", "nin": "$nin",
+}
+
+
+def build_where(filters: Optional[Dict]) -> Optional[Dict]:
+    """Translate a filter spec into a Chroma ``where`` clause
+
+    The spec maps field names to either a plain value (equality; for the
+    numeric amount fields a plain value keeps the old "at least" meaning)
+    or to an operator dict such as ``{"gt": 1000, "lte": 5000}``. Supported
+    operators are eq/ne/gt/gte/lt/lte/in/nin. Conditions can be combined
+    with ``{"and": [...]}`` / ``{"or": [...]}``; sibling keys are and-ed.
+    Raises ValueError on unknown operators, non-numeric amount bounds and
+    malformed specs (non-object filters, non-list in/nin, nested values).
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError(f"Filters must be an object of field conditions, got {filters!r}")
+
+    clauses = []
+    for field, spec in filters.items():
+        if field in ("and", "or"):
+            if not isinstance(spec, list):
+                raise ValueError(f"'{field}' expects a list of filters")
+            if not all(isinstance(part, dict) for part in spec):
+                raise ValueError(f"'{field}' expects a list of filter objects")
+            parts = [clause for clause in (build_where(part) for part in spec) if clause]
+            if len(parts) == 1:
+                clauses.append(parts[0])
+            elif parts:
+                clauses.append({f"${field}": parts})
+            continue
+
+        if isinstance(spec, dict):
+            for op, value in spec.items():
+                if op not in FILTER_OPERATORS:
+                    raise ValueError(f"Unsupported filter operator '{op}' for '{field}'")
+                if (op in ("in", "nin")) != isinstance(value, list):
+                    raise ValueError(f"Operator '{op}' on '{field}' "
+                                     f"{'needs' if op in ('in', 'nin') else 'does not take'} a list")
+                clauses.append({field: {FILTER_OPERATORS[op]: _filter_value(field, value)}})
+        elif isinstance(spec, list):
+            clauses.append({field: {"$in": _filter_value(field, spec)}})
+        elif field in NUMERIC_FIELDS:
+            clauses.append({field: {"$gte": _filter_value(field, spec)}})
+        else:
+            clauses.append({field: {"$eq": _filter_value(field, spec)}})
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def matches_where(metadata: Dict, where: Optional[Dict]) -> bool:
+    """Evaluate a build_where clause against one metadata dict (as Chroma would)"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, part) for part in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            for op, expected in condition.items():
+                if not _compare(op, value, expected):
+                    return False
+    return True
+
+
+def _compare(op: str, value, expected) -> bool:
+    if op == "$eq":
+        return value == expected
+    if op == "$ne":
+        return value != expected
+    if op == "$in":
+        return value in expected
+    if op == "$nin":
+        return value not in expected
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > expected
+    if op == "$gte":
+        return value >= expected
+    if op == "$lt":
+        return value < expected
+    if op == "$lte":
+        return value <= expected
+    raise ValueError(f"Unsupported operator {op}")
+
+
+def _filter_value(field: str, value, nested: bool = False):
+    if isinstance(value, list) and not nested:
+        return [_filter_value(field, v, nested=True) for v in value]
+    if not isinstance(value, (str, int, float, bool)):
+        raise ValueError(f"Filter on '{field}' needs a plain value, got {value!r}")
+    if field in NUMERIC_FIELDS:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Filter on '{field}' needs a number, got {value!r}")
+    if field == "status":
+        return normalize_status(value)
+    return value
+
+
+def normalize_category(value: Optional[str]) -> Optional[str]:
+    """Map the LLM's category onto ExpenseCategory ("food" -> "Food"); None if unknown"""
+    lowered = str(value or "").strip().lower()
+    for category in ExpenseCategory:
+        if lowered in (category.value.lower(), category.name.lower()):
+            return category.value
+    return None
+
+
+def normalize_status(value: str) -> str:
+    """Accept "declined", "partially", "Fully Reimbursed", ... for status filters"""
+    lowered = str(value).strip().lower()
+    for status in ReimbursementStatus:
+        if lowered in (status.value.lower(), status.name.lower()):
+            return status.value
+    return value
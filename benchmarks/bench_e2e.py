@@ -0,0 +1,405 @@
+"""End-to-end load test of the API, fully offline
+
+    python benchmarks/bench_e2e.py [--requests 20] [--concurrency 4] [--invoices 10]
+        [--llm-latency 0.2] [--out report.json] [--baseline previous.json]
+
+Starts the FastAPI app under uvicorn in a subprocess whose Gemini client is
+a FakeChatModel and whose embeddings are hashed (benchmarks/fakes.py), with
+every store in a temp directory. Concurrent httpx clients then run the
+stages in order:
+
+    generate        build the synthetic policy + invoice ZIPs (benchmarks/synthetic.py)
+    analyze         POST /analyze-invoice, a fresh ZIP per request
+    analyze_stream  POST /analyze-invoice/stream (first_byte = first invoice result)
+    chat            POST /chat
+    chat_stream     POST /chat/stream (first_byte = first answer token)
+    report          GET /reports/reimbursements
+
+Each stage reports throughput, p50/p95/p99 latency and the peak RSS of the
+server (PDF worker processes included) as JSON. ``--baseline`` compares
+against an earlier report and exits with status 1 when a stage's p95 grew
+by more than ``--max-regression``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import synthetic  # noqa: E402
+
+EMPLOYEES = ["Aarav Sharma", "Priya Iyer", "Rohan Mehta", "Ananya Nair", "Vikram Das"]
+CHAT_QUERIES = [
+    "Show declined invoices for {employee}",
+    "How much was reimbursed to {employee} for food?",
+    "Which invoices had whisky on the bill?",
+    "List cab rides above the daily limit",
+    "Partially reimbursed hotel stays",
+]
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def serve(args) -> None:
+    """Run the API with fake LLM and embeddings (the subprocess side)"""
+    data = args.data_dir
+    os.environ.update({
+        "CHROMA_PATH": os.path.join(data, "chroma"),
+        "RESPONSE_CACHE_PATH": os.path.join(data, "response_cache.sqlite3"),
+        "POLICY_CACHE_DIR": os.path.join(data, "policy_cache"),
+        "REPORTING_DB_PATH": os.path.join(data, "reporting.duckdb"),
+        "DEDUP_DB_PATH": os.path.join(data, "dedup.sqlite3"),
+        "JOB_DB_PATH": os.path.join(data, "jobs.sqlite3"),
+        "JOB_DIR": os.path.join(data, "jobs"),
+        "JOB_WORKERS": "0",
+        "LLM_RPM": "1000000000",
+        "RULES_ENGINE_ENABLED": "0" if args.no_rules else "1",
+    })
+
+    from benchmarks.fakes import FakeChatModel, HashedEmbedding
+    from app.services import llm_service, vector_store
+
+    llm = FakeChatModel(args.llm_latency, args.token_latency)
+    vector_store.LazyEmbeddingFunction = lambda *a, **kw: HashedEmbedding()
+    llm_service._gemini_client = lambda model, temperature: llm
+
+    import uvicorn
+    from app import main
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+class RssSampler:
+    """Peak resident memory of a process tree, sampled on a background thread"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.peak = self.tree_rss() or 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return round(self.peak / 2 ** 20, 1) if self.peak else None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.tree_rss() or 0)
+
+    def tree_rss(self) -> Optional[int]:
+        """RSS of the process and its descendants in bytes (None without /proc)"""
+        total, stack, seen = 0, [self.pid], set()
+        while stack:
+            pid = stack.pop()
+            if pid in seen:
+                continue
+            seen.add(pid)
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * PAGE_SIZE
+                tasks = os.listdir(f"/proc/{pid}/task")
+            except OSError:
+                if pid == self.pid:
+                    return None
+                continue
+            for task in tasks:
+                try:
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        stack.extend(int(child) for child in f.read().split())
+                except OSError:
+                    pass
+        return total
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(values: List[float]) -> Optional[Dict]:
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 0.5), 2),
+        "p95": round(percentile(values, 0.95), 2),
+        "p99": round(percentile(values, 0.99), 2),
+        "mean": round(statistics.mean(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+# A request returns (milliseconds to the first useful record or None, units of work) and
+# raises on failure
+Request = Callable[["httpx.AsyncClient", int], Awaitable[Tuple[Optional[float], int]]]
+
+
+async def run_stage(client, request: Request, requests: int, concurrency: int, pid: int) -> Dict:
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors: List[str] = []
+    units = 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal units
+        for index in indexes:
+            started = time.perf_counter()
+            try:
+                first_byte, done = await request(client, index)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}"[:300])
+                continue
+            finally:
+                latencies.append((time.perf_counter() - started) * 1000)
+            units += done
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+
+    with RssSampler(pid) as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        duration = time.perf_counter() - started
+    report = {
+        "requests": requests,
+        "errors": len(errors),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(requests / duration, 2) if duration else None,
+        "units_per_s": round(units / duration, 2) if duration else None,
+        "latency_ms": summarize(latencies),
+        "peak_rss_mb": sampler.peak_mb,
+    }
+    if first_bytes:
+        report["first_byte_ms"] = summarize(first_bytes)
+    if errors:
+        report["error_samples"] = sorted(set(errors))[:5]
+    return report
+
+
+def check(response) -> None:
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+def analyze_request(policy: bytes, zips: List[bytes], mode: str, stream: bool) -> Request:
+    async def request(client, index):
+        files = {"policy_pdf": ("policy.pdf", policy, "application/pdf"),
+                 "invoices_zip": (f"invoices_{index}.zip", zips[index], "application/zip")}
+        data = {"employee_name": EMPLOYEES[index % len(EMPLOYEES)], "analysis_mode": mode}
+        if not stream:
+            response = await client.post("/analyze-invoice", files=files, data=data)
+            check(response)
+            return None, response.json()["processed_invoices"]
+        started, first_byte, processed = time.perf_counter(), None, 0
+        async with client.stream("POST", "/analyze-invoice/stream", files=files, data=data) as response:
+            if response.status_code != 200:
+                await response.aread()
+                check(response)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record["type"] == "result" and first_byte is None:
+                    first_byte = (time.perf_counter() - started) * 1000
+                if record["type"] == "summary":
+                    processed = record["processed_invoices"]
+                if record["type"] == "error":
+                    raise RuntimeError(record["reason"])
+        return first_byte, processed
+    return request
+
+
+def chat_request(stream: bool) -> Request:
+    async def request(client, index):
+        query = CHAT_QUERIES[index % len(CHAT_QUERIES)].format(employee=EMPLOYEES[index % len(EMPLOYEES)])
+        body = {"query": query, "history": [], "k": 5}
+        if not stream:
+            check(await client.post("/chat", json=body))
+            return None, 1
+        started, first_byte = time.perf_counter(), None
+        async with client.stream("POST", "/chat/stream", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                check(response)
+            async for line in response.aiter_lines():
+                record = json.loads(line) if line else {}
+                if record.get("type") == "token" and first_byte is None:
+                    first_byte = (time.perf_counter() - started) * 1000
+                if record.get("type") == "error":
+                    raise RuntimeError(record.get("reason") or record.get("detail"))
+        return first_byte, 1
+    return request
+
+
+def report_request() -> Request:
+    async def request(client, index):
+        params = {"group_by": ["employee,category", "month", "status"][index % 3]}
+        check(await client.get("/reports/reimbursements", params=params))
+        return None, 1
+    return request
+
+
+def start_server(args, data_dir: str) -> Tuple[subprocess.Popen, str, float]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--data-dir", data_dir, "--llm-latency", str(args.llm_latency),
+               "--token-latency", str(args.token_latency)] + (["--no-rules"] if args.no_rules else [])
+    log = open(os.path.join(data_dir, "server.log"), "wb")
+    started = time.perf_counter()
+    server = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=data_dir)
+    deadline = started + args.startup_timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return server, f"http://127.0.0.1:{port}", time.perf_counter() - started
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    with open(os.path.join(data_dir, "server.log"), "rb") as f:
+        sys.stderr.write(f.read().decode(errors="replace")[-4000:])
+    raise SystemExit("API server did not start")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float) -> Dict:
+    """Per-stage p95 and throughput ratios (current / baseline) and the stages that regressed"""
+    ratios, regressions = {}, []
+    for stage, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous or not current.get("latency_ms") or not previous.get("latency_ms"):
+            continue
+        p95_ratio = current["latency_ms"]["p95"] / max(previous["latency_ms"]["p95"], 1e-9)
+        ratios[stage] = {"p95": round(p95_ratio, 3)}
+        if current.get("throughput_rps") and previous.get("throughput_rps"):
+            ratios[stage]["throughput"] = round(current["throughput_rps"] / previous["throughput_rps"], 3)
+        if p95_ratio > 1 + max_regression:
+            regressions.append(stage)
+    return {"ratios": ratios, "regressions": regressions, "max_regression": max_regression}
+
+
+async def run(args, base_url: str, server_pid: int, zips: List[bytes], policy: bytes) -> Dict:
+    import httpx
+
+    stages = {}
+    half = len(zips) // 2
+    plan = [
+        ("analyze", analyze_request(policy, zips[:half], args.mode, stream=False), half),
+        ("analyze_stream", analyze_request(policy, zips[half:], args.mode, stream=True), half),
+        ("chat", chat_request(stream=False), args.requests),
+        ("chat_stream", chat_request(stream=True), args.requests),
+        ("report", report_request(), args.requests),
+    ]
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        for name, request, count in plan:
+            if args.stages and name not in args.stages:
+                continue
+            stages[name] = await run_stage(client, request, count, args.concurrency, server_pid)
+        usage = (await client.get("/llm-usage")).json()
+    return {"stages": stages, "llm_usage": usage}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="requests per stage")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--invoices", type=int, default=10, help="invoices per ZIP")
+    parser.add_argument("--items", type=int, default=3, help="line items per invoice")
+    parser.add_argument("--mode", choices=["single", "batch"], default="single", help="analysis_mode")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per streamed word")
+    parser.add_argument("--no-rules", action="store_true", help="send every invoice to the (fake) LLM")
+    parser.add_argument("--stages", nargs="*", help="only run these stages")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 growth (0.2 = 20%%)")
+    # Subprocess side
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    with RssSampler(os.getpid()) as sampler:
+        started = time.perf_counter()
+        parts = synthetic.template_parts()
+        policy = synthetic.policy_bytes()
+        zips = [synthetic.build_zip(args.invoices, args.items, seed=args.seed * 100_000 + i, parts=parts)[0]
+                for i in range(2 * args.requests)]
+        generate_s = time.perf_counter() - started
+    generate = {
+        "zips": len(zips),
+        "invoices": len(zips) * args.invoices,
+        "bytes": sum(map(len, zips)),
+        "duration_s": round(generate_s, 3),
+        "units_per_s": round(len(zips) * args.invoices / generate_s, 2) if generate_s else None,
+        "peak_rss_mb": sampler.peak_mb,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench-e2e-") as data_dir:
+        server, base_url, startup_s = start_server(args, data_dir)
+        try:
+            result = asyncio.run(run(args, base_url, server.pid, zips, policy))
+        finally:
+            stop_server(server)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("serve", "port", "data_dir", "out", "baseline")},
+        "startup_s": round(startup_s, 3),
+        "stages": {"generate": generate, **result["stages"]},
+        "llm_usage": result["llm_usage"],
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.max_regression)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
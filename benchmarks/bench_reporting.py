@@ -0,0 +1,97 @@
+"""Latency of reporting aggregates over a large synthetic reimbursement table
+
+    python benchmarks/bench_reporting.py [--rows 1000000] [--repeat 20]
+
+Loads synthetic rows straight into a throwaway ReportingStore (no
+embeddings involved) and reports the load time plus p50/p95 latency of
+typical report queries as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.schemas import ExpenseCategory, ReimbursementStatus  # noqa: E402
+from app.services.reporting import ReportingStore  # noqa: E402
+
+QUERIES = {
+    "total": ([], {}),
+    "per_employee_category_this_month": (["employee", "category"], {"date_from": "{month_start}"}),
+    "per_month_category": (["month", "category"], {}),
+    "one_employee_per_month": (["month"], {"employee": "employee-0042"}),
+    "declined_per_category": (["category"], {"status": "declined"}),
+}
+
+
+def synthetic_rows(count: int, employees: int, seed: int = 5):
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=365)
+    categories = [c.value for c in ExpenseCategory]
+    statuses = [s.value for s in ReimbursementStatus]
+    for i in range(count):
+        requested = round(rng.uniform(50, 5000), 2)
+        status = rng.choice(statuses)
+        reimbursed = {ReimbursementStatus.FULLY.value: requested, ReimbursementStatus.DECLINED.value: 0.0}.get(
+            status, round(requested * rng.uniform(0.2, 0.9), 2))
+        created = start + timedelta(seconds=rng.randrange(365 * 86400))
+        yield (f"inv-{i:012x}", f"employee-{rng.randrange(employees):04d}", status, rng.choice(categories),
+               requested, reimbursed, created.isoformat())
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    month_start = datetime.now().replace(day=1).date().isoformat()
+    with tempfile.TemporaryDirectory(prefix="bench-reporting-") as path:
+        store = ReportingStore(os.path.join(path, "reporting.duckdb"))
+        started = time.perf_counter()
+        batch = []
+        for row in synthetic_rows(args.rows, args.employees):
+            batch.append(row)
+            if len(batch) >= args.batch_size:
+                store.upsert(batch)
+                batch = []
+        store.upsert(batch)
+        load_s = time.perf_counter() - started
+
+        results = {}
+        for name, (group_by, filters) in QUERIES.items():
+            filters = {key: value.format(month_start=month_start) for key, value in filters.items()}
+            latencies, groups = [], 0
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                groups = len(store.aggregate(group_by, filters, percentiles=(0.5, 0.95), limit=100_000)["rows"])
+                latencies.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                "groups": groups,
+                "p50_ms": round(percentile(latencies, 0.5), 3),
+                "p95_ms": round(percentile(latencies, 0.95), 3),
+            }
+        report = {
+            "rows": store.count(),
+            "load_s": round(load_s, 2),
+            "rows_per_s": round(args.rows / load_s, 1) if load_s else None,
+            "queries": results,
+        }
+        store.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
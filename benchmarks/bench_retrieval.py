@@ -0,0 +1,157 @@
+"""Relevance and latency of vector, BM25 and hybrid retrieval on a synthetic corpus
+
+    python benchmarks/bench_retrieval.py [--corpus 100000] [--queries 200] [--k 10]
+
+Builds a throwaway Chroma collection of synthetic invoice analyses and runs
+three query sets with known answers: employee names, invoice ids and a rare
+item keyword ("whisky"). Reports precision@k / MRR and p50/p95 latency per
+retrieval mode as JSON.
+
+By default vectors come from a hashed bag-of-words embedding so the run is
+offline and fast; it is kinder to exact-match queries than MiniLM, so its
+vector-only scores are an upper bound. ``--embedding model`` uses the
+configured sentence-transformers model instead.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.schemas import AnalysisResult, ReimbursementStatus  # noqa: E402
+from app.services import vector_store as vector_store_module  # noqa: E402
+from app.services.hybrid_retriever import HybridRetriever  # noqa: E402
+from benchmarks.fakes import HashedEmbedding  # noqa: E402
+
+FIRST_NAMES = ["Aarav", "Priya", "Rohan", "Ananya", "Vikram", "Neha", "Arjun", "Kavya", "Rahul", "Sneha",
+               "Karan", "Isha", "Aditya", "Meera", "Siddharth", "Pooja", "Nikhil", "Riya", "Amit", "Divya"]
+LAST_NAMES = ["Sharma", "Verma", "Iyer", "Nair", "Gupta", "Reddy", "Mehta", "Kapoor", "Das", "Joshi"]
+REASONS = {
+    "Food": ["Dinner at restaurant within the meal limit", "Team lunch exceeded the per meal limit",
+             "Breakfast during client visit"],
+    "Cab": ["Cab ride to airport within the daily limit", "Taxi fare includes toll charges",
+            "Office commute cab exceeded daily limit"],
+    "Travel": ["Flight ticket for client meeting", "Train fare for site visit",
+               "Bus ticket within the trip limit"],
+    "Accommodation": ["Hotel stay for two nights", "Lodging above the nightly limit",
+                      "Room booking during conference"],
+}
+
+
+def synthetic_records(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    employees = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    for i in range(count):
+        category = rng.choice(list(REASONS))
+        reason = rng.choice(REASONS[category])
+        if category == "Food" and rng.random() < 0.02:
+            reason += "; whisky on the bill is excluded"
+        requested = round(rng.uniform(50, 5000), 2)
+        status = rng.choice(list(ReimbursementStatus))
+        reimbursed = {ReimbursementStatus.FULLY: requested, ReimbursementStatus.DECLINED: 0.0}.get(
+            status, round(requested * rng.uniform(0.2, 0.9), 2))
+        yield {
+            "invoice_id": f"inv-{hashlib.sha256(str(i).encode()).hexdigest()[:16]}",
+            "invoice_text": "",
+            "employee_name": rng.choice(employees),
+            "analysis": AnalysisResult(category=category, status=status, reimbursed_amount=reimbursed,
+                                       requested_amount=requested, reason=reason, policy_references=[]),
+        }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def evaluate(run, queries, k):
+    latencies, precisions, reciprocal_ranks = [], [], []
+    for query, relevant in queries:
+        started = time.perf_counter()
+        ids = run(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        precisions.append(sum(doc_id in relevant for doc_id in ids[:k]) / min(k, len(relevant)))
+        rank = next((i for i, doc_id in enumerate(ids, start=1) if doc_id in relevant), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {
+        f"precision@{k}": round(statistics.mean(precisions), 4),
+        "mrr": round(statistics.mean(reciprocal_ranks), 4),
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per query set")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embedding", choices=["hashed", "model"], default="hashed")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--lexical-weight", type=float, default=1.0, help="BM25 weight in the fusion")
+    args = parser.parse_args()
+
+    if args.embedding == "hashed":
+        vector_store_module.LazyEmbeddingFunction = lambda *a, **kw: HashedEmbedding()
+
+    with tempfile.TemporaryDirectory(prefix="bench-retrieval-") as path:
+        store = vector_store_module.VectorStore(persist_path=path)
+        retriever = HybridRetriever(store, k=args.k, max_k=args.k, lexical_weight=args.lexical_weight)
+        retriever.build()
+
+        by_employee, by_id, whisky = {}, {}, set()
+        started = time.perf_counter()
+        batch = []
+        for record in synthetic_records(args.corpus):
+            by_employee.setdefault(record["employee_name"], set()).add(record["invoice_id"])
+            by_id[record["invoice_id"]] = {record["invoice_id"]}
+            if "whisky" in record["analysis"].reason:
+                whisky.add(record["invoice_id"])
+            batch.append(record)
+            if len(batch) >= args.batch_size:
+                store.store_analyses_bulk(batch, batch_size=args.batch_size)
+                batch = []
+        store.store_analyses_bulk(batch, batch_size=args.batch_size)
+        ingest_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rebuilt = HybridRetriever(store).build()
+        rebuild_s = time.perf_counter() - started
+
+        rng = random.Random(11)
+        query_sets = {
+            "employee_name": [(name, ids) for name, ids in rng.sample(sorted(by_employee.items()),
+                                                                   min(args.queries, len(by_employee)))],
+            "invoice_id": [(doc_id, ids) for doc_id, ids in rng.sample(sorted(by_id.items()),
+                                                                      min(args.queries, len(by_id)))],
+            "keyword": [(query, whisky) for query in ["whisky", "whisky excluded", "bill with whisky",
+                                                      "whisky on the bill"]] if whisky else [],
+        }
+        modes = {
+            "vector": lambda q: [hit["id"] for hit in store.search(q, n_results=args.k)],
+            "bm25": lambda q: [doc_id for doc_id, _ in retriever.index.search(q, args.k)],
+            "hybrid": lambda q: [hit["id"] for hit in retriever.search(q, k=args.k)["results"]],
+        }
+        report = {
+            "corpus": args.corpus,
+            "embedding": args.embedding,
+            "ingest_s": round(ingest_s, 2),
+            "ingest_per_s": round(args.corpus / ingest_s, 1) if ingest_s else None,
+            "bm25_rebuild_s": round(rebuild_s, 2),
+            "bm25_documents": rebuilt,
+            "results": {
+                query_set: {mode: evaluate(run, queries, args.k) for mode, run in modes.items()}
+                for query_set, queries in query_sets.items() if queries
+            },
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Offline stand-ins for the Gemini model and the embedding model
+
+``FakeChatModel`` answers the analysis, batch-analysis and chat prompts in
+the formats InvoiceAnalyzer and Chatbot parse, deterministically from the
+prompt text, after a configurable latency. ``HashedEmbedding`` is a
+bag-of-words hash embedding that needs no model download.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import re
+import time
+
+from app.services.hybrid_retriever import tokenize
+
+TOTAL_PATTERN = re.compile(r"Total:\s*(?:Rs\.?|₹)?\s*([\d,]+(?:\.\d+)?)", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+CATEGORY_KEYWORDS = {
+    "Cab": ("cab", "taxi", "toll"),
+    "Travel": ("flight", "train", "bus ticket"),
+    "Accommodation": ("hotel", "room", "lodging"),
+    "Food": ("biriyani", "naan", "dosa", "thali", "coffee", "meal", "whisky"),
+}
+# Per-invoice limits the fake "applies"; roughly the example policy
+LIMITS = {"Food": 1000.0, "Cab": 800.0, "Travel": 6000.0, "Accommodation": 4000.0, "Other": 500.0}
+
+
+class HashedEmbedding:
+    """Deterministic bag-of-words embedding (no model download)"""
+
+    def __init__(self, dimensions: int = 64):
+        self.dimensions = dimensions
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            vector = [0.0] * self.dimensions
+            for token in tokenize(text):
+                digest = hashlib.md5(token.encode()).digest()
+                vector[digest[0] % self.dimensions] += 1.0 if digest[1] & 1 else -1.0
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            vectors.append([v / norm for v in vector])
+        return vectors
+
+
+class FakeChatModel:
+    """Chat model with the invoke/ainvoke/astream surface the LLM gateway uses
+
+    ``latency`` seconds pass before the response (or its first token);
+    streamed answers then emit one word per ``token_latency`` seconds.
+    """
+
+    model = "fake-llm"
+    temperature = 0
+
+    def __init__(self, latency: float = 0.2, token_latency: float = 0.005):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+
+    def invoke(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+        time.sleep(self.latency)
+        return AIMessage(content=self.respond(prompt))
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+        await asyncio.sleep(self.latency)
+        return AIMessage(content=self.respond(prompt))
+
+    async def astream(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessageChunk
+        await asyncio.sleep(self.latency)
+        for word in re.findall(r"\S+\s*", self.respond(prompt)):
+            yield AIMessageChunk(content=word)
+            await asyncio.sleep(self.token_latency)
+
+    def respond(self, prompt) -> str:
+        self.calls += 1
+        text = _human_text(prompt)
+        if "INVOICES:" in text:
+            sections = re.split(r"^### Invoice (\d+)\n", text.split("INVOICES:", 1)[1], flags=re.MULTILINE)
+            results = []
+            for index, body in zip(sections[1::2], sections[2::2]):
+                category, requested, reimbursed, status, reason = _verdict(body)
+                results.append({"invoice_index": int(index), "category": category, "status": status,
+                                "reimbursed_amount": reimbursed, "requested_amount": requested,
+                                "reason": reason, "policy_references": [f"{category} limit"]})
+            return json.dumps(results)
+        if "INVOICE DETAILS:" in text:
+            category, requested, reimbursed, status, reason = _verdict(text.split("INVOICE DETAILS:", 1)[1])
+            return (f"Category: {category}\nStatus: {status}\nRequested Amount: ₹{requested:.2f}\n"
+                    f"Reimbursed Amount: ₹{reimbursed:.2f}\nReason: {reason}\n"
+                    f"Policy References:\n- {category} limit of ₹{LIMITS[category]:.0f}")
+        sources = re.findall(r"^\[(\d+)\] id: (\S+)", text, flags=re.MULTILINE)
+        cited = ", ".join(f"[{number}] {doc_id}" for number, doc_id in sources[:3]) or "no matching invoices"
+        return (f"- **Answer**: Found {len(sources)} relevant invoices; the closest matches are {cited}.\n"
+                f"- **Sources**: {', '.join(f'[{number}]' for number, _ in sources[:3]) or 'none'}\n"
+                f"- **Confidence**: {'High' if sources else 'Low'}")
+
+
+def _human_text(prompt) -> str:
+    if hasattr(prompt, "to_messages"):
+        messages = prompt.to_messages()
+        return str(messages[-1].content) if messages else ""
+    return str(prompt)
+
+
+def _verdict(invoice_text: str):
+    lowered = invoice_text.lower()
+    category = next((name for name, keywords in CATEGORY_KEYWORDS.items()
+                     if any(keyword in lowered for keyword in keywords)), "Other")
+    match = TOTAL_PATTERN.search(invoice_text)
+    if match:
+        requested = float(match.group(1).replace(",", ""))
+    else:
+        requested = max((float(n) for n in NUMBER_PATTERN.findall(invoice_text)), default=0.0)
+    limit = LIMITS[category]
+    if "whisky" in lowered:
+        reimbursed, status, reason = min(requested, limit) * 0.5, "Partially Reimbursed", \
+            "Alcohol is excluded from meal reimbursement"
+    elif requested <= limit:
+        reimbursed, status, reason = requested, "Fully Reimbursed", f"Within the {category} limit"
+    else:
+        reimbursed, status, reason = limit, "Partially Reimbursed", f"Capped at the {category} limit"
+    return category, round(requested, 2), round(reimbursed, 2), status, reason
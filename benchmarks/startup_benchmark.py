@@ -0,0 +1,71 @@
+"""Measure API cold start and per-request component lookup latency
+
+Each phase runs in a fresh interpreter so module caches do not hide import
+cost. Prints a JSON report:
+
+    python benchmarks/startup_benchmark.py [--skip-warm-up] [--repeat 3]
+
+``import_main_ms`` is the cost of importing the FastAPI app, ``warm_up_ms``
+the one-off component construction and embedding model load done in the
+lifespan, and ``getter_us`` the per-request cost of fetching a warmed
+component (what a Streamlit rerun now pays instead of a model reload).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+from app import main
+report = {{"import_main_ms": (time.perf_counter() - started) * 1000,
+          "heavy_modules_loaded": sorted(m for m in ("torch", "chromadb", "sentence_transformers",
+                                                      "langchain_core", "langchain_google_genai")
+                                         if m in sys.modules)}}
+from app.services import resources
+if {warm_up!r}:
+    started = time.perf_counter()
+    resources.warm_up()
+    report["warm_up_ms"] = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    for _ in range(10000):
+        resources.get_analyzer()
+        resources.get_vector_store()
+    report["getter_us"] = (time.perf_counter() - started) / 20000 * 1e6
+print(json.dumps(report))
+"""
+
+
+def run_probe(warm_up: bool) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(root=ROOT, warm_up=warm_up)],
+        check=True, capture_output=True, text=True, cwd=ROOT
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-warm-up", action="store_true",
+                        help="only time the import (no model download needed)")
+    args = parser.parse_args()
+
+    runs = [run_probe(not args.skip_warm_up) for _ in range(args.repeat)]
+    report = {"runs": args.repeat, "heavy_modules_loaded": runs[0]["heavy_modules_loaded"]}
+    for key in ("import_main_ms", "warm_up_ms", "getter_us"):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            report[key] = {"median": round(statistics.median(values), 3),
+                           "min": round(min(values), 3), "max": round(max(values), 3)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Synthetic invoice PDFs and ZIPs modelled on examples/Meal_Invoice_1.pdf
+
+    python benchmarks/synthetic.py --invoices 50 --items 8 --out invoices.zip
+
+The header and footer lines of the example invoice are reused; receipt
+number, date, line items and totals vary per invoice, and a share of the
+invoices are cab, travel or hotel bills instead of meals. PDFs are written
+by a minimal single-font writer, so no PDF library is needed to generate
+them and any extraction backend can read them. Output is deterministic for
+a given seed.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import zipfile
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EXAMPLES = os.path.join(ROOT, "examples")
+INVOICE_TEMPLATE = os.path.join(EXAMPLES, "Meal_Invoice_1.pdf")
+POLICY_TEMPLATE = os.path.join(EXAMPLES, "test_policy.pdf")
+
+# (item, unit price) per category; the meal items follow the example invoice
+CATALOG = {
+    "Food": [("Biriyani", 200.0), ("Royal Stag Whisky", 150.0), ("Paneer Tikka", 180.0), ("Butter Naan", 40.0),
+             ("Masala Dosa", 90.0), ("Filter Coffee", 30.0), ("Veg Thali", 160.0), ("Gulab Jamun", 60.0)],
+    "Cab": [("Cab ride - airport drop", 650.0), ("Taxi fare - city", 240.0), ("Toll charges", 85.0),
+            ("Waiting charges", 50.0)],
+    "Travel": [("Flight ticket BLR-DEL", 5400.0), ("Train fare 2A", 1850.0), ("Bus ticket", 700.0),
+               ("Seat selection", 300.0)],
+    "Accommodation": [("Hotel room - deluxe", 3200.0), ("Room service", 450.0), ("Laundry", 200.0),
+                      ("Late checkout", 800.0)],
+}
+HEADERS = {
+    "Cab": ["CITY CABS PVT LTD", "Ring Road Bengaluru", "1800 111111"],
+    "Travel": ["SKYWAY TRAVELS", "MG Road Bengaluru", "1800 222222"],
+    "Accommodation": ["HOTEL RESIDENCY", "Brigade Road Bengaluru", "1800 333333"],
+}
+FALLBACK_HEADER = ["WEST HOLLYWOOD", "7677 state Los Angeles", "1800 000000"]
+FALLBACK_FOOTER = ["PLEASE VISIT US AGAIN", "THANK YOU!!"]
+
+
+def template_parts(path: str = INVOICE_TEMPLATE) -> Tuple[List[str], List[str]]:
+    """Header lines (before the receipt number) and footer lines of the example invoice"""
+    try:
+        from app.services.pdf_processor import extract_text_from_pdf
+        lines = [line.strip() for line in extract_text_from_pdf(path).splitlines() if line.strip()]
+    except Exception:
+        return FALLBACK_HEADER, FALLBACK_FOOTER
+    start = next((i for i, line in enumerate(lines) if line.startswith("Receipt No")), None)
+    end = next((i for i, line in enumerate(lines) if line.startswith("Payment Mode")), None)
+    if start is None or end is None:
+        return FALLBACK_HEADER, FALLBACK_FOOTER
+    return lines[:start], lines[end + 1:]
+
+
+def invoice_lines(rng: random.Random, header: List[str], footer: List[str], items: int = 3,
+                  category: Optional[str] = None, food_share: float = 0.6) -> Tuple[List[str], Dict]:
+    """Text lines of one invoice and its ground truth (category, total)"""
+    if category is None:
+        category = "Food" if rng.random() < food_share else rng.choice(["Cab", "Travel", "Accommodation"])
+    issued = datetime(2024, 1, 1) + timedelta(minutes=rng.randrange(365 * 24 * 60))
+    lines = list(header if category == "Food" else HEADERS[category])
+    lines += [
+        f"Receipt No.: {rng.randrange(1000, 99999)}",
+        f"Table No.: {rng.randrange(1, 60)}" if category == "Food" else f"Booking Ref: {rng.randrange(10**7, 10**8)}",
+        f"Date: {issued:%b} {issued.day}, {issued:%Y %H:%M}",
+        "QTY / Item Name / Price / Amount",
+    ]
+    subtotal = 0.0
+    for name, price in (rng.choice(CATALOG[category]) for _ in range(max(1, items))):
+        quantity = rng.randint(1, 3)
+        subtotal += quantity * price
+        lines.append(f"{quantity} {name} {price:.2f} {quantity * price:.2f}")
+    tax = round(subtotal * 0.05, 2)
+    total = round(subtotal + 2 * tax, 2)
+    lines += [f"Sub Total: {subtotal:.2f}", f"CGST: 5% {tax:.2f}", f"SGST: 5% {tax:.2f}",
+              f"Total: Rs. {total:.2f}", "Payment Mode: Card"]
+    lines += footer
+    return lines, {"category": category, "total": total}
+
+
+def write_pdf(lines: List[str], font_size: int = 11) -> bytes:
+    """Minimal PDF (Helvetica, A4, as many pages as the lines need)"""
+    leading = round(font_size * 1.4, 1)
+    per_page = int((842 - 100) // leading)
+    pages = [lines[i:i + per_page] for i in range(0, len(lines), per_page)] or [[]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for page in pages:
+        text = " T* ".join(f"({_escape(line)}) Tj" for line in page)
+        stream = f"BT /F1 {font_size} Tf {leading} TL 50 792 Td {text} ET".encode("latin-1")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream")
+        content_number = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_number} 0 R >>")
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode("latin-1"))
+        out.write(body if isinstance(body, bytes) else body.encode("latin-1"))
+        out.write(b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def _escape(line: str) -> str:
+    line = line.replace("₹", "Rs. ").encode("latin-1", "replace").decode("latin-1")
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_zip(invoices: int, items: int = 3, seed: int = 0,
+              parts: Optional[Tuple[List[str], List[str]]] = None) -> Tuple[bytes, List[Dict]]:
+    """ZIP of ``invoices`` synthetic PDFs and the ground truth of each, in ZIP order"""
+    rng = random.Random(seed)
+    header, footer = parts or template_parts()
+    buffer, truth = io.BytesIO(), []
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i in range(invoices):
+            lines, facts = invoice_lines(rng, header, footer, items)
+            archive.writestr(f"invoice_{seed}_{i:05d}.pdf", write_pdf(lines))
+            truth.append(facts)
+    return buffer.getvalue(), truth
+
+
+def policy_bytes() -> bytes:
+    with open(POLICY_TEMPLATE, "rb") as f:
+        return f.read()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=10)
+    parser.add_argument("--items", type=int, default=3, help="line items per invoice (more items, more pages)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic_invoices.zip")
+    args = parser.parse_args()
+    data, _ = build_zip(args.invoices, args.items, args.seed)
+    with open(args.out, "wb") as f:
+        f.write(data)
+    print(f"wrote {args.invoices} invoices ({len(data)} bytes) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
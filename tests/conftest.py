@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the app the way the services do (``app.services...``)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_vector_store(tmp_path, monkeypatch):
+    """Build VectorStores on a temporary Chroma path with an offline embedding"""
+    from app.services import vector_store
+    from benchmarks.fakes import HashedEmbedding
+
+    monkeypatch.setattr(vector_store, "LazyEmbeddingFunction", lambda *args, **kwargs: HashedEmbedding())
+
+    def make(name: str = "chroma") -> vector_store.VectorStore:
+        return vector_store.VectorStore(persist_path=str(tmp_path / name))
+    return make
+
+
+@pytest.fixture
+def analysis():
+    from app.models.schemas import AnalysisResult, ReimbursementStatus
+
+    def make(amount: float = 100.0, status: ReimbursementStatus = ReimbursementStatus.FULLY):
+        return AnalysisResult(category="Food", status=status, reimbursed_amount=amount, requested_amount=amount,
+                              reason="Within limit", policy_references=[])
+    return make
@@ -0,0 +1,142 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.models.schemas import AnalysisResult, ReimbursementStatus
+from app.services.dedup import DedupIndex, invoice_id_for
+from app.services.pipeline import InvoicePipeline
+from app.services.text_utils import sha256_bytes
+from benchmarks.synthetic import write_pdf
+
+ITEMS = [f"Item {name} quantity {i} price {100 + i}.00" for i, name in enumerate(
+    ["masala dosa", "filter coffee", "idli vada", "paneer tikka", "veg biryani", "butter naan",
+     "dal makhani", "gulab jamun", "lassi", "mineral water", "rasam rice", "curd rice"])]
+
+
+def invoice_text(total: str = "1,500.00", header: str = "Saravana Bhavan") -> str:
+    return "\n".join([header, "Bill no 4411", *ITEMS, f"Total: {total}"])
+
+
+def stored(index: DedupIndex, byte_hash: str, text: str, amount: float = 100.0) -> None:
+    assert index.check_bytes(byte_hash, f"{byte_hash[:6]}.pdf") is None
+    assert index.check_text(byte_hash, text) is None
+    index.commit([{"byte_hash": byte_hash, "status": "Fully Reimbursed", "reimbursed_amount": amount}])
+
+
+@pytest.fixture
+def index(tmp_path):
+    dedup = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    yield dedup
+    dedup.close()
+
+
+def test_exact_text_and_near_matches_of_stored_invoices(index):
+    original = sha256_bytes(b"original")
+    stored(index, original, invoice_text())
+
+    exact = index.check_bytes(original, "copy.pdf")
+    assert exact["match"] == "exact" and exact["status"] == "Fully Reimbursed"
+
+    rerendered = sha256_bytes(b"rerendered")
+    assert index.check_bytes(rerendered, "rerendered.pdf") is None
+    text = index.check_text(rerendered, invoice_text().upper().replace("\n", "  \n"))
+    assert text["match"] == "text" and text["invoice_id"] == invoice_id_for(original)
+    # The other file of the same invoice is now known by its bytes too
+    assert index.check_bytes(rerendered, "again.pdf")["match"] == "exact"
+
+    edited = sha256_bytes(b"edited")
+    assert index.check_bytes(edited, "edited.pdf") is None
+    near = index.check_text(edited, invoice_text(total="1,550.00"))
+    assert near["match"] == "near" and near["similarity"] >= index.near_threshold
+
+
+def test_different_invoice_from_same_template_is_new(index):
+    stored(index, sha256_bytes(b"original"), invoice_text())
+    other = sha256_bytes(b"other")
+    assert index.check_bytes(other, "other.pdf") is None
+    assert index.check_text(other, "\n".join(["Saravana Bhavan", "Bill no 9", ITEMS[0], "Total: 100.00"])) is None
+
+
+def test_claims_are_shared_between_processes_on_one_file(tmp_path):
+    first, second = (DedupIndex(str(tmp_path / "dedup.sqlite3")) for _ in range(2))
+    byte_hash = sha256_bytes(b"invoice")
+    assert first.check_bytes(byte_hash, "a.pdf") is None
+    match = second.check_bytes(byte_hash, "b.pdf")
+    assert match["in_flight"] and match["invoice_id"] == invoice_id_for(byte_hash)
+
+    other = sha256_bytes(b"retyped")
+    first.check_text(byte_hash, invoice_text())
+    assert second.check_bytes(other, "retyped.pdf") is None
+    assert second.check_text(other, invoice_text())["in_flight"]
+
+    first.release(byte_hash)
+    assert second.check_bytes(byte_hash, "b.pdf") is None
+    assert second.stats()["in_flight"] == 1
+
+
+def test_claims_of_dead_processes_expire(index):
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    byte_hash = sha256_bytes(b"orphan")
+    index._conn.execute(
+        "INSERT INTO invoice_claims (byte_hash, invoice_id, filename, owner_pid, claimed_at) VALUES (?, ?, ?, ?, ?)",
+        (byte_hash, invoice_id_for(byte_hash), "orphan.pdf", child.pid, time.time())
+    )
+    assert index.check_bytes(byte_hash, "orphan.pdf") is None
+
+
+def test_old_claims_expire(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"), claim_ttl=0)
+    byte_hash = sha256_bytes(b"slow")
+    assert index.check_bytes(byte_hash, "slow.pdf") is None
+    assert index.check_bytes(byte_hash, "slow.pdf") is None
+
+
+class Analyzer:
+    """Answers after a short delay; the first ``failures`` calls fail"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+
+    async def aanalyze_invoice(self, policy, text, bypass_cache=False):
+        await asyncio.sleep(0.05)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("provider down")
+        return AnalysisResult(category="Food", status=ReimbursementStatus.FULLY, reimbursed_amount=100.0,
+                              requested_amount=100.0, reason="Within limit", policy_references=[])
+
+
+class VectorStore:
+    def store_analyses_bulk(self, writes, batch_size=None):
+        pass
+
+
+def run(pipeline, invoices):
+    return asyncio.run(pipeline.run("policy", invoices, "Asha"))
+
+
+def test_near_duplicate_of_failed_in_flight_invoice_is_processed(index):
+    original = write_pdf(invoice_text().splitlines())
+    edited = write_pdf(invoice_text(total="1,550.00").splitlines())
+    # Whichever invoice is claimed first fails; the other waited for it and is then processed
+    pipeline = InvoicePipeline(Analyzer(failures=1), VectorStore(), max_workers=2, dedup=index)
+
+    results = run(pipeline, [("original.pdf", original), ("edited.pdf", edited)])
+    assert sorted(r["status"] for r in results) == ["Failed", "Fully Reimbursed"]
+    assert index.stats()["in_flight"] == 0
+
+
+def test_in_batch_duplicate_reports_the_stored_original(index):
+    data = write_pdf(invoice_text().splitlines())
+    pipeline = InvoicePipeline(Analyzer(), VectorStore(), max_workers=2, dedup=index)
+
+    results = run(pipeline, [("a.pdf", data), ("b.pdf", data)])
+    statuses = sorted(r["status"] for r in results)
+    assert statuses == ["Duplicate", "Fully Reimbursed"]
+    duplicate = next(r for r in results if r["status"] == "Duplicate")
+    assert "already Fully Reimbursed" in duplicate["reason"]
+    assert len(index) == 1 and index.stats()["in_flight"] == 0
@@ -0,0 +1,54 @@
+import pytest
+
+from app.services.vector_store import build_where, matches_where
+
+RECORD = {"employee": "Asha", "status": "Declined", "category": "Food", "reimbursed_amount": 0.0,
+          "requested_amount": 1200.0, "timestamp": 1700000000.0}
+
+
+@pytest.mark.parametrize("filters, where", [
+    (None, None),
+    ({}, None),
+    ({"employee": "Asha"}, {"employee": {"$eq": "Asha"}}),
+    ({"status": "declined"}, {"status": {"$eq": "Declined"}}),
+    ({"requested_amount": "1000"}, {"requested_amount": {"$gte": 1000.0}}),
+    ({"requested_amount": {"gt": 1000, "lte": 5000}},
+     {"$and": [{"requested_amount": {"$gt": 1000.0}}, {"requested_amount": {"$lte": 5000.0}}]}),
+    ({"category": ["Food", "Cab"]}, {"category": {"$in": ["Food", "Cab"]}}),
+    ({"or": [{"employee": "Asha"}, {"employee": "Ravi"}]},
+     {"$or": [{"employee": {"$eq": "Asha"}}, {"employee": {"$eq": "Ravi"}}]}),
+    ({"and": [{}, {"employee": "Asha"}]}, {"employee": {"$eq": "Asha"}}),
+])
+def test_build_where(filters, where):
+    assert build_where(filters) == where
+
+
+@pytest.mark.parametrize("filters, message", [
+    ({"or": ["x"]}, "list of filter objects"),
+    ({"and": {"employee": "Asha"}}, "expects a list"),
+    (["employee"], "must be an object"),
+    ({"employee": {"like": "A%"}}, "Unsupported filter operator"),
+    ({"category": {"in": "Food"}}, "needs a list"),
+    ({"category": {"eq": ["Food"]}}, "does not take a list"),
+    ({"employee": {"eq": {"name": "Asha"}}}, "plain value"),
+    ({"category": [["Food"]]}, "plain value"),
+    ({"reimbursed_amount": {"gt": "lots"}}, "needs a number"),
+])
+def test_malformed_filters_raise_value_error(filters, message):
+    with pytest.raises(ValueError, match=message):
+        build_where(filters)
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"employee": "Asha"}, True),
+    ({"employee": "Ravi"}, False),
+    ({"status": "declined", "category": ["Food", "Travel"]}, True),
+    ({"requested_amount": {"gt": 1000, "lte": 1200}}, True),
+    ({"requested_amount": {"lt": 1200}}, False),
+    ({"category": {"nin": ["Food"]}}, False),
+    ({"or": [{"employee": "Ravi"}, {"reimbursed_amount": {"eq": 0}}]}, True),
+    ({"and": [{"employee": "Asha"}, {"status": "fully"}]}, False),
+    ({"missing": {"gt": 1}}, False),
+])
+def test_matches_where_agrees_with_the_filter(filters, expected):
+    assert matches_where(RECORD, build_where(filters)) is expected
@@ -0,0 +1,53 @@
+from app.services.hybrid_retriever import HybridRetriever
+
+
+def fill(store, analysis, count: int) -> None:
+    for i in range(count):
+        store.store_analysis(f"inv-{i}", f"Lunch at cafe {i} masala dosa", analysis(100.0 + i), "Asha")
+
+
+def pages(retriever, query, k):
+    seen, cursor = [], None
+    while True:
+        page = retriever.search(query, k=k, cursor=cursor)
+        seen.extend(hit["id"] for hit in page["results"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            return seen
+
+
+def test_pages_are_cut_from_one_candidate_list(make_vector_store, analysis):
+    store = make_vector_store()
+    fill(store, analysis, 12)
+    retriever = HybridRetriever(store, max_k=5, depth_multiplier=2)
+
+    paged = pages(retriever, "Asha reimbursed", k=3)
+    assert len(paged) == len(set(paged))
+    # Small pages walk the same ranking a single deep page over the same depth returns
+    deep = HybridRetriever(store, max_k=10, depth_multiplier=1)
+    assert paged[:10] == [hit["id"] for hit in deep.search("Asha reimbursed", k=10)["results"]]
+
+
+def test_metadata_only_listing_stops_at_candidate_depth(make_vector_store, analysis):
+    store = make_vector_store()
+    fill(store, analysis, 8)
+    retriever = HybridRetriever(store, max_k=2, depth_multiplier=2)
+
+    listed = pages(retriever, None, k=2)
+    assert len(listed) == retriever.depth == 4
+    assert len(set(listed)) == 4
+
+
+def test_index_is_rebuilt_when_another_writer_changes_the_collection(make_vector_store, analysis):
+    store = make_vector_store()
+    fill(store, analysis, 2)
+    retriever = HybridRetriever(store)
+    retriever.search("dosa")
+    assert retriever.stats()["indexed_documents"] == 2
+
+    # A second store on the same path stands in for another process; no listener sees its write
+    other = make_vector_store()
+    other.store_analysis("inv-remote", "Taxi fare to airport", analysis(), "Ravi")
+    hits = {hit["id"]: hit for hit in retriever.search("Ravi", k=3)["results"]}
+    assert hits["inv-remote"]["lexical_rank"] == 1
+    assert retriever.stats()["indexed_documents"] == 3
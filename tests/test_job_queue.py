@@ -0,0 +1,118 @@
+import asyncio
+import io
+import os
+import zipfile
+
+import pytest
+
+from app.services.job_queue import JobExpiredError, JobQueue
+from app.services.pipeline import InvoicePipeline
+from app.services.policy_registry import PolicyRegistry
+from benchmarks.synthetic import write_pdf
+from tests.test_pipeline import FakeAnalyzer
+
+
+class FlakyVectorStore:
+    """Fails its first ``failures`` writes"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.stored = []
+
+    def store_analyses_bulk(self, writes, batch_size=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("disk full")
+        self.stored.extend(write["invoice_id"] for write in writes)
+
+
+def invoices_zip(count: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for i in range(count):
+            zf.writestr(f"invoice_{i}.pdf", write_pdf([f"Cafe {i}", "Coffee 100", "Total: 100"]))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    def make(vector_store, **options) -> JobQueue:
+        pipeline = InvoicePipeline(FakeAnalyzer(), vector_store, max_workers=1, write_batch_size=1)
+        return JobQueue(pipeline, PolicyRegistry(), db_path=str(tmp_path / "jobs.sqlite3"),
+                        job_root=str(tmp_path / "jobs"), **options)
+    return make
+
+
+def submit(queue: JobQueue, count: int) -> str:
+    return queue.submit(write_pdf(["Meals up to 500 per day"]), invoices_zip(count), "Asha")["job_id"]
+
+
+def run_next(queue: JobQueue) -> None:
+    asyncio.run(queue._run(queue.store.claim(queue.stale_after)))
+
+
+def test_interrupted_job_resumes_from_its_checkpoints(make_queue):
+    store = FlakyVectorStore(failures=1)
+    queue = make_queue(store, stale_after=0)
+    job_id = submit(queue, 3)
+    # The worker dies after the invoices were checkpointed but before the job was finished
+    asyncio.run(queue._process(queue.store.claim(queue.stale_after)))
+
+    report = queue.status(job_id)
+    assert report["status"] == "running"
+    assert report["progress"]["processed"] == 2 and report["progress"]["failed"] == 1
+    assert len(store.stored) == 2
+
+    # Its stale heartbeat lets another worker take it over; only the failed invoice runs again
+    run_next(queue)
+    report = queue.status(job_id)
+    assert report["status"] == "completed"
+    assert report["progress"] == {"total": 3, "processed": 3, "failed": 0, "duplicates": 0, "remaining": 0,
+                                  "total_reimbursed": 300.0}
+    assert len(store.stored) == len(set(store.stored)) == 3
+    assert [item["index"] for item in report["results"]] == [0, 1, 2]
+
+
+def test_job_with_failed_invoices_keeps_its_uploads_and_resumes(make_queue):
+    store = FlakyVectorStore(failures=1)
+    queue = make_queue(store)
+    job_id = submit(queue, 3)
+    run_next(queue)
+
+    report = queue.status(job_id)
+    assert report["status"] == "failed" and report["uploads_kept"]
+    assert report["error"] == "1 of 3 invoices failed; resume the job to retry them"
+    assert report["progress"]["failed"] == 1
+
+    assert queue.resume(job_id)["status"] == "queued"
+    run_next(queue)
+    report = queue.status(job_id)
+    assert report["status"] == "completed" and not report["uploads_kept"]
+    assert report["progress"]["processed"] == 3 and report["error"] is None
+    assert len(store.stored) == len(set(store.stored)) == 3
+
+
+def test_completed_job_uploads_are_deleted(make_queue):
+    queue = make_queue(FlakyVectorStore())
+    job_id = submit(queue, 1)
+    job_dir = queue.store.get(job_id)["job_dir"]
+    run_next(queue)
+
+    assert not os.path.exists(job_dir)
+    assert queue.status(job_id)["uploads_kept"] is False
+
+
+def test_failed_job_uploads_are_kept_until_retention_ends(make_queue):
+    queue = make_queue(FlakyVectorStore(), retention=60)
+    job_id = submit(queue, 1)
+    job_dir = queue.store.get(job_id)["job_dir"]
+    queue.store.claim(queue.stale_after)
+    queue.store.finish(job_id, "failed", "crashed")
+
+    assert queue.sweep() == 0 and os.path.isdir(job_dir)
+    finished_at = queue.store.get(job_id)["finished_at"]
+    assert queue.sweep(now=finished_at + 61) == 1
+    assert not os.path.exists(job_dir)
+    with pytest.raises(JobExpiredError):
+        queue.resume(job_id)
+    assert queue.status(job_id)["status"] == "failed"
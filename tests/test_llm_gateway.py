@@ -0,0 +1,281 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.llm_gateway import (CircuitBreaker, CircuitOpenError, LLMGateway, LLMUnavailableError, TokenBucket,
+                                      is_retryable)
+
+
+class ScriptedModel:
+    """Chat model whose calls wait on ``gate`` and then answer or raise the next scripted error"""
+
+    model = "scripted"
+    temperature = 0
+
+    def __init__(self, errors=(), latency: float = 0.0, chunk_delays=()):
+        self.errors = list(errors)
+        self.latency = latency
+        self.chunk_delays = list(chunk_delays)
+        self.calls = 0
+        self.gate = None
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"answer to {prompt}"
+
+    async def astream(self, prompt):
+        self.calls += 1
+        for delay in self.chunk_delays:
+            await asyncio.sleep(delay)
+            yield "chunk"
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def gateway(**overrides) -> LLMGateway:
+    options = dict(requests_per_minute=1e9, max_retries=0, base_delay=0, timeout=1.0,
+                   failure_threshold=2, reset_timeout=0.05)
+    options.update(overrides)
+    return LLMGateway(**options)
+
+
+def test_identical_concurrent_prompts_share_one_call():
+    gw, llm = gateway(), ScriptedModel(latency=0.05)
+
+    async def run():
+        return await asyncio.gather(*(gw.ainvoke(llm, "same") for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer to same"] * 5
+    assert llm.calls == 1
+    assert gw.stats()["deduplicated"] == 4
+    assert gw.stats()["inflight"] == 0
+
+
+def test_cancelled_follower_does_not_affect_leader():
+    gw, llm = gateway(), ScriptedModel()
+
+    async def run():
+        llm.gate = asyncio.Event()
+        leader = asyncio.create_task(gw.ainvoke(llm, "p"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(gw.ainvoke(llm, "p"))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        llm.gate.set()
+        return await leader, follower
+
+    result, follower = asyncio.run(run())
+    assert result == "answer to p"
+    assert follower.cancelled()
+    assert llm.calls == 1
+
+
+def test_cancelled_leader_lets_followers_retry():
+    gw, llm = gateway(), ScriptedModel()
+
+    async def run():
+        llm.gate = asyncio.Event()
+        leader = asyncio.create_task(gw.ainvoke(llm, "p"))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(gw.ainvoke(llm, "p")) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        llm.gate.set()
+        return leader, await asyncio.gather(*followers)
+
+    leader, results = asyncio.run(run())
+    assert leader.cancelled()
+    assert results == ["answer to p", "answer to p"]
+    # One follower took over the call; the other waited on it
+    assert llm.calls == 2
+
+
+def test_errors_reach_every_waiter():
+    gw, llm = gateway(), ScriptedModel(errors=[BadRequest("bad prompt")], latency=0.02)
+
+    async def run():
+        return await asyncio.gather(*(gw.ainvoke(llm, "p") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, BadRequest) for r in results)
+    assert llm.calls == 1
+
+
+def test_sync_invoke_times_out_and_retries():
+    gw, llm = gateway(timeout=0.05, max_retries=1), ScriptedModel(latency=0.5)
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailableError, match="timed out"):
+        gw.invoke(llm, "slow")
+    assert time.monotonic() - started < 0.4
+    assert gw.stats()["timeouts"] == 2
+
+
+def test_retryable_errors_are_retried():
+    gw, llm = gateway(max_retries=2, failure_threshold=5), ScriptedModel(errors=[RateLimited(), RateLimited()])
+    assert gw.invoke(llm, "p") == "answer to p"
+    assert llm.calls == 3
+    assert gw.stats()["retries"] == 2
+
+
+def test_token_bucket_spaces_requests_after_the_burst():
+    bucket = TokenBucket(60, capacity=1)
+    waits = [bucket.reserve(1) for _ in range(3)]
+    assert waits[0] == 0
+    assert waits[1] == pytest.approx(1, abs=0.05)
+    assert waits[2] == pytest.approx(2, abs=0.05)
+
+
+def test_rate_limited_calls_wait():
+    gw, llm = gateway(requests_per_minute=600), ScriptedModel()
+    gw.request_bucket.reserve(gw.request_bucket.capacity)
+
+    started = time.monotonic()
+    gw.invoke(llm, "p")
+    assert time.monotonic() - started >= 0.05
+    assert gw.stats()["rate_limited_s"] > 0
+
+
+def test_breaker_opens_then_half_opens_with_one_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_abandoned_probe_frees_the_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.before_call() is True
+    breaker.abandon_probe()
+    assert breaker.before_call() is True
+
+
+def test_non_retryable_error_while_half_open_closes_breaker():
+    gw = gateway(failure_threshold=1)
+    llm = ScriptedModel(errors=[RateLimited(), BadRequest("bad")])
+    with pytest.raises(LLMUnavailableError):
+        gw.invoke(llm, "p")
+    assert gw.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        gw.invoke(llm, "p")
+
+    time.sleep(0.06)
+    with pytest.raises(BadRequest):
+        gw.invoke(llm, "p")
+    assert gw.breaker.state == "closed"
+    assert gw.invoke(llm, "p") == "answer to p"
+
+
+def test_cancelled_probe_does_not_wedge_half_open():
+    gw, llm = gateway(failure_threshold=1), ScriptedModel(errors=[RateLimited()])
+    with pytest.raises(LLMUnavailableError):
+        gw.invoke(llm, "p")
+    time.sleep(0.06)
+
+    async def run():
+        llm.gate = asyncio.Event()
+        probe = asyncio.create_task(gw.ainvoke(llm, "probe"))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await gw.ainvoke(llm, "other")
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        llm.gate.set()
+        return await gw.ainvoke(llm, "after")
+
+    assert asyncio.run(run()) == "answer to after"
+    assert gw.breaker.state == "closed"
+
+
+def test_stream_yields_chunks():
+    gw, llm = gateway(), ScriptedModel(chunk_delays=[0, 0, 0])
+
+    async def run():
+        return [chunk async for chunk in gw.astream(llm, "p")]
+
+    assert asyncio.run(run()) == ["chunk"] * 3
+
+
+def test_stalled_stream_times_out():
+    gw, llm = gateway(timeout=0.05), ScriptedModel(chunk_delays=[0, 1.0])
+
+    async def run():
+        chunks = []
+        with pytest.raises(LLMUnavailableError, match="stalled"):
+            async for chunk in gw.astream(llm, "p"):
+                chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(run()) == ["chunk"]
+    assert gw.stats()["timeouts"] == 1
+
+
+class ServiceUnavailable(Exception):
+    """Named like google.api_core.exceptions.ServiceUnavailable"""
+
+
+class WrappedError(Exception):
+    pass
+
+
+def wrapped(cause: Exception) -> Exception:
+    try:
+        raise WrappedError("model call failed") from cause
+    except WrappedError as e:
+        return e
+
+
+@pytest.mark.parametrize("error, expected", [
+    (RateLimited("slow down"), True),
+    (BadRequest("connection timeout: field 'unavailable' must be < 500"), False),
+    (ServiceUnavailable("backend down"), True),
+    (ConnectionResetError("reset by peer"), True),
+    (asyncio.TimeoutError(), True),
+    (ValueError("connection string is invalid"), False),
+    (RuntimeError("429 Resource has been exhausted (e.g. check quota)."), True),
+    (wrapped(RateLimited()), True),
+    (wrapped(BadRequest("timeout")), False),
+])
+def test_retryable_errors_are_decided_by_type_and_status(error, expected):
+    assert is_retryable(error) is expected
+
+
+def test_client_errors_mentioning_transient_words_do_not_open_the_breaker():
+    gw = gateway(max_retries=2, failure_threshold=1)
+    llm = ScriptedModel(errors=[BadRequest("request timeout field is unavailable")])
+    with pytest.raises(BadRequest):
+        gw.invoke(llm, "p")
+    assert llm.calls == 1
+    assert gw.breaker.state == "closed"
@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import pytest
+
+from app.models.schemas import ReimbursementStatus
+from app.services.llm_service import InvoiceAnalyzer
+from benchmarks.fakes import FakeChatModel
+
+
+def bill(item: str, total: int) -> str:
+    return f"{item}\nTotal: Rs. {total}"
+
+
+BILLS = [bill("Coffee", 120), bill("Cab ride", 450), bill("Hotel room", 3000)]
+
+
+class ScriptedChatModel(FakeChatModel):
+    """FakeChatModel whose batch prompts get a fixed (possibly broken) reply"""
+
+    def __init__(self, batch_reply: str):
+        super().__init__(latency=0, token_latency=0)
+        self.batch_reply = batch_reply
+        self.batch_calls = 0
+        self.single_calls = 0
+
+    def respond(self, prompt) -> str:
+        answer = super().respond(prompt)
+        if answer.startswith("["):
+            self.batch_calls += 1
+            return self.batch_reply
+        self.single_calls += 1
+        return answer
+
+
+def make_analyzer(llm=None, **options) -> InvoiceAnalyzer:
+    return InvoiceAnalyzer(llm=llm or FakeChatModel(latency=0, token_latency=0), **options)
+
+
+def batch_item(index: int, category: str = "Food", amount: float = 120.0) -> dict:
+    return {"invoice_index": index, "category": category, "status": "Fully Reimbursed",
+            "reimbursed_amount": amount, "requested_amount": amount,
+            "reason": "Within limit", "policy_references": []}
+
+
+def test_pack_batches_respects_size_and_token_budget():
+    analyzer = make_analyzer(max_batch_size=2)
+    assert analyzer.pack_batches(["short"] * 5) == [[0, 1], [2, 3], [4]]
+
+    analyzer = make_analyzer(batch_token_budget=400, max_batch_size=10)
+    long_invoice = "word " * 300
+    # Overhead plus one long invoice fills the budget; an oversized invoice still gets its own batch
+    assert analyzer.pack_batches(["short", long_invoice, "short"]) == [[0], [1], [2]]
+    assert analyzer.pack_batches([]) == []
+
+
+def test_pack_batches_counts_the_policy_overhead():
+    analyzer = make_analyzer(batch_token_budget=1000, max_batch_size=10)
+    invoices = ["word " * 100] * 4
+    assert len(analyzer.pack_batches(invoices)) == 1
+    assert len(analyzer.pack_batches(invoices, policy="policy " * 500)) > 1
+
+
+def test_parse_batch_response_orders_by_invoice_index():
+    reply = "```json\n" + json.dumps([batch_item(1, "Cab", 450.0), batch_item(0)]) + "\n```"
+
+    parsed = make_analyzer()._parse_batch_response(reply, 2)
+
+    assert [result.category for result, _ in parsed] == ["Food", "Cab"]
+    assert parsed[1][0].reimbursed_amount == 450.0
+    assert "invoice_index" not in parsed[0][1]
+
+
+@pytest.mark.parametrize("reply", [
+    json.dumps([batch_item(0)]),                                  # too short
+    json.dumps({"results": [batch_item(0), batch_item(1)]}),      # not an array
+    json.dumps([batch_item(0), batch_item(0)]),                   # duplicate index
+    json.dumps([batch_item(0), batch_item(5)]),                   # index out of range
+    json.dumps([batch_item(0), dict(batch_item(1), status="Maybe")]),  # fails validation
+    "Sorry, I cannot help with that.",                            # not JSON
+])
+def test_parse_batch_response_rejects_malformed_arrays(reply):
+    with pytest.raises(ValueError):
+        make_analyzer()._parse_batch_response(reply, 2)
+
+
+def test_batch_mode_uses_one_call_per_batch():
+    llm = FakeChatModel(latency=0, token_latency=0)
+    analyzer = make_analyzer(llm)
+
+    results = asyncio.run(analyzer.aanalyze_batch("policy", BILLS))
+
+    assert llm.calls == 1
+    assert [r.category for r in results] == ["Food", "Cab", "Accommodation"]
+    assert [r.requested_amount for r in results] == [120.0, 450.0, 3000.0]
+    assert analyzer.usage.report()["batch"]["invoices"] == 3
+
+
+@pytest.mark.parametrize("reply", [
+    json.dumps([batch_item(0), batch_item(1)]),
+    "not json at all",
+])
+def test_malformed_batch_falls_back_to_single_calls(reply):
+    llm = ScriptedChatModel(reply)
+    analyzer = make_analyzer(llm)
+
+    results = asyncio.run(analyzer.aanalyze_batch("policy", BILLS))
+
+    assert llm.batch_calls == 1
+    assert llm.single_calls == 3
+    assert [r.category for r in results] == ["Food", "Cab", "Accommodation"]
+    assert all(r.status == ReimbursementStatus.FULLY for r in results)
+    usage = analyzer.usage.report()
+    assert usage["batch"]["invoices"] == 0
+    assert usage["single"]["invoices"] == 3
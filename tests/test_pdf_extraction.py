@@ -0,0 +1,61 @@
+import threading
+
+from app.services.pdf_extraction import PDFBackend, PDFExtractionEngine
+
+
+class RecordingBackend(PDFBackend):
+    """In-memory "document" of numbered pages that records the threads reading it"""
+    name = "recording"
+
+    def __init__(self, pages: int, releases_gil: bool):
+        self.pages = pages
+        self.releases_gil = releases_gil
+        self.opened = 0
+        self.threads = set()
+
+    def open(self, data: bytes):
+        self.opened += 1
+        return data
+
+    def page_count(self, document) -> int:
+        return self.pages
+
+    def page_text(self, document, page_number: int, layout: bool = False) -> str:
+        self.threads.add(threading.get_ident())
+        return f"page {page_number}\n"
+
+
+def extract(backend: RecordingBackend):
+    return PDFExtractionEngine(backend, parallel_threshold=4, max_workers=4).extract(b"%PDF")
+
+
+def test_gil_bound_backends_read_pages_in_one_pass():
+    backend = RecordingBackend(pages=20, releases_gil=False)
+    result = extract(backend)
+    assert backend.opened == 1
+    assert backend.threads == {threading.get_ident()}
+    assert result.text.splitlines() == [f"page {i}" for i in range(20)]
+
+
+def test_gil_releasing_backends_split_pages_across_threads():
+    backend = RecordingBackend(pages=20, releases_gil=True)
+    result = extract(backend)
+    # One handle for the page count plus one per page range
+    assert backend.opened == 5
+    assert result.text.splitlines() == [f"page {i}" for i in range(20)]
+    assert len(result.page_timings_ms) == 20
+
+
+def test_pdf_executor_starts_workers_without_forking(monkeypatch):
+    from app.services import resources
+    from app.services.pdf_processor import extract_pdf_from_bytes
+    from benchmarks.synthetic import write_pdf
+
+    monkeypatch.setattr(resources, "PIPELINE_WORKERS", 1)
+    executor = resources.get_pdf_executor()
+    try:
+        assert executor._mp_context.get_start_method() == "spawn"
+        result = executor.submit(extract_pdf_from_bytes, write_pdf(["Cafe", "Total: 100"])).result(timeout=60)
+        assert "Total: 100" in result.text
+    finally:
+        resources.reset()
@@ -0,0 +1,131 @@
+import io
+import zipfile
+
+import pytest
+
+from app.services.pdf_processor import ZipLimitError, iter_zip_invoices, list_zip_invoices
+from benchmarks.synthetic import write_pdf
+
+
+def make_zip(members, compression=zipfile.ZIP_STORED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def invoice_zip(count):
+    return make_zip([(f"invoice_{i}.pdf", write_pdf([f"Invoice {i}", f"Total: Rs. {100 * (i + 1)}"]))
+                     for i in range(count)])
+
+
+class NonSeekable(io.RawIOBase):
+    """Upload stream that can only be read forward, like a request body"""
+
+    def __init__(self, data):
+        self._inner = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, buffer):
+        data = self._inner.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def test_yields_pdfs_in_listing_order_and_ignores_other_members():
+    archive = make_zip([
+        ("invoice_0.pdf", write_pdf(["Invoice 0"])),
+        ("notes.txt", b"not an invoice"),
+        ("nested/", b""),
+        ("nested/invoice_1.pdf", write_pdf(["Invoice 1"])),
+    ])
+
+    names = [name for name, _ in iter_zip_invoices(archive)]
+
+    assert names == ["invoice_0.pdf", "nested/invoice_1.pdf"]
+    assert list_zip_invoices(archive) == names
+
+
+def test_yielded_streams_hold_the_member_bytes():
+    pdf = write_pdf(["Invoice 0", "Total: Rs. 100"])
+
+    (name, stream), = iter_zip_invoices(make_zip([("invoice_0.pdf", pdf)]))
+
+    assert stream.read() == pdf
+
+
+def test_skip_offsets_are_not_yielded():
+    names = [name for name, _ in iter_zip_invoices(invoice_zip(4), skip={0, 2})]
+
+    assert names == ["invoice_1.pdf", "invoice_3.pdf"]
+
+
+def test_skip_positions_count_only_pdfs():
+    archive = make_zip([
+        ("readme.txt", b"skip me"),
+        ("invoice_0.pdf", write_pdf(["Invoice 0"])),
+        ("invoice_1.pdf", write_pdf(["Invoice 1"])),
+    ])
+
+    assert [name for name, _ in iter_zip_invoices(archive, skip={0})] == ["invoice_1.pdf"]
+
+
+def test_oversized_member_rejected():
+    archive = make_zip([("invoice_0.pdf", write_pdf(["Invoice 0"])),
+                        ("huge.pdf", b"%PDF-1.4\n" + b"x" * 4096)])
+
+    with pytest.raises(ZipLimitError, match=r"huge.pdf is \d+ bytes \(limit 2048\)"):
+        list(iter_zip_invoices(archive, max_member_size=2048))
+
+
+def test_member_count_limit():
+    with pytest.raises(ZipLimitError, match=r"ZIP contains 3 PDFs \(limit 2\)"):
+        list(iter_zip_invoices(invoice_zip(3), max_members=2))
+
+    assert len(list(iter_zip_invoices(invoice_zip(2), max_members=2))) == 2
+
+
+def test_non_pdf_members_do_not_count_towards_limit():
+    archive = make_zip([(f"note_{i}.txt", b"x") for i in range(5)] + [("invoice_0.pdf", write_pdf(["Invoice 0"]))])
+
+    assert [name for name, _ in iter_zip_invoices(archive, max_members=1)] == ["invoice_0.pdf"]
+
+
+def test_total_size_limit():
+    archive = invoice_zip(3)
+    sizes = [info.file_size for info in zipfile.ZipFile(archive).infolist()]
+    archive.seek(0)
+
+    with pytest.raises(ZipLimitError, match="total size|bytes of PDFs"):
+        list(iter_zip_invoices(archive, max_total_size=sum(sizes) - 1))
+
+
+def test_compression_ratio_bomb_rejected():
+    archive = make_zip([("bomb.pdf", b"\0" * (1024 * 1024))], compression=zipfile.ZIP_DEFLATED)
+
+    with pytest.raises(ZipLimitError, match="bomb.pdf has a suspicious compression ratio"):
+        list(iter_zip_invoices(archive))
+
+
+def test_limits_checked_before_anything_is_yielded():
+    archive = make_zip([("invoice_0.pdf", write_pdf(["Invoice 0"])),
+                        ("bomb.pdf", b"\0" * (1024 * 1024))], compression=zipfile.ZIP_DEFLATED)
+    invoices = iter_zip_invoices(archive)
+
+    with pytest.raises(ZipLimitError):
+        next(invoices)
+
+
+def test_non_seekable_upload_is_spooled():
+    data = invoice_zip(2).getvalue()
+
+    names = [name for name, _ in iter_zip_invoices(NonSeekable(data), spool_max_memory=16)]
+
+    assert names == ["invoice_0.pdf", "invoice_1.pdf"]
@@ -0,0 +1,99 @@
+import asyncio
+
+from app.models.schemas import AnalysisResult, ReimbursementStatus
+from app.services.pipeline import InvoicePipeline, stream_analysis_records, summarize_results
+from benchmarks.synthetic import write_pdf
+
+
+class FakeAnalyzer:
+    async def aanalyze_invoice(self, policy, invoice_text, bypass_cache=False):
+        return AnalysisResult(category="Food", status=ReimbursementStatus.FULLY,
+                              reimbursed_amount=100.0, requested_amount=100.0, reason="Within limit",
+                              policy_references=[])
+
+
+class FakeVectorStore:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.stored = []
+
+    def store_analyses_bulk(self, writes, batch_size=None):
+        if self.fail:
+            raise RuntimeError("disk full")
+        self.stored.extend(write["invoice_id"] for write in writes)
+
+
+def invoices(count: int):
+    return [(f"invoice_{i}.pdf", write_pdf([f"Cafe {i}", "Coffee 100", "Total: 100"])) for i in range(count)]
+
+
+def collect(agen):
+    async def run():
+        return [record async for record in agen]
+    return asyncio.run(run())
+
+
+def test_stream_results_and_summary_agree():
+    pipeline = InvoicePipeline(FakeAnalyzer(), FakeVectorStore(), max_workers=2, write_batch_size=2)
+    records = collect(stream_analysis_records(pipeline, "policy", invoices(3), "Asha"))
+
+    assert [r["type"] for r in records] == ["result"] * 3 + ["summary"]
+    assert sorted(r["index"] for r in records[:-1]) == [0, 1, 2]
+    assert records[-1] == {"type": "summary", "processed_invoices": 3, "failed_invoices": 0,
+                           "duplicate_invoices": 0, "total_reimbursed": 300.0}
+
+
+def test_storage_failure_after_result_sends_update():
+    pipeline = InvoicePipeline(FakeAnalyzer(), FakeVectorStore(fail=True), max_workers=2, write_batch_size=4)
+    records = collect(stream_analysis_records(pipeline, "policy", invoices(2), "Asha"))
+
+    results = [r for r in records if r["type"] == "result"]
+    updates = [r for r in records if r["type"] == "result_update"]
+    # Results went out before the write; each is corrected once it failed
+    assert [r["status"] for r in results] == [ReimbursementStatus.FULLY.value] * 2
+    assert sorted(r["index"] for r in updates) == [0, 1]
+    assert all(r["status"] == "Failed" and "disk full" in r["reason"] for r in updates)
+    assert records[-1]["processed_invoices"] == 0
+    assert records[-1]["failed_invoices"] == 2
+    assert records[-1]["total_reimbursed"] == 0
+
+
+def test_durable_stream_yields_each_invoice_once_after_its_write():
+    pipeline = InvoicePipeline(FakeAnalyzer(), FakeVectorStore(fail=True), max_workers=2, write_batch_size=4)
+    records = collect(pipeline.stream("policy", invoices(2), "Asha", durable=True))
+
+    assert sorted(r["index"] for r in records) == [0, 1]
+    assert {r["status"] for r in records} == {"Failed"}
+
+
+def test_run_returns_final_status_in_zip_order():
+    pipeline = InvoicePipeline(FakeAnalyzer(), FakeVectorStore(fail=True), max_workers=2)
+    results = asyncio.run(pipeline.run("policy", invoices(3), "Asha"))
+
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert summarize_results(results)["failed_invoices"] == 3
+
+
+def metric(name: str) -> float:
+    from app.services import telemetry
+
+    for line in telemetry.REGISTRY.render().splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return 0.0
+
+
+def test_truncated_invoice_carries_a_warning_and_page_metrics(monkeypatch):
+    from app.services import pdf_extraction
+
+    monkeypatch.setattr(pdf_extraction, "_default_engine", pdf_extraction.PDFExtractionEngine(max_pages=1))
+    pages, truncated = metric("pdf_page_extract_seconds_count"), metric("pdf_truncated_total")
+    long_invoice = write_pdf([f"Line {i}" for i in range(120)])
+    pipeline = InvoicePipeline(FakeAnalyzer(), FakeVectorStore(), max_workers=1)
+
+    results = asyncio.run(pipeline.run("policy", [("long.pdf", long_invoice), ("short.pdf", invoices(1)[0][1])],
+                                       "Asha"))
+    assert results[0]["warnings"] == ["Only the first 1 of 3 pages were read (PDF_MAX_PAGES)"]
+    assert "warnings" not in results[1]
+    assert metric("pdf_page_extract_seconds_count") == pages + 2
+    assert metric("pdf_truncated_total") == truncated + 1
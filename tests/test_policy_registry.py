@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from app.services.policy_registry import PolicyRegistry, build_policy_document, parse_policy_rules
+
+EXAMPLE_POLICY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "examples", "test_policy.pdf")
+
+
+@pytest.fixture(scope="module")
+def policy():
+    with open(EXAMPLE_POLICY, "rb") as f:
+        return PolicyRegistry().get_or_parse(f.read())
+
+
+def clause(policy, fragment):
+    return next(c for c in policy.clauses if fragment in c.text)
+
+
+def test_example_policy_limits(policy):
+    assert [(rule.category, rule.limit, rule.unit) for rule in policy.rules] == [
+        ("Food", 200.0, "meal"), ("Travel", 2000.0, "trip"), ("Cab", 150.0, "day"),
+        ("Accommodation", 50.0, "night"),
+    ]
+
+
+@pytest.mark.parametrize("fragment, kind, category", [
+    ("excluding taxes and fees", "condition", "Accommodation"),
+    ("company-approved hotels", "condition", "Accommodation"),
+    ("meals is allowed when traveling for work", "condition", "Food"),
+    ("work-related travel only", "condition", "Travel"),
+    ("depending on the location", "condition", "Travel"),
+    ("original receipts", "condition", None),
+    ("Alcoholic beverages are not reimbursable", "exclusion", "Food"),
+    ("personal reasons will not be reimbursed", "exclusion", "Travel"),
+])
+def test_example_policy_clauses_are_kept_verbatim(policy, fragment, kind, category):
+    found = clause(policy, fragment)
+    assert (found.kind, found.category) == (kind, category)
+    assert found.text in policy.compact_text
+
+
+def test_example_policy_compact_text_is_smaller_than_raw(policy):
+    assert policy.compact_text != policy.text
+    assert policy.compact_token_count <= policy.token_count / 2
+    assert policy.exclusions == [c.text for c in policy.clauses if c.kind == "exclusion"]
+
+
+def test_short_policy_is_sent_verbatim():
+    text = "Meals up to ₹300 per meal, only on client visits. Alcohol is not reimbursable."
+    policy = build_policy_document("hash", text)
+    assert policy.rules[0].limit == 300.0
+    assert policy.compact_text == text
+
+
+def test_policy_without_exclusions_gets_the_defaults():
+    _, clauses = parse_policy_rules("Food: ₹250 per meal")
+    assert [(c.kind, c.category) for c in clauses] == [("exclusion", "Food"), ("exclusion", "Cab")]
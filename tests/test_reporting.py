@@ -0,0 +1,102 @@
+import pytest
+
+from app.services.reporting import VALUES_BATCH_LIMIT, ReportingStore
+
+ROWS = [
+    ("inv-1", "Asha", "Fully Reimbursed", "Food", 300.0, 300.0, "2024-01-05T09:00:00"),
+    ("inv-2", "Asha", "Partially Reimbursed", "Cab", 900.0, 800.0, "2024-01-20T18:30:00"),
+    ("inv-3", "Ravi", "Declined", "Food", 250.0, 0.0, "2024-02-02T12:00:00"),
+    ("inv-4", "Ravi", "Fully Reimbursed", "Travel", 4000.0, 4000.0, "2024-02-14T07:15:00"),
+    ("inv-5", "Asha", "Fully Reimbursed", "Food", 100.0, 100.0, "2024-02-28T20:00:00"),
+]
+
+
+@pytest.fixture
+def reporting(tmp_path):
+    store = ReportingStore(str(tmp_path / "reporting.duckdb"))
+    store.upsert(ROWS)
+    yield store
+    store.close()
+
+
+def by(rows, *keys):
+    return {tuple(row[key] for key in keys): row for row in rows}
+
+
+def test_grouped_totals(reporting):
+    rows = by(reporting.aggregate(["employee", "category"])["rows"], "employee", "category")
+
+    assert set(rows) == {("Asha", "Cab"), ("Asha", "Food"), ("Ravi", "Food"), ("Ravi", "Travel")}
+    assert rows["Asha", "Food"]["invoices"] == 2
+    assert rows["Asha", "Food"]["requested_total"] == 400.0
+    assert rows["Asha", "Food"]["reimbursed_total"] == 400.0
+    assert rows["Asha", "Cab"]["reimbursed_total"] == 800.0
+    assert rows["Ravi", "Food"]["reimbursed_total"] == 0.0
+
+
+def test_totals_by_month_with_percentiles(reporting):
+    result = reporting.aggregate(["month"], percentiles=[0.5])
+
+    assert [row["month"] for row in result["rows"]] == ["2024-01-01", "2024-02-01"]
+    january, february = result["rows"]
+    assert (january["invoices"], january["reimbursed_total"]) == (2, 1100.0)
+    assert (february["invoices"], february["reimbursed_total"]) == (3, 4100.0)
+    assert february["reimbursed_amount_avg"] == pytest.approx(4100.0 / 3)
+    assert february["reimbursed_amount_p50"] == 100.0
+
+
+def test_filters_narrow_the_totals(reporting):
+    total = reporting.aggregate(filters={"employee": "Asha", "date_from": "2024-01-10"})["rows"]
+    assert (total[0]["invoices"], total[0]["reimbursed_total"]) == (2, 900.0)
+
+    declined = reporting.aggregate(["employee"], filters={"status": "declined"})["rows"]
+    assert [(row["employee"], row["invoices"]) for row in declined] == [("Ravi", 1)]
+
+    inclusive = reporting.aggregate(filters={"date_to": "2024-01-20"})["rows"]
+    assert inclusive[0]["invoices"] == 2
+
+
+def test_upsert_replaces_rows_by_invoice_id(reporting):
+    reporting.upsert([("inv-3", "Ravi", "Fully Reimbursed", "Food", 250.0, 250.0, "2024-02-02T12:00:00")])
+
+    assert reporting.count() == len(ROWS)
+    rows = by(reporting.aggregate(["employee"])["rows"], "employee")
+    assert rows["Ravi",]["reimbursed_total"] == 4250.0
+
+
+def test_large_batches_load_through_csv(tmp_path):
+    store = ReportingStore(str(tmp_path / "bulk.duckdb"))
+    rows = [(f"inv-{i}", f"emp-{i % 3}", "Fully Reimbursed", "Food", 10.0, 10.0, "2024-03-01T10:00:00")
+            for i in range(VALUES_BATCH_LIMIT + 100)]
+    store.upsert(rows)
+
+    totals = by(store.aggregate(["employee"])["rows"], "employee")
+    assert sum(row["invoices"] for row in totals.values()) == len(rows)
+    assert totals["emp-0",]["reimbursed_total"] == 10.0 * len(range(0, len(rows), 3))
+    store.close()
+
+
+def test_rejects_unknown_dimensions_and_filters(reporting):
+    with pytest.raises(ValueError):
+        reporting.aggregate(["invoice_id"])
+    with pytest.raises(ValueError):
+        reporting.aggregate(filters={"reason": "x"})
+    with pytest.raises(ValueError):
+        reporting.aggregate(percentiles=[1.5])
+
+
+def test_attached_mirror_follows_vector_store_writes(tmp_path, make_vector_store, analysis):
+    vector_store = make_vector_store()
+    vector_store.store_analysis("existing", "Invoice existing", analysis(150.0), "Asha")
+    reporting = ReportingStore(str(tmp_path / "mirror.duckdb"))
+
+    reporting.attach(vector_store)
+    vector_store.store_analysis("new-1", "Invoice new-1", analysis(200.0), "Asha")
+    vector_store.store_analysis("new-2", "Invoice new-2", analysis(50.0), "Ravi")
+    vector_store.store_analysis("new-1", "Invoice new-1", analysis(250.0), "Asha")
+
+    rows = by(reporting.aggregate(["employee", "category"])["rows"], "employee", "category")
+    assert rows["Asha", "Food"]["invoices"] == 2
+    assert rows["Asha", "Food"]["reimbursed_total"] == 400.0
+    assert rows["Ravi", "Food"]["reimbursed_total"] == 50.0
+    reporting.close()
@@ -0,0 +1,52 @@
+import time
+
+from app.services.response_cache import SQLiteCacheBackend
+
+
+def deletes(backend: SQLiteCacheBackend) -> list:
+    statements = []
+    backend._conn.set_trace_callback(lambda sql: statements.append(sql) if sql.startswith("DELETE") else None)
+    return statements
+
+
+def test_sqlite_backend_evicts_least_recently_used_only_when_full(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_entries=3)
+    statements = deletes(backend)
+    for i in range(3):
+        backend.set(f"k{i}", {"i": i})
+        time.sleep(0.001)
+    backend.set("k0", {"i": 0})
+    assert backend.get("k1") == {"i": 1}
+    assert statements == []
+
+    backend.set("k3", {"i": 3})
+    assert len(backend) == 3
+    # k2 is the least recently used: k0 was rewritten and k1 read since
+    assert backend.get("k2") is None
+    assert [backend.get(key) is not None for key in ("k0", "k1", "k3")] == [True, True, True]
+
+
+def test_sqlite_backend_counts_rows_written_by_other_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = SQLiteCacheBackend(path, max_entries=2), SQLiteCacheBackend(path, max_entries=2)
+    first.set("a", {})
+    time.sleep(0.001)
+    first.set("b", {})
+    time.sleep(0.001)
+    # The second instance's own estimate only reaches the limit after its third write;
+    # it then recounts the table and trims everything beyond the two newest rows
+    for key in ("c", "d", "e"):
+        second.set(key, {})
+        time.sleep(0.001)
+    assert len(second) == 2
+    assert [first.get(key) is not None for key in "abcde"] == [False, False, False, True, True]
+
+
+def test_sqlite_backend_expired_rows_are_dropped_on_eviction(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_entries=2, ttl_seconds=0.05)
+    backend.set("old", {})
+    time.sleep(0.06)
+    backend.set("new", {})
+    backend.set("newer", {})
+    assert len(backend) == 2
+    assert backend.get("new") == {} and backend.get("newer") == {}
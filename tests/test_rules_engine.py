@@ -0,0 +1,126 @@
+import pytest
+
+from app.models.schemas import PolicyRule, ReimbursementStatus
+from app.services.rules_engine import RuleEngine, extract_total_amount
+
+RULES = [
+    PolicyRule(category="Food", limit=1000.0, unit="meal"),
+    PolicyRule(category="Cab", limit=2000.0, unit="day"),
+]
+
+
+def cab_bill(total_line: str) -> str:
+    return "\n".join(["City Cab ride", "Driver: Ravi", "Pickup: Airport", "Drop: MG Road",
+                      "Base fare ₹1,000.00", "GST ₹180.00", total_line, "Thank you"])
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Total ₹1,180.00", 1180.0),
+    ("Total: Rs. 1133.00", 1133.0),
+    ("GRAND TOTAL: ₹ 770", 770.0),
+    ("Amount Payable INR 1,00,000.50", 100000.5),
+    ("Total Amount - ₹12,345", 12345.0),
+    ("  total:₹99.9  ", 99.9),
+])
+def test_total_line_amounts(text, expected):
+    assert extract_total_amount(f"Some Restaurant\n{text}\nThanks") == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Sub Total: ₹700.00\nSGST ₹4.50",           # no total line
+    "Total:\n770.00",                           # amount not on the total line
+    "Total ₹700.00\nGrand Total ₹770.00",       # two candidates
+    "Total Items: 3",
+    "Total ₹1,2345.00",                         # malformed grouping
+])
+def test_missing_or_ambiguous_totals(text):
+    assert extract_total_amount(text) is None
+
+
+def test_comma_grouped_total_is_read_in_full():
+    result = RuleEngine(RULES).evaluate(cab_bill("Total ₹1,180.00"))
+    assert result is not None
+    assert result.status == ReimbursementStatus.FULLY
+    assert result.reimbursed_amount == result.requested_amount == 1180.0
+
+
+def test_comma_grouped_total_over_the_limit_goes_to_the_llm():
+    rules = [PolicyRule(category="Cab", limit=150.0, unit="day")]
+    assert RuleEngine(rules).evaluate(cab_bill("Total ₹1,180.00")) is None
+
+
+def test_tax_line_after_the_total_is_not_taken_as_the_total():
+    meal = "\n".join(["Spice Restaurant", "Table No.: 4", "2 Veg Thali ₹320.00", "Sub Total ₹320.00",
+                      "Total ₹329.00", "CGST ₹4.50", "SGST ₹4.50"])
+    result = RuleEngine(RULES).evaluate(meal)
+    assert result is not None and result.reimbursed_amount == 329.0
+
+
+@pytest.mark.parametrize("total_lines", ["Sub Total ₹320.00\nSGST ₹4.50", "Total ₹300\nTotal ₹320"])
+def test_no_single_total_line_falls_through(total_lines):
+    meal = "\n".join(["Spice Restaurant", "Table No.: 4", "2 Veg Thali ₹320.00", total_lines])
+    engine = RuleEngine(RULES)
+    assert engine.evaluate(meal) is None
+    assert engine.stats()["fallthrough"] == 1
+
+
+def test_judgement_items_fall_through():
+    meal = "\n".join(["Spice Restaurant", "Table No.: 4", "1 Beer ₹300.00", "Total ₹300.00"])
+    assert RuleEngine(RULES).evaluate(meal) is None
+
+
+def policy(text: str):
+    from app.services.policy_registry import build_policy_document
+
+    return build_policy_document("hash", text)
+
+
+def meal_bill() -> str:
+    return "\n".join(["Spice Restaurant", "Table No.: 4", "Lunch menu", "2 Veg Thali ₹320.00", "Total ₹320.00"])
+
+
+LIMITS = "Food: ₹1000 per meal. Cab: ₹2000 per day."
+
+
+def test_condition_on_the_category_sends_the_invoice_to_the_llm():
+    document = policy(LIMITS + " Meals are reimbursable only during client visits.")
+    engine = RuleEngine()
+    assert engine.evaluate(meal_bill(), document) is None
+    # Cab has no condition, so clear cab bills are still resolved
+    assert engine.evaluate(cab_bill("Total ₹1,180.00"), document) is not None
+
+
+def test_exclusion_the_engine_cannot_check_sends_the_invoice_to_the_llm():
+    document = policy(LIMITS + " Airport surcharges on cab rides will not be reimbursed.")
+    assert RuleEngine().evaluate(cab_bill("Total ₹1,180.00"), document) is None
+    assert RuleEngine().evaluate(meal_bill(), document) is not None
+
+
+def test_checkable_exclusions_do_not_block_clean_invoices():
+    document = policy(LIMITS + " Alcoholic beverages are not reimbursable with meals.")
+    assert RuleEngine().evaluate(meal_bill(), document).status == ReimbursementStatus.FULLY
+
+
+def test_example_policy_leaves_conditioned_categories_to_the_llm():
+    from tests.test_policy_registry import EXAMPLE_POLICY
+    from app.services.policy_registry import PolicyRegistry
+
+    with open(EXAMPLE_POLICY, "rb") as f:
+        document = PolicyRegistry().get_or_parse(f.read())
+    cheap_meal = meal_bill().replace("320.00", "180.00")
+    assert RuleEngine().evaluate(cheap_meal, document) is None
+    assert RuleEngine().evaluate(cab_bill("Total ₹120.00"), document) is not None
+
+
+def test_bypass_cache_skips_the_rules_stage():
+    import asyncio
+
+    from app.services.llm_service import InvoiceAnalyzer
+    from benchmarks.fakes import FakeChatModel
+
+    llm = FakeChatModel(latency=0, token_latency=0)
+    analyzer = InvoiceAnalyzer(rules=RuleEngine(RULES), llm=llm)
+    asyncio.run(analyzer.aanalyze_invoice("policy", meal_bill()))
+    assert llm.calls == 0
+    asyncio.run(analyzer.aanalyze_invoice("policy", meal_bill(), bypass_cache=True))
+    assert llm.calls == 1
@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services import telemetry
+
+
+def profiled_client(profile_dir):
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"ok": True}
+
+    return TestClient(telemetry.TelemetryMiddleware(app, profile_on_header=True, profile_dir=str(profile_dir)))
+
+
+def test_request_id_is_echoed(tmp_path):
+    response = profiled_client(tmp_path).get("/ping", headers={"X-Request-ID": "req_1-a"})
+    assert response.headers["x-request-id"] == "req_1-a"
+
+
+@pytest.mark.parametrize("request_id", ["../../escaped", "/tmp/absolute", "a b", "x" * 65, "..", ""])
+def test_unsafe_request_ids_are_replaced_and_profiles_stay_in_profile_dir(tmp_path, request_id):
+    profile_dir = tmp_path / "data" / "profiles"
+    response = profiled_client(profile_dir).get("/ping", headers={"X-Request-ID": request_id, "X-Profile": "1"})
+    cid = response.headers["x-request-id"]
+    assert cid != request_id
+    assert telemetry.CORRELATION_ID_PATTERN.fullmatch(cid)
+    assert os.listdir(profile_dir) == [f"{cid}.folded"]
+    assert not (tmp_path / "escaped.folded").exists()
+
+
+def test_profile_path_rejects_traversal(tmp_path):
+    assert telemetry.profile_path(str(tmp_path), "abc") == os.path.join(os.path.realpath(tmp_path), "abc.folded")
+    for cid in ("../x", "/etc/passwd", "a/b"):
+        with pytest.raises(ValueError):
+            telemetry.profile_path(str(tmp_path), cid)
+
+
+def test_traced_records_spans_under_the_correlation_id():
+    @telemetry.traced("unit_stage")
+    def stage():
+        return 42
+
+    token = telemetry.correlation_id.set("trace-unit")
+    try:
+        assert stage() == 42
+    finally:
+        telemetry.correlation_id.reset(token)
+    assert [span["span"] for span in telemetry.trace("trace-unit")] == ["unit_stage"]
+
+
+def busy_invoice_parse(seconds: float) -> int:
+    deadline, total = time.perf_counter() + seconds, 0
+    while time.perf_counter() < deadline:
+        total += sum(range(200))
+    return total
+
+
+def test_sampling_profiler_captures_the_busy_function(tmp_path):
+    profiler = telemetry.SamplingProfiler.try_start(interval=0.001)
+    assert profiler is not None
+    try:
+        # Only one profiler runs at a time
+        assert telemetry.SamplingProfiler.try_start() is None
+        busy_invoice_parse(0.3)
+    finally:
+        samples = profiler.stop()
+
+    busy = {stack: count for stack, count in samples.items() if "busy_invoice_parse (test_telemetry.py:" in stack}
+    assert sum(busy.values()) >= 5
+    # Folded stacks run root first, so the caller precedes the busy frame
+    assert all(stack.index("test_sampling_profiler_captures_the_busy_function") < stack.index("busy_invoice_parse")
+               for stack in busy)
+    assert not any("sampling-profiler" in stack or "_run (telemetry.py" in stack for stack in samples)
+
+    lines = open(profiler.save(str(tmp_path / "profile.folded")), encoding="utf-8").read().splitlines()
+    assert len(lines) == len(samples)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    restarted = telemetry.SamplingProfiler.try_start()
+    assert restarted is not None
+    restarted.stop()
@@ -0,0 +1,149 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.services.dedup import DedupIndex, invoice_id_for
+from app.services.text_utils import sha256_bytes
+from app.services.vector_store import ChromaPathInUseError, claim_chroma_path
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Mirror:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.ids = set()
+        self.resyncs = 0
+
+    def on_write(self, ids, documents, metadatas, reset):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("mirror down")
+        if reset:
+            self.ids.clear()
+        self.ids.update(ids)
+
+    def resync(self, store):
+        self.resyncs += 1
+        self.ids = set(store.collection.get(include=[])["ids"])
+
+
+def store_one(store, analysis, invoice_id: str) -> None:
+    store.store_analysis(invoice_id, f"Invoice {invoice_id}", analysis(), "Asha")
+
+
+def test_failing_listener_does_not_fail_write_or_other_listeners(make_vector_store, analysis):
+    store = make_vector_store()
+    broken, healthy = Mirror(failures=1), Mirror()
+    store.add_listener(broken.on_write, resync=broken.resync)
+    store.add_listener(healthy.on_write, resync=healthy.resync)
+
+    store_one(store, analysis, "inv-1")
+    assert store.collection.count() == 1
+    assert healthy.ids == {"inv-1"}
+    assert broken.ids == set()
+
+    # The broken mirror is rebuilt from the collection before the next write reaches it
+    store_one(store, analysis, "inv-2")
+    assert broken.resyncs == 1
+    assert broken.ids == {"inv-1", "inv-2"}
+    assert store.resync_listeners() == 0
+
+
+def test_restore_with_replace_clears_attached_dedup_index(make_vector_store, analysis, tmp_path):
+    source = make_vector_store("source")
+    store_one(source, analysis, "inv-kept")
+    snapshot = str(tmp_path / "snapshot.jsonl.gz")
+    source.snapshot(snapshot)
+
+    store = make_vector_store("target")
+    dedup = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    dedup.attach(store)
+    byte_hash = sha256_bytes(b"stale invoice")
+    assert dedup.check_bytes(byte_hash, "stale.pdf") is None
+    assert dedup.check_text(byte_hash, "Stale invoice total 100") is None
+    store.store_analysis(invoice_id_for(byte_hash), "Stale invoice total 100", analysis(), "Asha")
+    dedup.commit([{"byte_hash": byte_hash, "status": "Fully Reimbursed", "reimbursed_amount": 100.0}])
+    assert len(dedup) == 1
+
+    store.restore(snapshot, replace=True)
+    assert len(dedup) == 0
+    assert dedup.check_bytes(byte_hash, "stale.pdf") is None
+
+
+def test_attach_reconciles_fingerprints_against_collection_ids(make_vector_store, analysis, tmp_path):
+    store = make_vector_store()
+    dedup = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    kept, dropped = sha256_bytes(b"kept"), sha256_bytes(b"dropped")
+    for byte_hash, text in ((kept, "Kept invoice total 100"), (dropped, "Dropped invoice total 200")):
+        dedup.check_bytes(byte_hash, f"{byte_hash}.pdf")
+        dedup.check_text(byte_hash, text)
+        dedup.commit([{"byte_hash": byte_hash, "status": "Fully Reimbursed", "reimbursed_amount": 100.0}])
+    store.store_analysis(invoice_id_for(kept), "Kept invoice total 100", analysis(), "Asha")
+
+    # The collection is not empty, but only one fingerprint still has its invoice
+    dedup.attach(store)
+    assert len(dedup) == 1
+    assert dedup.check_bytes(kept, "again.pdf")["invoice_id"] == invoice_id_for(kept)
+    assert dedup.check_bytes(dropped, "again.pdf") is None
+
+
+def hold_chroma_path(path: str) -> subprocess.Popen:
+    """Start a process that claims ``path`` and keeps it until killed"""
+    holder = subprocess.Popen(
+        [sys.executable, "-c", "import sys, time\nfrom app.services.vector_store import claim_chroma_path\n"
+                               f"claim_chroma_path({path!r})\nprint('ready', flush=True)\ntime.sleep(30)"],
+        stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(path),
+        env={**os.environ, "PYTHONPATH": REPO_ROOT}
+    )
+    assert holder.stdout.readline().strip() == "ready"
+    return holder
+
+
+def test_local_chroma_path_is_served_by_one_process(tmp_path):
+    path = str(tmp_path / "chroma")
+    holder = hold_chroma_path(path)
+    try:
+        with pytest.raises(ChromaPathInUseError, match=f"pid {holder.pid}"):
+            claim_chroma_path(path)
+    finally:
+        holder.kill()
+        holder.wait()
+
+    claim_chroma_path(path)
+    # Claims are per process, so this process can open the directory again
+    claim_chroma_path(path)
+
+
+def test_cached_results_expire_so_other_writers_become_visible(make_vector_store, analysis, tmp_path):
+    from app.services import vector_store
+
+    reader = vector_store.VectorStore(persist_path=str(tmp_path / "shared"), search_cache_ttl=0.2)
+    writer = make_vector_store("shared")
+    store_one(writer, analysis, "inv-1")
+    assert [hit["id"] for hit in reader.search(None, n_results=10)] == ["inv-1"]
+
+    # The reader's generation did not move, so its cached list is stale until it expires
+    store_one(writer, analysis, "inv-2")
+    assert len(reader.search(None, n_results=10)) == 1
+    time.sleep(0.25)
+    assert {hit["id"] for hit in reader.search(None, n_results=10)} == {"inv-1", "inv-2"}
+
+
+def test_reembed_refuses_a_directory_served_by_another_process(tmp_path, monkeypatch):
+    from app import cli
+    from app.services import resources
+
+    path = str(tmp_path / "chroma")
+    monkeypatch.setattr(resources, "CHROMA_PATH", path)
+    monkeypatch.setattr(resources, "CHROMA_HOST", None)
+    holder = hold_chroma_path(path)
+    try:
+        with pytest.raises(ChromaPathInUseError):
+            cli.main(["reembed"])
+    finally:
+        holder.kill()
+        holder.wait()